@@ -0,0 +1,384 @@
+"""
+AV 控制集成：在 HA 的事件循环中直接发送 TCP 命令和 RS232 数据。
+
+与 shell_command.send_cmd / send_rs232_command 相比，每次操作不再启动一个 Python 进程，
+也不受 shell_command 的超时和并发限制。服务的字段与 scripts.yaml 中的
+send_tcp_command_script / send_rs232_data_script 相同，设备的响应作为服务响应数据返回::
+
+    - service: av_control.send_tcp_command
+      data:
+        ip_address: 192.168.3.116
+        port_number: 4001
+        command_string: "VOL?"
+        append_carriage_return: true
+      response_variable: result      # result.response_text / result.value / ...
+
+av_control.send_device_command 按设备档案（devices.yaml）发送具名命令，
+av_control.matrix_route / matrix_preset 切换矩阵（matrices.yaml，只发送变化的交叉点，交叉点缓存与命令行共用），
+仪表盘按钮和矩阵切换脚本经由它们发送，点击时不再启动 Python 进程。
+
+av_control.run_macro 按 macros.yaml 中的时间线运行多设备场景（见 scripts/macro_engine.py），
+同一互斥组中启动新的宏会取消正在运行的宏；av_control.cancel_macro 取消正在运行的宏。
+"""
+import codecs
+import logging
+import time
+
+import voluptuous as vol
+
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.typing import ConfigType
+
+from .const import (
+    ATTR_APPEND_CR,
+    ATTR_BAUDRATE,
+    ATTR_BROADCAST,
+    ATTR_BYTESIZE,
+    ATTR_COALESCE_KEY,
+    ATTR_COMMAND,
+    ATTR_COMMAND_STRING,
+    ATTR_CONNECT_TIMEOUT,
+    ATTR_DATA,
+    ATTR_DECODE,
+    ATTR_DEVICE,
+    ATTR_ENCODING,
+    ATTR_EXPECTED_LENGTH,
+    ATTR_FORCE,
+    ATTR_FRAMING,
+    ATTR_GROUP,
+    ATTR_INPUT,
+    ATTR_IP_ADDRESS,
+    ATTR_IS_HEX,
+    ATTR_MACRO,
+    ATTR_MATRIX,
+    ATTR_OUTPUT,
+    ATTR_PARITY,
+    ATTR_PORT,
+    ATTR_PORT_NUMBER,
+    ATTR_PRESET,
+    ATTR_READ_RESPONSE,
+    ATTR_READ_TIMEOUT,
+    ATTR_REPLY_WINDOW,
+    ATTR_RESPONSE_MODE,
+    ATTR_SEND_AS_HEX,
+    ATTR_STOPBITS,
+    ATTR_TERMINATOR,
+    ATTR_TIMEOUT,
+    ATTR_TRANSPORT,
+    ATTR_WAIT,
+    DOMAIN,
+    SERVICE_CANCEL_MACRO,
+    SERVICE_MATRIX_PRESET,
+    SERVICE_MATRIX_ROUTE,
+    SERVICE_RUN_MACRO,
+    SERVICE_SEND_DEVICE_COMMAND,
+    SERVICE_SEND_RS232_DATA,
+    SERVICE_SEND_TCP_COMMAND,
+)
+
+# 收发逻辑与命令行脚本共用 scripts/ 下的模块（以 custom_components.av_control.scripts.<名称> 导入，见 scripts.py）
+from .scripts.device_profiles import ProfileError, get_profile, load_profiles
+from .scripts.framing import parse_framing
+from .scripts.macro_engine import MacroError, MacroRunner, check_references, get_macro, load_macros
+from .scripts.matrix_router import MatrixError, apply_routes, get_matrix, load_matrices
+from .scripts.response_decoders import DecodeError, DecoderSpecError, compile_decoder
+from .scripts.send_serial_data import RESPONSE_MODES, check_response_mode
+from .scripts.send_tcp_command import build_tcp_payload, hex_string_to_bytes
+from .transport import AsyncTransport
+
+_LOGGER = logging.getLogger(__name__)
+
+CONFIG_SCHEMA = cv.empty_config_schema(DOMAIN)
+
+SEND_TCP_COMMAND_SCHEMA = vol.Schema({
+    vol.Required(ATTR_IP_ADDRESS): cv.string,
+    vol.Required(ATTR_PORT_NUMBER): cv.port,
+    vol.Required(ATTR_COMMAND_STRING): cv.string,
+    vol.Optional(ATTR_APPEND_CR, default=False): cv.boolean,
+    vol.Optional(ATTR_SEND_AS_HEX, default=False): cv.boolean,
+    vol.Optional(ATTR_ENCODING, default="utf-8"): cv.string,
+    vol.Optional(ATTR_FRAMING, default="once"): cv.string,
+    vol.Optional(ATTR_READ_TIMEOUT, default=5): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(ATTR_CONNECT_TIMEOUT, default=5): vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+    vol.Optional(ATTR_TRANSPORT, default="tcp"): vol.In(["tcp", "udp"]),
+    vol.Optional(ATTR_REPLY_WINDOW): vol.All(vol.Coerce(float), vol.Range(min=0, max=30)),
+    vol.Optional(ATTR_BROADCAST, default=False): cv.boolean,
+    vol.Optional(ATTR_COALESCE_KEY): cv.string,
+    vol.Optional(ATTR_DECODE): vol.Any(cv.string, dict),
+})
+
+SEND_RS232_DATA_SCHEMA = vol.Schema({
+    vol.Required(ATTR_DATA): cv.string,
+    vol.Optional(ATTR_PORT, default="/dev/ttyS1"): cv.string,
+    vol.Optional(ATTR_BAUDRATE, default=9600): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(ATTR_BYTESIZE, default=8): vol.All(vol.Coerce(int), vol.In([5, 6, 7, 8])),
+    vol.Optional(ATTR_PARITY, default="N"): vol.In(["N", "E", "O", "M", "S"]),
+    vol.Optional(ATTR_STOPBITS, default=1.0): vol.All(vol.Coerce(float), vol.In([1.0, 1.5, 2.0])),
+    vol.Optional(ATTR_TIMEOUT, default=1.0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(ATTR_IS_HEX, default=False): cv.boolean,
+    vol.Optional(ATTR_READ_RESPONSE, default=False): cv.boolean,
+    vol.Optional(ATTR_ENCODING, default="ascii"): cv.string,
+    vol.Optional(ATTR_RESPONSE_MODE, default="sleep"): vol.In(RESPONSE_MODES),
+    vol.Optional(ATTR_TERMINATOR, default="\\r"): cv.string,
+    vol.Optional(ATTR_EXPECTED_LENGTH, default=0): vol.All(vol.Coerce(int), vol.Range(min=0)),
+    vol.Optional(ATTR_COALESCE_KEY): cv.string,
+    vol.Optional(ATTR_DECODE): vol.Any(cv.string, dict),
+})
+
+SEND_DEVICE_COMMAND_SCHEMA = vol.Schema({
+    vol.Required(ATTR_DEVICE): cv.string,
+    vol.Required(ATTR_COMMAND): cv.string,
+    vol.Optional(ATTR_READ_RESPONSE, default=True): cv.boolean,
+})
+
+MATRIX_ROUTE_SCHEMA = vol.Schema({
+    vol.Required(ATTR_MATRIX): cv.string,
+    vol.Required(ATTR_OUTPUT): cv.string,
+    vol.Required(ATTR_INPUT): cv.string,
+    vol.Optional(ATTR_FORCE, default=False): cv.boolean,
+})
+
+MATRIX_PRESET_SCHEMA = vol.Schema({
+    vol.Required(ATTR_MATRIX): cv.string,
+    vol.Required(ATTR_PRESET): cv.string,
+    vol.Optional(ATTR_FORCE, default=False): cv.boolean,
+})
+
+RUN_MACRO_SCHEMA = vol.Schema({
+    vol.Required(ATTR_MACRO): cv.string,
+    vol.Optional(ATTR_WAIT, default=True): cv.boolean,
+})
+
+CANCEL_MACRO_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_GROUP): cv.string,
+})
+
+
+def _response_data(result, encoding, decoder, started):
+    """把传输结果整理为服务响应数据。"""
+    response = result["response"]
+    data = {
+        "ok": True,
+        "response_hex": response.hex(" ").upper() if response else None,
+        "response_text": response.decode(encoding, errors="replace") if response else None,
+        "via": result["via"],
+        "superseded": result.get("superseded", False),
+        "suppressed": result.get("suppressed", False),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    if len(result.get("replies") or ()) > 1:
+        # 组播 / 广播目标：列出每台设备的应答
+        data["replies"] = [
+            {"from": source, "response_hex": reply.hex(" ").upper(),
+             "response_text": reply.decode(encoding, errors="replace")}
+            for source, reply in result["replies"]
+        ]
+    try:
+        fields = decoder.decode(response)
+    except DecodeError as e:
+        data["value"] = None
+        data["decode_error"] = str(e)
+        return data
+    # 与 device_poller.decode_value 相同：只有一个 value 字段时直接给出该值
+    if fields is not None and list(fields) == ["value"]:
+        data["value"] = fields["value"]
+    else:
+        data["value"] = None
+        if fields is not None:
+            data["fields"] = fields
+    return data
+
+
+def _load_profile(name):
+    """在线程池中读取设备档案（编译缓存有效时直接读取缓存，修改 devices.yaml 后无需重启 HA）。"""
+    return get_profile(load_profiles(), name)
+
+
+def _load_routes(name, preset=None, routes=None):
+    """在线程池中读取矩阵定义，返回矩阵和要切换的路由（预设或单个交叉点），并检查输出和输入都存在。"""
+    matrix = get_matrix(load_matrices(), name)
+    routes = matrix.preset(preset) if preset is not None else routes
+    matrix.validate_routes(routes)
+    return matrix, routes
+
+
+def _load_macro(name):
+    """在线程池中读取宏、设备档案和矩阵，并检查宏引用的设备命令和矩阵都存在（修改 yaml 后无需重启 HA）。"""
+    macros = load_macros()
+    profiles = load_profiles()
+    matrices = load_matrices()
+    macro = get_macro(macros, name)
+    check_references({name: macro}, profiles, matrices)
+    return macro, profiles, matrices
+
+
+def _log_report(report):
+    lines = [f"宏 '{report['macro']}': {report['status']}，总耗时 {report['elapsed_ms']} ms"]
+    for step in report["steps"]:
+        timing = (f"计划 {step['planned_ms']} ms，开始 {step['started_ms']} ms（偏差 {step['lag_ms']} ms），"
+                  f"耗时 {step['duration_ms']} ms" if "duration_ms" in step else f"计划 {step['planned_ms']} ms")
+        lines.append(f"  {step['id']}: {step['status']}，{timing}{'，' + step['error'] if step.get('error') else ''}")
+    _LOGGER.log(logging.INFO if report["status"] == "ok" else logging.WARNING, "\n".join(lines))
+
+
+def _decoder(call):
+    try:
+        return compile_decoder(call.data.get(ATTR_DECODE))
+    except DecoderSpecError as e:
+        raise ServiceValidationError(str(e)) from e
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """
+    注册 av_control.send_tcp_command、send_rs232_data、send_device_command、matrix_route、matrix_preset、
+    run_macro 和 cancel_macro 服务。
+    """
+    transport = hass.data[DOMAIN] = AsyncTransport(hass)
+    runner = MacroRunner()
+
+    async def send_tcp_command(call: ServiceCall) -> ServiceResponse:
+        started = time.perf_counter()
+        try:
+            framing = call.data[ATTR_FRAMING]
+            parse_framing(framing)
+            payload = build_tcp_payload(call.data[ATTR_COMMAND_STRING], call.data[ATTR_APPEND_CR],
+                                        call.data[ATTR_SEND_AS_HEX], call.data[ATTR_ENCODING], verbose=False)
+        except (ValueError, LookupError) as e:
+            raise ServiceValidationError(str(e)) from e
+        decoder = _decoder(call)
+        ip, port = call.data[ATTR_IP_ADDRESS], call.data[ATTR_PORT_NUMBER]
+        try:
+            result = await transport.send_tcp(
+                ip, port, payload,
+                connect_timeout=call.data[ATTR_CONNECT_TIMEOUT],
+                read_timeout=call.data[ATTR_READ_TIMEOUT],
+                framing=framing,
+                coalesce_key=call.data.get(ATTR_COALESCE_KEY),
+                transport=call.data[ATTR_TRANSPORT],
+                reply_window=call.data.get(ATTR_REPLY_WINDOW),
+                broadcast=call.data[ATTR_BROADCAST],
+            )
+        except OSError as e:
+            raise HomeAssistantError(f"发送到 {ip}:{port} 失败: {type(e).__name__}: {e}") from e
+        return _response_data(result, call.data[ATTR_ENCODING], decoder, started)
+
+    async def send_rs232_data(call: ServiceCall) -> ServiceResponse:
+        started = time.perf_counter()
+        encoding = call.data[ATTR_ENCODING]
+        try:
+            if call.data[ATTR_IS_HEX]:
+                payload = hex_string_to_bytes(call.data[ATTR_DATA])
+            else:
+                payload = call.data[ATTR_DATA].encode(encoding)
+            terminator = codecs.decode(call.data[ATTR_TERMINATOR], "unicode_escape").encode("latin-1")
+            check_response_mode(call.data[ATTR_RESPONSE_MODE], call.data[ATTR_EXPECTED_LENGTH])
+        except (ValueError, LookupError) as e:
+            raise ServiceValidationError(str(e)) from e
+        decoder = _decoder(call)
+        port = call.data[ATTR_PORT]
+        try:
+            result = await transport.send_serial(
+                payload, port,
+                baudrate=call.data[ATTR_BAUDRATE],
+                bytesize=call.data[ATTR_BYTESIZE],
+                parity=call.data[ATTR_PARITY],
+                stopbits=call.data[ATTR_STOPBITS],
+                timeout=call.data[ATTR_TIMEOUT],
+                read_response=call.data[ATTR_READ_RESPONSE],
+                response_mode=call.data[ATTR_RESPONSE_MODE],
+                terminator=terminator or b"\r",
+                expected_length=call.data[ATTR_EXPECTED_LENGTH],
+                coalesce_key=call.data.get(ATTR_COALESCE_KEY),
+            )
+        except OSError as e:
+            raise HomeAssistantError(f"串口 {port} 发送失败: {type(e).__name__}: {e}") from e
+        return _response_data(result, encoding, decoder, started)
+
+    async def send_device_command(call: ServiceCall) -> ServiceResponse:
+        started = time.perf_counter()
+        name, command = call.data[ATTR_DEVICE], call.data[ATTR_COMMAND]
+        try:
+            profile = await hass.async_add_executor_job(_load_profile, name)
+            profile.frame(command)
+        except ProfileError as e:
+            raise ServiceValidationError(str(e)) from e
+        except OSError as e:
+            raise HomeAssistantError(f"无法读取设备档案: {e}") from e
+        try:
+            result = await transport.profile_exchange(profile, command, call.data[ATTR_READ_RESPONSE])
+        except OSError as e:
+            raise HomeAssistantError(f"发送 {name}.{command} 失败: {type(e).__name__}: {e}") from e
+        return _response_data(result, "utf-8", profile.decoder(command), started)
+
+    async def switch_matrix(name, force, preset=None, routes=None):
+        started = time.perf_counter()
+        try:
+            matrix, routes = await hass.async_add_executor_job(_load_routes, name, preset, routes)
+        except MatrixError as e:
+            raise ServiceValidationError(str(e)) from e
+        except OSError as e:
+            raise HomeAssistantError(f"无法读取矩阵定义: {e}") from e
+        # 交叉点缓存保存在加锁的文件中，与命令行共用，放到线程池里执行
+        try:
+            sent = await hass.async_add_executor_job(apply_routes, matrix, routes, force)
+        except MatrixError as e:
+            raise HomeAssistantError(str(e)) from e
+        return {"matrix": name, "routes": routes, "sent": sent,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    async def matrix_route(call: ServiceCall) -> ServiceResponse:
+        return await switch_matrix(call.data[ATTR_MATRIX], call.data[ATTR_FORCE],
+                                   routes={call.data[ATTR_OUTPUT]: call.data[ATTR_INPUT]})
+
+    async def matrix_preset(call: ServiceCall) -> ServiceResponse:
+        return await switch_matrix(call.data[ATTR_MATRIX], call.data[ATTR_FORCE], preset=call.data[ATTR_PRESET])
+
+    async def run_macro(call: ServiceCall) -> ServiceResponse:
+        name = call.data[ATTR_MACRO]
+        try:
+            macro, profiles, matrices = await hass.async_add_executor_job(_load_macro, name)
+        except (MacroError, ProfileError, MatrixError) as e:
+            raise ServiceValidationError(str(e)) from e
+        except OSError as e:
+            raise HomeAssistantError(f"无法读取宏定义: {e}") from e
+
+        async def execute(step):
+            if step.kind == "device":
+                return await transport.send_profile_command(get_profile(profiles, step.device), step.command,
+                                                            step.read_response)
+            matrix = matrices[step.matrix]
+            routes = matrix.presets[step.preset] if step.preset is not None else step.routes
+            # 矩阵路由的交叉点缓存保存在加锁的文件中，与命令行共用，放到线程池里执行
+            await hass.async_add_executor_job(apply_routes, matrix, routes, step.force)
+            return None
+
+        async def run():
+            report = await runner.run(macro, execute)
+            _log_report(report)
+            return report
+
+        if not call.data[ATTR_WAIT]:
+            hass.async_create_background_task(run(), f"{DOMAIN} macro {name}")
+            return {"macro": name, "status": "started"}
+        return await run()
+
+    async def cancel_macro(call: ServiceCall) -> ServiceResponse:
+        return {"cancelled": runner.cancel(call.data.get(ATTR_GROUP))}
+
+    hass.services.async_register(DOMAIN, SERVICE_SEND_TCP_COMMAND, send_tcp_command,
+                                 schema=SEND_TCP_COMMAND_SCHEMA, supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, SERVICE_SEND_RS232_DATA, send_rs232_data,
+                                 schema=SEND_RS232_DATA_SCHEMA, supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, SERVICE_SEND_DEVICE_COMMAND, send_device_command,
+                                 schema=SEND_DEVICE_COMMAND_SCHEMA, supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, SERVICE_MATRIX_ROUTE, matrix_route,
+                                 schema=MATRIX_ROUTE_SCHEMA, supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, SERVICE_MATRIX_PRESET, matrix_preset,
+                                 schema=MATRIX_PRESET_SCHEMA, supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, SERVICE_RUN_MACRO, run_macro,
+                                 schema=RUN_MACRO_SCHEMA, supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, SERVICE_CANCEL_MACRO, cancel_macro,
+                                 schema=CANCEL_MACRO_SCHEMA, supports_response=SupportsResponse.OPTIONAL)
+    return True
@@ -0,0 +1,63 @@
+"""AV 控制集成的常量。"""
+import os
+
+DOMAIN = "av_control"
+
+# 与集成共用收发逻辑（分帧、HEX 解析、解码器、熔断器、流量追踪）的命令行脚本目录：<HA 配置目录>/scripts
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "scripts")
+
+SERVICE_SEND_TCP_COMMAND = "send_tcp_command"
+SERVICE_SEND_RS232_DATA = "send_rs232_data"
+SERVICE_SEND_DEVICE_COMMAND = "send_device_command"
+SERVICE_MATRIX_ROUTE = "matrix_route"
+SERVICE_MATRIX_PRESET = "matrix_preset"
+SERVICE_RUN_MACRO = "run_macro"
+SERVICE_CANCEL_MACRO = "cancel_macro"
+
+# send_tcp_command 的字段（与 scripts.yaml 中 send_tcp_command_script 的字段相同）
+ATTR_IP_ADDRESS = "ip_address"
+ATTR_PORT_NUMBER = "port_number"
+ATTR_COMMAND_STRING = "command_string"
+ATTR_APPEND_CR = "append_carriage_return"
+ATTR_SEND_AS_HEX = "send_as_hex"
+ATTR_FRAMING = "framing"
+ATTR_READ_TIMEOUT = "read_timeout"
+ATTR_CONNECT_TIMEOUT = "connect_timeout"
+ATTR_TRANSPORT = "transport"
+ATTR_REPLY_WINDOW = "reply_window"
+ATTR_BROADCAST = "broadcast"
+
+# send_rs232_data 的字段（与 scripts.yaml 中 send_rs232_data_script 的字段相同）
+ATTR_DATA = "data"
+ATTR_PORT = "port"
+ATTR_BAUDRATE = "baudrate"
+ATTR_BYTESIZE = "bytesize"
+ATTR_PARITY = "parity"
+ATTR_STOPBITS = "stopbits"
+ATTR_TIMEOUT = "timeout"
+ATTR_IS_HEX = "is_hex"
+ATTR_READ_RESPONSE = "read_response"
+ATTR_RESPONSE_MODE = "response_mode"
+ATTR_TERMINATOR = "terminator"
+ATTR_EXPECTED_LENGTH = "expected_length"
+
+# 两个服务共用的字段
+ATTR_ENCODING = "encoding"
+ATTR_COALESCE_KEY = "coalesce_key"
+ATTR_DECODE = "decode"
+
+# send_device_command 的字段（设备档案见 devices.yaml；read_response 与 send_rs232_data 共用）
+ATTR_DEVICE = "device"
+ATTR_COMMAND = "command"
+
+# matrix_route / matrix_preset 的字段（矩阵定义见 matrices.yaml）
+ATTR_MATRIX = "matrix"
+ATTR_OUTPUT = "output"
+ATTR_INPUT = "input"
+ATTR_PRESET = "preset"
+ATTR_FORCE = "force"
+
+# run_macro / cancel_macro 的字段（宏定义见 macros.yaml）
+ATTR_MACRO = "macro"
+ATTR_WAIT = "wait"
+ATTR_GROUP = "group"
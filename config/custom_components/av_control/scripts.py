@@ -0,0 +1,60 @@
+"""
+以独立的模块名导入 <HA 配置目录>/scripts 下的命令行脚本模块。
+
+脚本之间用顶层名称互相导入（import trace_ring、from framing import ...，也包括函数内的延迟导入）。
+把脚本目录加入 sys.path 会让 framing、trace_ring 这类通用名称进入 HA 全局的 sys.modules，
+与同名的已安装包互相覆盖。这里把本模块作为包，脚本以 custom_components.av_control.scripts.<名称>
+加载，例如::
+
+    from .scripts.framing import parse_framing
+
+脚本模块中的 import 语句只在脚本目录内解析为同一包下的模块，其他名称照常导入，
+不修改 sys.path，也不写入顶层名称。
+"""
+import builtins
+import importlib
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+from .const import SCRIPTS_DIR
+
+# 子模块全部由下面的查找器从 SCRIPTS_DIR 加载，不经过路径查找
+__path__ = []
+
+SCRIPT_NAMES = frozenset(
+    entry[:-3] for entry in os.listdir(SCRIPTS_DIR)
+    if entry.endswith(".py") and entry[:-3].isidentifier()
+) if os.path.isdir(SCRIPTS_DIR) else frozenset()
+
+
+def _import(name, globals=None, locals=None, fromlist=(), level=0):
+    """脚本模块使用的 __import__：脚本目录中的顶层名称解析为本包下的模块。"""
+    if level == 0 and name in SCRIPT_NAMES:
+        return importlib.import_module(f"{__name__}.{name}")
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+_SCRIPT_BUILTINS = {**vars(builtins), "__import__": _import}
+
+
+class _ScriptLoader(importlib.machinery.SourceFileLoader):
+    def exec_module(self, module):
+        # 模块代码（包括之后定义的函数）中的 import 都经过 _import
+        module.__builtins__ = _SCRIPT_BUILTINS
+        super().exec_module(module)
+
+
+class _ScriptFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path=None, target=None):
+        package, _, name = fullname.rpartition(".")
+        if package != __name__ or name not in SCRIPT_NAMES:
+            return None
+        source = os.path.join(SCRIPTS_DIR, f"{name}.py")
+        return importlib.util.spec_from_file_location(fullname, source, loader=_ScriptLoader(fullname, source))
+
+
+if not any(isinstance(finder, _ScriptFinder) for finder in sys.meta_path):
+    sys.meta_path.insert(0, _ScriptFinder())
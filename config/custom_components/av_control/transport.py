@@ -0,0 +1,364 @@
+"""
+AV 控制集成的异步传输：在 HA 的事件循环中直接收发 TCP / 串口数据，不再为每次操作启动 Python 进程。
+
+与命令行脚本（scripts/send_tcp_command.py、scripts/send_serial_data.py）的行为一致:
+  - TCP 连接池守护进程 / 串口代理在运行时，请求通过它们的 Unix socket 发送（长连接、命令合并、状态轮询加速）；
+    没有运行时直接连接设备。
+  - 分帧方式、串口响应读取方式、HEX 解析、解码器、熔断器和流量追踪都复用 scripts/ 下的模块。
+    熔断器和流量追踪读写加锁的文件，不在事件循环中执行：熔断状态在线程池中读写，
+    追踪记录交给一个后台线程按顺序写入。
+"""
+import asyncio
+import contextlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .scripts import device_health, trace_ring, udp_transport
+from .scripts.framing import RECV_BUFFER_SIZE, parse_framing
+from .scripts.send_serial_data import (
+    BROKER_SOCKET_PATH,
+    BROKER_WAIT_TIMEOUT,
+    DEFAULT_TERMINATOR,
+    MIN_INTER_FRAME_GAP,
+    check_response_mode,
+    inter_frame_gap,
+)
+from .scripts.send_tcp_command import DAEMON_SOCKET_PATH
+
+IPC_LINE_LIMIT = 1 << 20        # 守护进程的一行响应最大字节数（HEX 编码的响应帧）
+SLEEP_MODE_DELAY = 0.1          # 串口 sleep 模式：写入后固定等待的时间（秒），与 send_serial_data.py 相同
+
+
+class DaemonUnavailable(Exception):
+    """守护进程 / 串口代理没有运行。"""
+
+
+async def ipc_request(path, payload, timeout):
+    """
+    向 Unix socket 上的守护进程发送一个 JSON 行请求（协议见 scripts/unix_ipc.py）。
+
+    Raises:
+        DaemonUnavailable: socket 不存在或守护进程已退出。
+        ConnectionError: 守护进程没有返回数据。
+    """
+    try:
+        reader, writer = await asyncio.open_unix_connection(path, limit=IPC_LINE_LIMIT)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        raise DaemonUnavailable(str(e)) from None
+    try:
+        async with asyncio.timeout(timeout):
+            writer.write(json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+    finally:
+        writer.close()
+    if not line:
+        raise ConnectionError("守护进程未返回任何数据。")
+    return json.loads(line)
+
+
+async def _read_chunk(reader, timeout):
+    """最多等待 `timeout` 秒读取一段数据；超时返回 b''，对端关闭返回 None。"""
+    if timeout <= 0:
+        return b""
+    try:
+        async with asyncio.timeout(timeout):
+            chunk = await reader.read(RECV_BUFFER_SIZE)
+    except TimeoutError:
+        return b""
+    return chunk or None
+
+
+async def read_frame(reader, framing, timeout):
+    """
+    framing.read_frame 的异步版本：按 `framing` 读取一帧响应，收到完整的一帧立即返回。
+
+    Returns:
+        bytes | None: 收到的数据；什么都没收到则为 None。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    buffer = b""
+    while True:
+        remaining = deadline - loop.time()
+        if framing.mode == "idle" and buffer:
+            remaining = min(remaining, framing.idle_gap)
+        chunk = await _read_chunk(reader, remaining)
+        if not chunk:
+            break
+        buffer += chunk
+        if framing.mode == "once":
+            break
+        size = framing.complete_size(buffer)
+        if size is not None:
+            buffer = buffer[:size]
+            break
+        if len(buffer) >= framing.max_size:
+            break
+    return buffer or None
+
+
+class AsyncTransport:
+    """集成内共用的传输状态：同一 TCP 设备 / 同一串口上的直接发送按到达顺序串行。"""
+
+    def __init__(self, hass):
+        self.hass = hass
+        self._locks = {}
+        self._trace_writer = None
+
+    def _lock_for(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    def _trace(self, transport, device, direction, data, latency=None):
+        """
+        记录一次收发（见 scripts/trace_ring.py）。写入带文件锁和 mmap，第一次写入还会创建追踪文件，
+        因此交给单个后台线程按顺序执行，时间戳取调用时刻。未设置 HA_TRANSPORT_TRACE 时立即返回。
+        """
+        if not trace_ring.TRACE_PATH:
+            return
+        if self._trace_writer is None:
+            self._trace_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="av_control_trace")
+        self._trace_writer.submit(trace_ring.record, transport, device, direction, data, latency, time.time())
+
+    # ======== TCP ========
+
+    async def send_tcp(self, ip, port, data, read_response=True, connect_timeout=5, read_timeout=5,
+                       framing=None, coalesce_key=None, transport="tcp", reply_window=None, broadcast=False):
+        """
+        发送 TCP（或 UDP）数据。守护进程运行时经守护进程发送，否则直接连接。
+
+        `transport` 为 "udp" 时通过复用的 UDP socket 发送，在 `reply_window` 秒内收集应答（见 scripts/udp_transport.py），
+        `broadcast` 为 True 表示目标是子网定向广播地址；
+        没有守护进程时在线程池中使用集成进程内共用的 UdpSender。
+
+        Returns:
+            dict: {"response": bytes | None, "via": "daemon" | "direct"}，
+                  经守护进程合并时还带 "superseded" / "suppressed"；
+                  UDP 时还带 "replies": [(来源 "ip:port", bytes), ...]。
+
+        Raises:
+            OSError / ConnectionError: 连接或发送失败（包括熔断器打开的 DeviceUnavailableError）。
+        """
+        request = {
+            "ip": ip,
+            "port": int(port),
+            "data": data.hex(),
+            "read_response": read_response,
+            "read_timeout": read_timeout,
+            "connect_timeout": connect_timeout,
+            "framing": framing,
+        }
+        timeout = connect_timeout + read_timeout + 5
+        if transport == "udp":
+            if reply_window is None:
+                reply_window = udp_transport.DEFAULT_REPLY_WINDOW
+            request["transport"] = "udp"
+            request["reply_window"] = reply_window
+            timeout += reply_window
+            if broadcast:
+                request["broadcast"] = True
+        if coalesce_key:
+            request["coalesce_key"] = coalesce_key
+            timeout += connect_timeout + read_timeout
+        try:
+            reply = await ipc_request(DAEMON_SOCKET_PATH, request, timeout)
+        except DaemonUnavailable:
+            if transport == "udp":
+                replies = await self.hass.async_add_executor_job(
+                    udp_transport.shared_sender().exchange, ip, port, data, read_response, reply_window, broadcast)
+                return {"response": replies[0][1] if replies else None, "via": "direct", "replies": replies}
+            response = await self.tcp_exchange(ip, port, data, read_response, connect_timeout, read_timeout, framing)
+            return {"response": response, "via": "direct"}
+        if not reply.get("ok"):
+            raise ConnectionError(reply.get("error"))
+        result = {
+            "response": bytes.fromhex(reply["response"]) if reply.get("response") else None,
+            "via": "daemon",
+            "superseded": bool(reply.get("superseded")),
+            "suppressed": bool(reply.get("suppressed")),
+        }
+        if "replies" in reply:
+            result["replies"] = [(item["from"], bytes.fromhex(item["data"])) for item in reply["replies"]]
+        return result
+
+    async def tcp_exchange(self, ip, port, data, read_response=True, connect_timeout=5, read_timeout=5,
+                           framing=None):
+        """send_tcp_command.tcp_exchange 的异步版本：建立一次连接，发送并按分帧规则读取响应。"""
+        framing = parse_framing(framing)
+        target = f"{ip}:{port}"
+        # 熔断状态保存在加锁的文件中，放到线程池里读写，不阻塞事件循环
+        await self.hass.async_add_executor_job(device_health.before_connect, ip, port)
+        async with self._lock_for(("tcp", ip, int(port))):
+            writer = None
+            try:
+                async with asyncio.timeout(connect_timeout):
+                    reader, writer = await asyncio.open_connection(ip, int(port))
+                    writer.write(data)
+                    await writer.drain()
+            except BaseException as e:
+                # 连接已建立、但发送失败 / 超时 / 被取消：丢弃未发出的数据并关闭连接
+                if writer is not None:
+                    writer.transport.abort()
+                if not isinstance(e, OSError):
+                    raise
+                await self.hass.async_add_executor_job(device_health.record_failure, ip, port, e)
+                self._trace("tcp", target, trace_ring.ERROR, e)
+                raise
+            sent_at = time.perf_counter()
+            self._trace("tcp", target, trace_ring.TX, data)
+            try:
+                await self.hass.async_add_executor_job(device_health.record_success, ip, port)
+                if not read_response:
+                    return None
+                response = await read_frame(reader, framing, read_timeout)
+                self._trace("tcp", target, trace_ring.RX, response, time.perf_counter() - sent_at)
+                return response
+            finally:
+                writer.close()
+                with contextlib.suppress(OSError):
+                    await writer.wait_closed()
+
+    # ======== 设备档案 ========
+
+    async def send_profile_command(self, profile, command_name, read_response=True):
+        """
+        device_profiles.send_command 的异步版本：按设备档案（devices.yaml）发送一条具名命令。
+
+        Returns:
+            bytes | None: 设备的响应；被同组更新的命令取代时为 None。
+
+        Raises:
+            ProfileError: 命令不存在。
+            OSError / ConnectionError: 发送失败。
+        """
+        result = await self.profile_exchange(profile, command_name, read_response)
+        return result["response"]
+
+    async def profile_exchange(self, profile, command_name, read_response=True):
+        """
+        与 send_profile_command 相同，返回 send_tcp / send_serial 的完整结果
+        （{"response", "via", ...}，经守护进程 / 串口代理合并时还带 "superseded" / "suppressed"）。
+        """
+        from .scripts.device_profiles import serial_options, tcp_options, udp_options
+
+        frame = profile.frame(command_name)
+        settings = profile.settings
+        coalesce_key = profile.coalesce_key(command_name)
+        if profile.transport == "serial":
+            return await self.send_serial(frame, **serial_options(profile, read_response), coalesce_key=coalesce_key)
+        if profile.transport == "udp":
+            return await self.send_tcp(settings["ip"], settings["port"], frame, read_response,
+                                       coalesce_key=coalesce_key, transport="udp", **udp_options(profile))
+        return await self.send_tcp(settings["ip"], settings["port"], frame, read_response,
+                                   coalesce_key=coalesce_key, **tcp_options(profile))
+
+    # ======== 串口 ========
+
+    async def send_serial(self, data, port, baudrate, bytesize, parity, stopbits, timeout, read_response,
+                          response_mode, terminator=DEFAULT_TERMINATOR, expected_length=0, coalesce_key=None):
+        """
+        发送串口数据。串口代理运行时经代理发送，否则直接打开串口。
+
+        Returns:
+            dict: {"response": bytes | None, "via": "broker" | "direct"}，经代理合并时还带 "superseded" / "suppressed"。
+
+        Raises:
+            OSError / ConnectionError: 串口无法打开或代理报告错误。
+            ValueError: 响应读取方式无效（length 模式没有 expected_length）。
+        """
+        check_response_mode(response_mode, expected_length)
+        request = {
+            "port": port,
+            "baudrate": baudrate,
+            "bytesize": bytesize,
+            "parity": parity,
+            "stopbits": stopbits,
+            "timeout": timeout,
+            "data": data.hex(),
+            "read_response": read_response,
+            "response_mode": response_mode,
+            "terminator": terminator.hex(),
+            "expected_length": expected_length,
+            "gap": None,
+            "wait_timeout": BROKER_WAIT_TIMEOUT,
+        }
+        if coalesce_key:
+            request["coalesce_key"] = coalesce_key
+        try:
+            reply = await ipc_request(BROKER_SOCKET_PATH, request, timeout + 30)
+        except DaemonUnavailable:
+            response = await self.serial_exchange(data, port, baudrate, bytesize, parity, stopbits, timeout,
+                                                  read_response, response_mode, terminator, expected_length)
+            return {"response": response, "via": "direct"}
+        if not reply.get("ok"):
+            raise ConnectionError(reply.get("error"))
+        return {
+            "response": bytes.fromhex(reply["response"]) if reply.get("response") else None,
+            "via": "broker",
+            "superseded": bool(reply.get("superseded")),
+            "suppressed": bool(reply.get("suppressed")),
+        }
+
+    async def serial_exchange(self, data, port, baudrate, bytesize, parity, stopbits, timeout, read_response,
+                              response_mode, terminator=DEFAULT_TERMINATOR, expected_length=0):
+        """send_serial_data.send_serial_data 的异步版本：打开串口、写入、按 response_mode 读取响应后关闭。"""
+        import serial_asyncio_fast
+
+        async with self._lock_for(("serial", port)):
+            reader, writer = await serial_asyncio_fast.open_serial_connection(
+                url=port, baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits)
+            try:
+                writer.write(data)
+                await writer.drain()
+                sent_at = time.perf_counter()
+                self._trace("serial", port, trace_ring.TX, data)
+                if not read_response:
+                    if response_mode == "sleep":
+                        await asyncio.sleep(SLEEP_MODE_DELAY)
+                    return None
+                gap = inter_frame_gap(baudrate, bytesize, parity, stopbits)
+                response = await read_serial_response(reader, response_mode, terminator, expected_length,
+                                                      gap, timeout)
+                self._trace("serial", port, trace_ring.RX, response, time.perf_counter() - sent_at)
+                return response or None
+            finally:
+                writer.close()
+
+
+async def read_serial_response(reader, response_mode, terminator, expected_length, gap, timeout):
+    """
+    send_serial_data.read_response_data 的异步版本。
+
+    sleep       固定等待 0.1 秒后读取已到达的数据
+    gap         收到首字节后，一直读到线路静默超过字符间隔 `gap`
+    terminator  读到终止符为止
+    length      读满 expected_length 字节
+    首字节最多等待 `timeout` 秒；expected_length 在 gap / terminator 模式下作为上限。
+    """
+    if response_mode == "sleep":
+        await asyncio.sleep(SLEEP_MODE_DELAY)
+        buffer = b""
+        while chunk := await _read_chunk(reader, MIN_INTER_FRAME_GAP):
+            buffer += chunk
+        return buffer
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    buffer = await _read_chunk(reader, timeout) or b""
+    while buffer:
+        if response_mode == "terminator":
+            index = buffer.find(terminator)
+            if index >= 0:
+                return buffer[:index + len(terminator)]
+        if expected_length and len(buffer) >= expected_length:
+            return buffer[:expected_length]
+        wait = gap if response_mode == "gap" else deadline - loop.time()
+        chunk = await _read_chunk(reader, wait)
+        if not chunk:
+            break
+        buffer += chunk
+    return buffer
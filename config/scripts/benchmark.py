@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# benchmark.py
+# 传输层延迟/吞吐量基准测试。使用 fake_devices.py 中的本地替身设备（TCP 矩阵、UDP 设备和 pty 串口），
+# 分别驱动命令行入口（每条命令一个进程，与 shell_command 相同）和 send_tcp_command() / send_serial_data() 函数，
+# 在顺序和并发负载下统计 p50/p95/p99 延迟、每秒命令数以及进程启动开销。
+#
+# 用法:
+#   python benchmark.py                          运行所有场景
+#   python benchmark.py --scenario tcp-cli --count 50 --concurrency 4
+#   python benchmark.py --reply-delay 0.02 --fragment-size 4 --json results.jsonl
+#   python benchmark.py --scenario startup --budget-ms 30
+#
+# --json 会把每次运行的结果以一行 JSON 追加到文件中，便于跨版本比较。
+# --budget-ms 是启动耗时的回归检查：快速入口（python -S fast_send.py）发送一条 TCP 命令的 p50 超过预算时以非零码退出。
+# 提交的预算由 startup_check.py 检查（python startup_check.py）。
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_devices import FakePtyDevice, FakeTcpDevice, FakeUdpDevice
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('startup', 'tcp-function', 'tcp-cli', 'udp-function', 'udp-cli', 'serial-function', 'serial-cli')
+FAST_START_PROBE = 'python -S fast_send.py tcp'   # --budget-ms 检查的启动场景
+
+
+def percentile(sorted_values, fraction):
+    """最近秩法百分位数。"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall_time, errors):
+    values = sorted(latencies)
+    to_ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'count': len(values),
+        'errors': errors,
+        'p50_ms': to_ms(percentile(values, 0.50)),
+        'p95_ms': to_ms(percentile(values, 0.95)),
+        'p99_ms': to_ms(percentile(values, 0.99)),
+        'mean_ms': to_ms(sum(values) / len(values)) if values else None,
+        'max_ms': to_ms(values[-1]) if values else None,
+        'commands_per_sec': round(len(values) / wall_time, 2) if wall_time > 0 else None,
+        'wall_s': round(wall_time, 3),
+    }
+
+
+def run_load(call, count, concurrency):
+    """调用 `call` 共 `count` 次（最多 `concurrency` 个同时进行），返回统计结果。"""
+    latencies = []
+    errors = 0
+
+    def one(_):
+        started = time.perf_counter()
+        ok = call()
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        results = [one(i) for i in range(count)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(one, range(count)))
+    wall_time = time.perf_counter() - started
+    for latency, ok in results:
+        latencies.append(latency)
+        errors += 0 if ok else 1
+    return summarize(latencies, wall_time, errors)
+
+
+def _cli_call(argv, env):
+    def call():
+        completed = subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return completed.returncode == 0
+    return call
+
+
+@contextlib.contextmanager
+def _quiet(enabled=True):
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def _isolated_env():
+    # 把守护进程 / 代理的 socket 指向不存在的路径，确保测的是直接发送的路径
+    env = dict(os.environ)
+    scratch = tempfile.gettempdir()
+    env.setdefault('HA_TCP_DAEMON_SOCKET', os.path.join(scratch, f'bench-no-daemon-{os.getpid()}.sock'))
+    env.setdefault('HA_SERIAL_BROKER_SOCKET', os.path.join(scratch, f'bench-no-broker-{os.getpid()}.sock'))
+    os.environ.update(env)
+    return env
+
+
+def bench_startup(args, env):
+    """进程启动开销：空解释器、导入各传输模块的解释器，以及完整入口和快速入口各发送一条 TCP 命令的冷启动耗时。"""
+    results = {}
+    device = FakeTcpDevice()
+    target = [device.host, str(device.port), 'ping', 'true', 'false']
+    probes = {
+        'python': [sys.executable, '-c', 'pass'],
+        'python -S': [sys.executable, '-S', '-c', 'pass'],
+        'import send_tcp_command': [sys.executable, '-c', 'import send_tcp_command'],
+        'import send_serial_data': [sys.executable, '-c', 'import send_serial_data'],
+        'send_tcp_command.py': [sys.executable, os.path.join(SCRIPTS_DIR, 'send_tcp_command.py')] + target,
+        FAST_START_PROBE: [sys.executable, '-S', os.path.join(SCRIPTS_DIR, 'fast_send.py'), 'tcp'] + target,
+    }
+    with device:
+        for name, argv in probes.items():
+            probe_env = dict(env, PYTHONPATH=SCRIPTS_DIR)
+            results[name] = run_load(_cli_call(argv, probe_env), args.count, 1)
+    return results
+
+
+def bench_tcp(args, env, mode):
+    device = FakeTcpDevice(reply_delay=args.reply_delay, fragment_size=args.fragment_size,
+                           fragment_gap=args.fragment_gap)
+    command = 'silent' if args.silent else 'ping'
+    with device:
+        if mode == 'cli':
+            argv = [sys.executable, os.path.join(SCRIPTS_DIR, 'send_tcp_command.py'),
+                    device.host, str(device.port), command, 'true', 'false',
+                    '--framing', args.framing, '--read-timeout', str(args.read_timeout)]
+            call = _cli_call(argv, env)
+        else:
+            from send_tcp_command import send_tcp_command
+
+            def call():
+                try:
+                    send_tcp_command(device.host, device.port, command, 'true', 'false', use_daemon=False,
+                                     read_timeout=args.read_timeout, framing=args.framing)
+                except SystemExit:
+                    return False
+                return True
+        # 在整个负载期间统一屏蔽函数内部的打印（在每次调用里切换 sys.stdout 会在多线程下相互覆盖）
+        with _quiet(mode == 'function'):
+            return {
+                'sequential': run_load(call, args.count, 1),
+                'concurrent': run_load(call, args.count, args.concurrency),
+            }
+
+
+def bench_udp(args, env, mode):
+    device = FakeUdpDevice(reply_delay=args.reply_delay)
+    command = 'silent' if args.silent else 'ping'
+    with device:
+        if mode == 'cli':
+            argv = [sys.executable, os.path.join(SCRIPTS_DIR, 'send_tcp_command.py'),
+                    device.host, str(device.port), command, 'true', 'false',
+                    '--udp', '--reply-window', str(args.reply_window)]
+            call = _cli_call(argv, env)
+        else:
+            from send_tcp_command import send_tcp_command
+
+            def call():
+                send_tcp_command(device.host, device.port, command, 'true', 'false', use_daemon=False,
+                                 transport='udp', reply_window=args.reply_window)
+                return True
+        with _quiet(mode == 'function'):
+            return {
+                'sequential': run_load(call, args.count, 1),
+                'concurrent': run_load(call, args.count, args.concurrency),
+            }
+
+
+def bench_serial(args, env, mode):
+    device = FakePtyDevice(reply_delay=args.reply_delay, baudrate=args.baudrate)
+    command = 'silent' if args.silent else 'ping'
+    with device:
+        serial_args = ['--port', device.path, '--baudrate', str(args.baudrate), '--read-response',
+                       '--response-mode', args.response_mode, '--no-broker']
+        if mode == 'cli':
+            argv = [sys.executable, os.path.join(SCRIPTS_DIR, 'send_serial_data.py'), command] + serial_args
+            call = _cli_call(argv, env)
+        else:
+            with _quiet():
+                from send_serial_data import send_serial_data
+
+            def call():
+                success, _ = send_serial_data(command + '\r', port=device.path, baudrate=args.baudrate,
+                                              read_response=True, response_mode=args.response_mode)
+                return success
+        # 同一个串口同一时刻只能有一个事务，串口场景只测顺序负载
+        with _quiet(mode == 'function'):
+            return {'sequential': run_load(call, args.count, 1)}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_table(results):
+    print(f"{'场景':<36} {'次数':>5} {'错误':>4} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'命令/秒':>9}")
+    for scenario, loads in results.items():
+        for load, stats in loads.items():
+            print(f"{scenario + ' / ' + load:<36} {stats['count']:>5} {stats['errors']:>4} "
+                  f"{stats['p50_ms']!s:>9} {stats['p95_ms']!s:>9} {stats['p99_ms']!s:>9} "
+                  f"{stats['commands_per_sec']!s:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="传输层延迟/吞吐量基准测试（使用本地替身设备）。")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="要运行的场景，可重复指定（默认: 全部）")
+    parser.add_argument("--count", type=int, default=20, help="每个场景的命令数 (默认: 20)")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发负载的并发数 (默认: 4)")
+    parser.add_argument("--reply-delay", type=float, default=0.0, help="替身设备的应答延迟（秒）")
+    parser.add_argument("--fragment-size", type=int, default=0, help="TCP 替身把应答拆成多少字节一段（0 表示不拆）")
+    parser.add_argument("--fragment-gap", type=float, default=0.0, help="TCP 应答分段之间的间隔（秒）")
+    parser.add_argument("--silent", action="store_true", help="替身设备不应答（测量超时路径）")
+    parser.add_argument("--framing", default="terminator", help="TCP 响应分帧方式 (默认: terminator)")
+    parser.add_argument("--read-timeout", type=float, default=1.0, help="TCP 读取超时（秒）(默认: 1)")
+    parser.add_argument("--reply-window", type=float, default=0.2,
+                        help="UDP 收集应答的时间（秒），0 表示发出即返回 (默认: 0.2)")
+    parser.add_argument("--baudrate", type=int, default=9600, help="串口替身的波特率 (默认: 9600)")
+    parser.add_argument("--response-mode", default="terminator", help="串口响应读取方式 (默认: terminator)")
+    parser.add_argument("--json", metavar="FILE", help="把结果以一行 JSON 追加到 FILE（'-' 表示输出到标准输出）")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help=f"启动耗时预算（毫秒）：startup 场景中 '{FAST_START_PROBE}' 的 p50 超过预算时以非零码退出")
+    args = parser.parse_args()
+    if args.budget_ms is not None and args.scenario and 'startup' not in args.scenario:
+        parser.error("--budget-ms 需要运行 startup 场景")
+
+    env = _isolated_env()
+    scenarios = args.scenario or list(SCENARIOS)
+    results = {}
+    for scenario in scenarios:
+        if scenario.startswith('serial'):
+            try:
+                import serial  # noqa: F401
+            except ImportError:
+                print(f"跳过 {scenario}: 未安装 pyserial", file=sys.stderr)
+                continue
+        if scenario == 'startup':
+            results[scenario] = bench_startup(args, env)
+        elif scenario.startswith('tcp'):
+            results[scenario] = bench_tcp(args, env, scenario.split('-')[1])
+        elif scenario.startswith('udp'):
+            results[scenario] = bench_udp(args, env, scenario.split('-')[1])
+        else:
+            results[scenario] = bench_serial(args, env, scenario.split('-')[1])
+
+    record = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('json', 'scenario')},
+        'results': results,
+    }
+    if args.json == '-':
+        print(json.dumps(record, ensure_ascii=False))
+    else:
+        print_table(results)
+        if args.json:
+            with open(args.json, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    if not all(stats['errors'] == 0 for loads in results.values() for stats in loads.values()):
+        return 1
+    if args.budget_ms is not None:
+        p50 = results['startup'][FAST_START_PROBE]['p50_ms']
+        if p50 > args.budget_ms:
+            print(f"启动耗时超出预算: {FAST_START_PROBE} p50 {p50} ms > {args.budget_ms} ms", file=sys.stderr)
+            return 1
+        print(f"启动耗时在预算内: {FAST_START_PROBE} p50 {p50} ms <= {args.budget_ms} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# build_svg_sprite.py
+# 把 www/svg 下的所有图标打包成一个带内容哈希的 JSON 雪碧图，供 www/file-loader.js 一次性加载并缓存到 localStorage，
+# 墙面平板的看板刷新时不再为每个图标单独请求 /local/svg/<name>.svg 并逐个解析。
+#
+# 与 file-loader.js 相同的提取规则：<svg> 的 viewBox（缺失时使用 DEFAULT_VIEWBOX）和第一个 <path> 的 d 属性。
+# 没有 path 数据的文件不打包，加载器对这些图标仍按原来的方式单独请求（并打印同样的警告）。
+#
+# 输出（位于 www/ 下，HA 中的 URL 为 /local/...）:
+#   svg-sprite.<哈希>.json   图标数据，内容不变则文件名不变，可被浏览器长期缓存
+#   svg-sprite.json          清单：当前雪碧图的哈希和文件名，加载器每次启动时只重新验证这个小文件
+#
+# 用法:
+#   python build_svg_sprite.py            重新生成雪碧图（并删除旧的雪碧图文件）
+#   python build_svg_sprite.py --check    只检查雪碧图是否与 svg 目录一致，不一致时返回 1
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+CONFIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WWW_DIR = os.path.join(CONFIG_DIR, 'www')
+SVG_DIR = os.path.join(WWW_DIR, 'svg')
+MANIFEST_NAME = 'svg-sprite.json'
+SPRITE_PREFIX = 'svg-sprite.'
+SPRITE_FORMAT = 1       # 雪碧图格式版本，与 file-loader.js 的 SPRITE_FORMAT 对应
+DEFAULT_VIEWBOX = '0 0 32 32'
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def extract_icon(path):
+    """
+    读取一个 SVG 文件，返回 {'path': d, 'viewBox': viewBox}；没有 path 数据时返回 None。
+
+    Raises:
+        ET.ParseError: 文件不是有效的 XML。
+    """
+    root = ET.parse(path).getroot()
+    svg = root if _local_name(root.tag) == 'svg' else next(
+        (element for element in root.iter() if _local_name(element.tag) == 'svg'), None)
+    viewbox = svg.get('viewBox') if svg is not None else None
+    if not viewbox:
+        print(f"警告: {os.path.basename(path)} 没有 viewBox，使用默认值 '{DEFAULT_VIEWBOX}'。")
+        viewbox = DEFAULT_VIEWBOX
+    # 与 querySelector("path") 相同：按文档顺序的第一个 <path>
+    element = next((element for element in root.iter() if _local_name(element.tag) == 'path'), None)
+    data = element.get('d') if element is not None else None
+    if not data:
+        print(f"警告: {os.path.basename(path)} 的第一个 <path> 没有 d 属性，不打包（加载器会单独请求该文件）。")
+        return None
+    return {'path': ' '.join(data.split()), 'viewBox': ' '.join(viewbox.split())}
+
+
+def build_sprite(svg_dir=SVG_DIR):
+    """扫描 `svg_dir`，返回雪碧图字典（含内容哈希）。"""
+    icons = {}
+    for path in sorted(glob.glob(os.path.join(svg_dir, '*.svg'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            icon = extract_icon(path)
+        except ET.ParseError as e:
+            print(f"警告: 无法解析 {os.path.basename(path)}: {e}，不打包。")
+            continue
+        if icon is not None:
+            icons[name] = icon
+    content = json.dumps(icons, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    digest = hashlib.sha256(f"{SPRITE_FORMAT}:{content}".encode('utf-8')).hexdigest()[:12]
+    return {'format': SPRITE_FORMAT, 'hash': digest, 'icons': icons}
+
+
+def _read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_sprite(sprite, out_dir=WWW_DIR):
+    """写入雪碧图和清单，并删除旧哈希的雪碧图文件。返回雪碧图文件名。"""
+    filename = f"{SPRITE_PREFIX}{sprite['hash']}.json"
+    with open(os.path.join(out_dir, filename), 'w', encoding='utf-8') as f:
+        json.dump(sprite, f, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    manifest = {'format': sprite['format'], 'hash': sprite['hash'], 'file': filename, 'count': len(sprite['icons'])}
+    temporary = os.path.join(out_dir, f"{MANIFEST_NAME}.tmp")
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    # 先写好新的雪碧图再替换清单，加载器不会读到指向不存在文件的清单
+    os.replace(temporary, os.path.join(out_dir, MANIFEST_NAME))
+    for stale in glob.glob(os.path.join(out_dir, f"{SPRITE_PREFIX}*.json")):
+        if os.path.basename(stale) not in (filename, MANIFEST_NAME):
+            os.remove(stale)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把 www/svg 下的图标打包成一个带内容哈希的 JSON 雪碧图。")
+    parser.add_argument("--svg-dir", default=SVG_DIR, help=f"SVG 图标目录 (默认: {SVG_DIR})")
+    parser.add_argument("--out-dir", default=WWW_DIR, help=f"雪碧图输出目录 (默认: {WWW_DIR})")
+    parser.add_argument("--check", action="store_true", help="只检查雪碧图是否为最新，不写入文件")
+    args = parser.parse_args()
+
+    sprite = build_sprite(args.svg_dir)
+    manifest = _read_manifest(args.out_dir)
+    current = (manifest is not None and manifest.get('hash') == sprite['hash']
+               and os.path.exists(os.path.join(args.out_dir, manifest.get('file', ''))))
+    if args.check:
+        if current:
+            print(f"雪碧图是最新的: {manifest['file']}（{len(sprite['icons'])} 个图标）")
+            return 0
+        print("雪碧图已过期，请运行 build_svg_sprite.py 重新生成。", file=sys.stderr)
+        return 1
+    if current:
+        print(f"雪碧图没有变化: {manifest['file']}（{len(sprite['icons'])} 个图标）")
+        return 0
+    filename = write_sprite(sprite, args.out_dir)
+    print(f"已生成 {filename}: {len(sprite['icons'])} 个图标。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# command_coalescer.py
+# 控制命令合并（防抖）：在常驻进程（TCP 连接池守护进程、串口代理）转发命令之前，
+# 按调用方给出的合并键（例如 "matrix:video:TV" 表示视频矩阵的 TV 输出，"projector:volume" 表示投影机音量）
+# 把短时间内连续到达的命令合并为最后一条。
+#
+#   - 同一合并键的第一条命令到达后等待 window 秒，期间到达的新命令取代旧命令（后写者胜），
+#     被取代的调用方立即得到 {"ok": true, "superseded": true}，设备只收到最终的那一条；
+#   - 等待时间从第一条命令开始计算，连续不断的按键也不会无限推迟发送，延迟最多为 window 秒
+#     （加上同一合并键上一条命令尚未发送完的时间）；
+#   - 与最近一次成功发送的内容完全相同的命令（幂等重复）在 repeat_ttl 秒内不再发送，
+#     直接返回上一次的响应并标记 {"suppressed": true}。
+#
+# 没有合并键的请求不经过这里，行为与之前完全相同。
+import threading
+import time
+
+DEFAULT_WINDOW = 0.15       # 默认合并窗口（秒）
+DEFAULT_REPEAT_TTL = 10     # 幂等重复的抑制时间（秒）；超过后即使内容相同也重新发送，以纠正设备被面板手动改动的情况
+MAX_WINDOW = 5              # 调用方可请求的最大合并窗口（秒）
+
+
+class _Pending:
+    """某个合并键上等待发送的最新命令及其调用方。"""
+
+    def __init__(self, request, fingerprint):
+        self.request = request
+        self.fingerprint = fingerprint
+        self.reply = None
+        self.done = threading.Event()
+        self.due = False            # 窗口已结束，但同一合并键上一条命令仍在发送
+
+
+class CommandCoalescer:
+    """
+    按合并键合并命令，只把最终意图交给 `send`。
+
+    Args:
+        send: 可调用对象，接收请求字典并返回响应字典（即守护进程原本的请求处理函数）。
+        repeat_ttl: 幂等重复的抑制时间（秒），0 表示不抑制。
+    """
+
+    def __init__(self, send, repeat_ttl=DEFAULT_REPEAT_TTL):
+        self.send = send
+        self.repeat_ttl = repeat_ttl
+        self._pending = {}          # 合并键 -> _Pending
+        self._busy = set()          # 正在发送的合并键
+        self._last = {}             # 合并键 -> (fingerprint, 发送时间, 响应)
+        self._lock = threading.Lock()
+        self.stats = {'sent': 0, 'superseded': 0, 'suppressed': 0}
+
+    def submit(self, key, request, fingerprint):
+        """
+        提交一条带合并键的命令并等待结果。
+
+        Args:
+            key: 合并键。
+            request: 原始请求字典，可包含 coalesce_window（秒）。
+            fingerprint: 描述命令实际效果的可比较值（例如 (ip, port, data)），用于识别幂等重复。
+
+        Returns:
+            dict: `send` 的响应；被取代时为 {"ok": true, "superseded": true, "response": null}。
+        """
+        window = min(max(float(request.get('coalesce_window', DEFAULT_WINDOW)), 0), MAX_WINDOW)
+        pending = _Pending(request, fingerprint)
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is None and key not in self._busy:
+                last = self._last.get(key)
+                if (last is not None and last[0] == fingerprint
+                        and time.monotonic() - last[1] < self.repeat_ttl):
+                    self.stats['suppressed'] += 1
+                    return {'ok': True, 'response': last[2], 'suppressed': True}
+            self._pending[key] = pending
+            if previous is not None:
+                # 新命令接替旧命令的位置，沿用旧命令的发送时刻，保证延迟有上限
+                pending.due = previous.due
+                previous.reply = {'ok': True, 'response': None, 'superseded': True}
+                previous.done.set()
+                self.stats['superseded'] += 1
+        if previous is None:
+            timer = threading.Timer(window, self._flush, (key,))
+            timer.daemon = True
+            timer.start()
+        pending.done.wait()
+        return pending.reply
+
+    def _flush(self, key):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                return
+            if key in self._busy:
+                # 由正在发送的线程发送完后接着发送，保证同一合并键上的命令按顺序到达设备
+                pending.due = True
+                return
+            del self._pending[key]
+            self._busy.add(key)
+
+        while pending is not None:
+            try:
+                reply = self.send(pending.request)
+            except Exception as e:
+                reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            with self._lock:
+                self.stats['sent'] += 1
+                if reply.get('ok'):
+                    self._last[key] = (pending.fingerprint, time.monotonic(), reply.get('response'))
+                else:
+                    # 发送失败后设备状态未知，下一条相同的命令必须真正发送
+                    self._last.pop(key, None)
+                pending.reply = reply
+                pending.done.set()
+                pending = self._pending.get(key)
+                if pending is not None and pending.due:
+                    del self._pending[key]
+                else:
+                    pending = None
+                    self._busy.discard(key)
+
+    def forget(self, key=None):
+        """清除幂等重复的记录（全部或某个合并键），下一条命令一定会发送。"""
+        with self._lock:
+            if key is None:
+                self._last.clear()
+            else:
+                self._last.pop(key, None)
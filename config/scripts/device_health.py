@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# device_health.py
+# 设备可达性缓存与熔断器：所有进程（命令行脚本、批量模式、连接池守护进程）共用一个加锁的 JSON 文件，
+# 记录每个 TCP 目标 (ip:port) 的熔断状态。
+#
+#   closed     正常发送；连续失败 FAILURE_THRESHOLD 次后进入 open
+#   open       直接抛出 DeviceUnavailableError，不再等待连接超时；COOLDOWN 秒后进入 half_open
+#   half_open  只放行一次探测（一次真实调用或守护进程的后台探测），成功则 closed，失败则重新 open
+#
+# 只有连接 / 发送失败才计为失败；设备连上了但没有应答不算离线。
+#
+# 用法:
+#   python device_health.py status [--json]    显示各设备的熔断状态（HA 的 command_line 传感器使用 --json）
+#   python device_health.py reset [ip:port]    手动恢复一台（或全部）设备
+import fcntl
+import os
+import sys
+import time
+
+from transport_metrics import SUMMARY, vprint
+
+HEALTH_STATE_PATH = os.environ.get('HA_DEVICE_HEALTH', '/tmp/ha_device_health.json')
+
+FAILURE_THRESHOLD = 3       # 连续失败多少次后熔断
+COOLDOWN = 30               # 熔断后多少秒允许一次半开探测
+PROBE_TIMEOUT = 10          # 半开探测的最长占用时间（秒），超时后允许其他调用重新探测
+PROBE_INTERVAL = 5          # 守护进程后台探测的检查间隔（秒）
+PROBE_CONNECT_TIMEOUT = 1   # 后台探测的连接超时（秒）
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class DeviceUnavailableError(ConnectionError):
+    """目标设备的熔断器处于打开状态，调用被立即拒绝。"""
+
+
+def target_key(ip, port):
+    return f"{ip}:{int(port)}"
+
+
+class locked_health:
+    """
+    以文件锁打开熔断状态（上下文管理器）。exclusive 为 False 时只读（共享锁），修改不会写回。
+    写成类而不是 @contextmanager：每次发送都会导入本模块，contextlib 连带的 collections / functools
+    会让命令行启动慢几毫秒。
+    """
+
+    def __init__(self, exclusive=True, path=None):
+        self.exclusive = exclusive
+        self.path = path or HEALTH_STATE_PATH
+
+    def __enter__(self):
+        import json
+        self._file = open(self.path, 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+            self._file.seek(0)
+            try:
+                self.state = json.loads(self._file.read() or '{}')
+            except ValueError:
+                self.state = {}
+        except BaseException:
+            self._file.close()
+            raise
+        return self.state
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._file as f:
+            if self.exclusive and exc_type is None:
+                import json
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(self.state, ensure_ascii=False))
+
+
+def _is_healthy(entry):
+    return entry is None or (entry.get('state') == CLOSED and not entry.get('failures'))
+
+
+def _is_tracked(key):
+    """
+    `key` 是否出现在状态文件中（共享锁下的子串查找）。从未失败过的设备不在文件中，
+    不必解析 JSON，命令行也不必为此导入 json。
+    """
+    try:
+        with open(HEALTH_STATE_PATH, encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return f'"{key}"' in f.read()
+    except FileNotFoundError:
+        return False
+
+
+def before_connect(ip, port):
+    """
+    在连接设备之前调用。熔断器打开时立即抛出 DeviceUnavailableError；
+    冷却时间已过时把熔断器切换为 half_open，由本次调用充当探测。
+
+    正常设备只需一次共享锁读取，不写文件。
+    """
+    key = target_key(ip, port)
+    if not _is_tracked(key):
+        return
+    with locked_health(exclusive=False) as state:
+        if _is_healthy(state.get(key)):
+            return
+    now = time.time()
+    with locked_health() as state:
+        entry = state.get(key)
+        if entry is None or entry.get('state') == CLOSED:
+            return
+        if entry['state'] == OPEN and now - entry['opened_at'] < COOLDOWN:
+            raise DeviceUnavailableError(
+                f"设备 {key} 离线（连续失败 {entry['failures']} 次，最近错误: {entry.get('last_error')}），"
+                f"{COOLDOWN - (now - entry['opened_at']):.0f} 秒后重试")
+        if entry['state'] == HALF_OPEN and now - entry.get('probe_started', 0) < PROBE_TIMEOUT:
+            raise DeviceUnavailableError(f"设备 {key} 离线，正在探测是否恢复")
+        entry['state'] = HALF_OPEN
+        entry['probe_started'] = now
+        entry['changed'] = now
+
+
+def record_success(ip, port):
+    """连接 / 发送成功。设备原本就正常时不写文件。"""
+    key = target_key(ip, port)
+    if not _is_tracked(key):
+        return
+    with locked_health(exclusive=False) as state:
+        if _is_healthy(state.get(key)):
+            return
+    with locked_health() as state:
+        entry = state.get(key)
+        if entry is None:
+            return
+        if entry.get('state') != CLOSED:
+            entry['changed'] = time.time()
+            vprint(SUMMARY, f"设备 {key} 已恢复在线。")
+        entry.update({'state': CLOSED, 'failures': 0})
+        entry.pop('probe_started', None)
+
+
+def record_failure(ip, port, error):
+    """连接 / 发送失败。`error` 为异常对象或错误描述。"""
+    key = target_key(ip, port)
+    now = time.time()
+    description = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+    with locked_health() as state:
+        entry = state.setdefault(key, {'state': CLOSED, 'failures': 0, 'changed': now})
+        entry['failures'] += 1
+        entry['last_error'] = description
+        entry['last_failure'] = now
+        if entry['state'] == HALF_OPEN or (entry['state'] == CLOSED and entry['failures'] >= FAILURE_THRESHOLD):
+            if entry['state'] == CLOSED:
+                vprint(SUMMARY, f"设备 {key} 连续失败 {entry['failures']} 次，已熔断 {COOLDOWN} 秒。")
+            entry['state'] = OPEN
+            entry['opened_at'] = now
+            entry['changed'] = now
+            entry.pop('probe_started', None)
+
+
+def probe(ip, port, connect_timeout=PROBE_CONNECT_TIMEOUT):
+    """
+    对一台可疑设备做一次连接探测并记录结果。熔断器打开且冷却未结束时不探测。
+
+    Returns:
+        bool | None: 探测结果；未探测时为 None。
+    """
+    try:
+        before_connect(ip, port)
+    except DeviceUnavailableError:
+        return None
+    import socket
+    try:
+        socket.create_connection((ip, int(port)), timeout=connect_timeout).close()
+    except OSError as e:
+        record_failure(ip, port, e)
+        return False
+    record_success(ip, port)
+    return True
+
+
+def probe_loop(interval=PROBE_INTERVAL):
+    """
+    后台探测（在连接池守护进程中运行）：只探测有失败记录的设备，冷却结束就立即探测，
+    设备恢复后不必等到下一次真实调用来承担探测的等待时间。
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            with locked_health(exclusive=False) as state:
+                suspects = [key for key, entry in state.items() if not _is_healthy(entry)]
+        except OSError:
+            continue
+        for key in suspects:
+            ip, _, port = key.rpartition(':')
+            probe(ip, port)
+
+
+def status():
+    with locked_health(exclusive=False) as state:
+        devices = dict(state)
+    return {
+        'down': sorted(key for key, entry in devices.items() if entry.get('state') != CLOSED),
+        'devices': devices,
+    }
+
+
+def main():
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="设备可达性缓存与熔断器。")
+    sub = parser.add_subparsers(dest="action", required=True)
+    show = sub.add_parser("status", help="显示各设备的熔断状态")
+    show.add_argument("--json", action="store_true", help="以 JSON 输出")
+    reset = sub.add_parser("reset", help="手动恢复设备（清除失败记录）")
+    reset.add_argument("target", nargs="?", help="ip:port，省略时恢复全部设备")
+    args = parser.parse_args()
+
+    if args.action == 'reset':
+        with locked_health() as state:
+            if args.target:
+                state.pop(args.target, None)
+            else:
+                state.clear()
+        return 0
+
+    result = status()
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return 0
+    if not result['devices']:
+        print("没有任何设备的失败记录。")
+    for key, entry in sorted(result['devices'].items()):
+        changed = time.strftime('%H:%M:%S', time.localtime(entry.get('changed', 0)))
+        print(f"{key:<24} {entry.get('state'):<10} 失败 {entry.get('failures', 0):>3} 次  "
+              f"自 {changed}  {entry.get('last_error') or ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
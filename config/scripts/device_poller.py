@@ -0,0 +1,323 @@
+# device_poller.py
+# 后台设备状态轮询：在 TCP 连接池守护进程内运行，按 pollers.yaml 中每条查询的间隔
+# 通过共享的长连接（串口设备通过串口代理）发送查询命令，按命令的解码器解析响应，只发布发生变化的值。
+#
+# 自适应间隔：
+#   - 值没有变化时，间隔按 backoff 倍数逐步放慢，直到 max_interval；
+#   - 值发生变化时恢复为 interval；
+#   - 守护进程转发了发往同一设备的控制命令后，在 boost_duration 秒内按 boost_interval 快速轮询，
+#     以便尽快反映控制结果（例如切换输入、调节音量之后）。
+#
+# 发布方式（见 pollers.yaml 的 publish 段）：
+#   snapshot  把全部当前值原子写入 JSON 文件
+#   webhook   把变化的值和全部当前值 POST 到 HA 的 webhook（configuration.yaml 中的触发式模板传感器）
+import heapq
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLLERS_CONFIG_PATH = os.environ.get('HA_POLLERS_CONFIG', os.path.join(CONFIG_DIR, 'pollers.yaml'))
+DEFAULT_SNAPSHOT_PATH = os.environ.get('HA_DEVICE_STATUS', '/tmp/ha_device_status.json')
+
+DEFAULT_INTERVAL = 10         # 基础轮询间隔（秒）
+DEFAULT_BACKOFF = 2.0         # 值稳定时每次放慢的倍数
+DEFAULT_BOOST_INTERVAL = 1    # 控制命令之后的快速轮询间隔（秒）
+DEFAULT_BOOST_DURATION = 15   # 快速轮询持续时间（秒）
+MAX_WORKERS = 4               # 同时进行的查询数（同一设备上的查询由连接池串行化）
+QUERY_KEYS = ('name', 'command', 'interval', 'max_interval', 'backoff')
+
+
+class PollerError(Exception):
+    """轮询配置无效。"""
+
+
+def decode_value(response, decoder):
+    """
+    按命令的解码器（devices.yaml 的 decode，默认 number）解析响应。
+    只有一个 value 字段时返回该值本身，否则返回字段字典。
+
+    Raises:
+        DecodeError: 响应与解码器不匹配。
+    """
+    fields = decoder.decode(response)
+    if fields is not None and list(fields) == ['value']:
+        return fields['value']
+    return fields
+
+
+class PollQuery:
+    """一台设备上的一条周期查询及其调度状态。"""
+
+    def __init__(self, device, name, profile, command, interval, max_interval, backoff):
+        self.device = device
+        self.name = name
+        self.profile = profile
+        self.command = command
+        self.frame = profile.frame(command)
+        self.decoder = profile.decoder(command)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.current_interval = interval
+        self.boost_until = 0.0
+        self.generation = 0         # 重新调度时递增，堆中旧的条目随之作废
+        self.in_flight = False
+        self.value = None
+        self.error = None
+        self.polled = False
+
+    @property
+    def key(self):
+        return f"{self.device}.{self.name}"
+
+    def matches(self, ip, port):
+        settings = self.profile.settings
+        return self.profile.transport in ('tcp', 'udp') and settings['ip'] == ip and settings['port'] == int(port)
+
+
+def build_queries(config, profiles):
+    """根据 pollers.yaml 的 pollers 段和设备档案生成 PollQuery 列表。"""
+    from device_profiles import ProfileError, get_profile
+
+    defaults = config.get('defaults') or {}
+    queries = []
+    for device, entries in (config.get('pollers') or {}).items():
+        try:
+            profile = get_profile(profiles, str(device))
+        except ProfileError as e:
+            raise PollerError(str(e)) from None
+        if not isinstance(entries, list):
+            raise PollerError(f"设备 '{device}': 查询列表必须是列表")
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {'command': entry}
+            unknown = set(entry) - set(QUERY_KEYS)
+            if unknown:
+                raise PollerError(f"设备 '{device}': 未知字段 {', '.join(sorted(unknown))}")
+            if 'command' not in entry:
+                raise PollerError(f"设备 '{device}': 查询缺少 command")
+            interval = float(entry.get('interval', defaults.get('interval', DEFAULT_INTERVAL)))
+            max_interval = float(entry.get('max_interval', defaults.get('max_interval', interval * 8)))
+            backoff = float(entry.get('backoff', defaults.get('backoff', DEFAULT_BACKOFF)))
+            if interval <= 0 or max_interval < interval or backoff < 1:
+                raise PollerError(f"设备 '{device}' 查询 '{entry['command']}': "
+                                  "需要 interval > 0、max_interval >= interval、backoff >= 1")
+            try:
+                queries.append(PollQuery(str(device), str(entry.get('name', entry['command'])), profile,
+                                         str(entry['command']), interval, max_interval, backoff))
+            except ProfileError as e:
+                raise PollerError(str(e)) from None
+    return queries
+
+
+class StatusPublisher:
+    """
+    在后台线程中发布状态变化。多次变化会合并后一起发布，
+    webhook 缓慢或不可达不会拖慢轮询。
+    """
+
+    def __init__(self, snapshot_path=None, webhook_url=None, webhook_timeout=5):
+        self.snapshot_path = snapshot_path
+        self.webhook_url = webhook_url
+        self.webhook_timeout = webhook_timeout
+        self.values = {}            # device -> {query -> {value, error, updated}}
+        self._changes = queue.Queue()
+        threading.Thread(target=self._run, name="poll-publisher", daemon=True).start()
+
+    def publish(self, query):
+        self._changes.put((query.device, query.name, {
+            'value': query.value,
+            'error': query.error,
+            'updated': round(time.time(), 3),
+        }))
+
+    def _run(self):
+        while True:
+            changed = {}
+            item = self._changes.get()
+            while item is not None:
+                device, name, state = item
+                changed.setdefault(device, {})[name] = state
+                self.values.setdefault(device, {})[name] = state
+                try:
+                    item = self._changes.get_nowait()
+                except queue.Empty:
+                    item = None
+            document = {'updated': round(time.time(), 3), 'changed': changed, 'values': self.values}
+            if self.snapshot_path:
+                self._write_snapshot(document)
+            if self.webhook_url:
+                self._post(document)
+
+    def _write_snapshot(self, document):
+        temporary = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump({'updated': document['updated'], 'values': document['values']}, f, ensure_ascii=False)
+            os.replace(temporary, self.snapshot_path)
+        except OSError as e:
+            print(f"警告: 无法写入状态快照 {self.snapshot_path}: {e}")
+
+    def _post(self, document):
+        import urllib.error
+        import urllib.request
+        request = urllib.request.Request(
+            self.webhook_url, data=json.dumps(document, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.webhook_timeout):
+                pass
+        except (urllib.error.URLError, OSError) as e:
+            print(f"警告: 状态推送到 {self.webhook_url} 失败: {e}")
+
+
+class DevicePoller:
+    """按各查询自己的间隔调度轮询，查询通过 TCP 连接池（UDP 设备通过共用的 UDP socket，串口设备通过串口代理）发送。"""
+
+    def __init__(self, queries, pool, publisher, boost_interval=DEFAULT_BOOST_INTERVAL,
+                 boost_duration=DEFAULT_BOOST_DURATION, max_workers=MAX_WORKERS):
+        self.queries = queries
+        self.pool = pool
+        self.publisher = publisher
+        self.boost_interval = boost_interval
+        self.boost_duration = boost_duration
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="poll")
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def _schedule(self, query, delay):
+        # 调用方需持有 self._condition
+        query.generation += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), query.generation, query))
+        self._condition.notify()
+
+    def start(self):
+        with self._condition:
+            for index, query in enumerate(self.queries):
+                # 错开首次轮询，避免启动时所有查询同时发出
+                self._schedule(query, index * 0.05)
+        threading.Thread(target=self._run, name="poll-scheduler", daemon=True).start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    due, _, generation, query = self._heap[0]
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    if generation == query.generation and not query.in_flight:
+                        query.in_flight = True
+                        break
+                if self._stopped:
+                    return
+            self._executor.submit(self._poll, query)
+
+    def _exchange(self, query):
+        profile = query.profile
+        if profile.transport == 'tcp':
+            from device_profiles import tcp_options
+            options = tcp_options(profile)
+            return self.pool.exchange(profile.settings['ip'], profile.settings['port'], query.frame,
+                                      read_timeout=options['read_timeout'], framing=options['framing'],
+                                      connect_timeout=options['connect_timeout'])
+        if profile.transport == 'udp':
+            from device_profiles import udp_options
+            from udp_transport import shared_sender
+            replies = shared_sender().exchange(profile.settings['ip'], profile.settings['port'], query.frame,
+                                               **udp_options(profile))
+            return replies[0][1] if replies else None
+        from device_profiles import serial_options
+        from send_serial_data import send_via_broker
+        result = send_via_broker(query.frame, **serial_options(profile))
+        if result is None:
+            raise ConnectionError("串口代理未运行")
+        success, response = result
+        if not success:
+            raise ConnectionError(f"串口 {profile.settings['port']} 发送失败")
+        return response
+
+    def _poll(self, query):
+        try:
+            value, error = decode_value(self._exchange(query), query.decoder), None
+        except Exception as e:
+            value, error = query.value, f"{type(e).__name__}: {e}"
+
+        with self._condition:
+            query.in_flight = False
+            changed = not query.polled or value != query.value or (error is None) != (query.error is None)
+            query.value, query.error, query.polled = value, error, True
+            if time.monotonic() < query.boost_until:
+                delay = self.boost_interval
+            elif changed and error is None:
+                query.current_interval = query.interval
+                delay = query.interval
+            else:
+                # 值稳定或设备无响应：逐步放慢
+                query.current_interval = min(query.max_interval, query.current_interval * query.backoff)
+                delay = query.current_interval
+            if not self._stopped:
+                self._schedule(query, delay)
+        if changed:
+            self.publisher.publish(query)
+
+    def boost(self, ip=None, port=None, device=None):
+        """控制命令发出后加快相关设备的轮询。按 (ip, port) 或设备名匹配，返回受影响的查询数。"""
+        now = time.monotonic()
+        count = 0
+        with self._condition:
+            for query in self.queries:
+                if query.device == device or (ip is not None and query.matches(ip, port)):
+                    query.boost_until = now + self.boost_duration
+                    query.current_interval = query.interval
+                    if not query.in_flight:
+                        self._schedule(query, self.boost_interval)
+                    count += 1
+        return count
+
+    def status(self):
+        return {query.key: {'value': query.value, 'error': query.error,
+                            'interval': query.current_interval} for query in self.queries}
+
+
+def load_poller(pool, path=POLLERS_CONFIG_PATH):
+    """
+    读取 pollers.yaml 并创建 DevicePoller。配置文件不存在或没有任何查询时返回 None。
+
+    Raises:
+        PollerError / ProfileError: 配置无效。
+    """
+    if not os.path.exists(path):
+        return None
+    import yaml
+    from device_profiles import load_profiles
+    with open(path, encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    queries = build_queries(config, load_profiles())
+    if not queries:
+        return None
+    publish = config.get('publish') or {}
+    defaults = config.get('defaults') or {}
+    publisher = StatusPublisher(publish.get('snapshot', DEFAULT_SNAPSHOT_PATH), publish.get('webhook'))
+    return DevicePoller(queries, pool, publisher,
+                        boost_interval=float(defaults.get('boost_interval', DEFAULT_BOOST_INTERVAL)),
+                        boost_duration=float(defaults.get('boost_duration', DEFAULT_BOOST_DURATION)))
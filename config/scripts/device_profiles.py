@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# device_profiles.py
+# 设备档案注册表：读取 devices.yaml，校验每台设备的设置，并把所有具名命令一次性编译成
+# 可直接发送的字节帧（十六进制解析、文本编码、后缀、校验和都在编译时完成）。
+# 编译结果缓存在 COMPILED_CACHE_PATH，设备档案未修改时后续调用无需再解析 YAML。
+#
+# 用法:
+#   python device_profiles.py check              校验并列出所有命令的字节帧
+#   python device_profiles.py send <设备> <命令> [--read-response]
+import argparse
+import codecs
+import json
+import os
+import sys
+
+from send_tcp_command import hex_string_to_bytes
+
+CONFIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEVICES_CONFIG_PATH = os.environ.get('HA_DEVICES_CONFIG', os.path.join(CONFIG_DIR, 'devices.yaml'))
+COMPILED_CACHE_PATH = os.environ.get('HA_DEVICES_CACHE', '/tmp/ha_devices.compiled.json')
+CACHE_FORMAT = 4    # 编译缓存的格式版本，缓存内容或校验规则变化时递增，使旧缓存失效
+
+TRANSPORTS = ('tcp', 'udp', 'serial')
+TCP_SETTINGS = ('ip', 'port', 'framing', 'connect_timeout', 'read_timeout', 'coalesce_window')
+UDP_SETTINGS = ('ip', 'port', 'reply_window', 'broadcast', 'coalesce_window')
+SERIAL_SETTINGS = ('port', 'baudrate', 'bytesize', 'parity', 'stopbits', 'timeout',
+                   'response_mode', 'terminator', 'expected_length', 'coalesce_window')
+ENCODING_KEYS = ('hex', 'encoding', 'suffix', 'checksum')
+DECODE_KEY = 'decode'     # 响应解码器（见 response_decoders.py），可在设备级或单条命令上设置
+COALESCE_KEY = 'coalesce' # 合并组（见 command_coalescer.py），同组命令连续触发时只发送最后一条
+
+
+class ProfileError(Exception):
+    """设备档案无效，或引用了不存在的设备/命令。"""
+
+
+# ======== 校验和（编译时计算并写入字节帧） ========
+
+def _sum8(data):
+    return bytes([sum(data) & 0xFF])
+
+def _xor8(data):
+    value = 0
+    for byte in data:
+        value ^= byte
+    return bytes([value])
+
+def _crc16_modbus(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc.to_bytes(2, 'little')
+
+CHECKSUMS = {
+    'sum8': _sum8,
+    'xor8': _xor8,
+    'crc16_modbus': _crc16_modbus,
+}
+
+
+def _apply_checksum(frame, spec, context):
+    if isinstance(spec, str):
+        spec = {'type': spec}
+    if not isinstance(spec, dict):
+        raise ProfileError(f"{context}: checksum 必须是字符串或字典")
+    function = CHECKSUMS.get(spec.get('type'))
+    if function is None:
+        raise ProfileError(f"{context}: 未知的校验方式 '{spec.get('type')}'，可选: {', '.join(CHECKSUMS)}")
+    # start: 参与计算的起始字节；insert_at: 校验和插入的位置（默认追加到末尾，-1 表示最后一个字节之前）
+    start = int(spec.get('start', 0))
+    insert_at = spec.get('insert_at')
+    insert_at = len(frame) if insert_at is None else int(insert_at)
+    if insert_at < 0:
+        insert_at += len(frame)
+    if not 0 <= start <= insert_at <= len(frame):
+        raise ProfileError(f"{context}: 校验范围无效 (start={start}, insert_at={insert_at})")
+    return frame[:insert_at] + function(frame[start:insert_at]) + frame[insert_at:]
+
+
+# ======== 编译 ========
+
+def _compile_command(device_name, command_name, entry, defaults):
+    context = f"设备 '{device_name}' 命令 '{command_name}'"
+    options = dict(defaults)
+    if isinstance(entry, dict):
+        unknown = set(entry) - {'data', DECODE_KEY, COALESCE_KEY, *ENCODING_KEYS}
+        if unknown:
+            raise ProfileError(f"{context}: 未知字段 {', '.join(sorted(unknown))}")
+        if 'data' not in entry:
+            raise ProfileError(f"{context}: 缺少 data")
+        options.update({key: entry[key] for key in ENCODING_KEYS if key in entry})
+        data = entry['data']
+    else:
+        data = entry
+    data = '' if data is None else str(data)
+
+    try:
+        if options.get('hex'):
+            frame = hex_string_to_bytes(data)
+            suffix = hex_string_to_bytes(str(options.get('suffix') or ''))
+        else:
+            encoding = options.get('encoding') or 'utf-8'
+            suffix_text = codecs.decode(str(options.get('suffix') or ''), 'unicode_escape')
+            frame = data.encode(encoding)
+            suffix = suffix_text.encode(encoding)
+    except (ValueError, LookupError, UnicodeError) as e:
+        raise ProfileError(f"{context}: {e}") from e
+
+    if options.get('checksum'):
+        frame = _apply_checksum(frame, options['checksum'], context)
+    return frame + suffix
+
+
+def _check_decoder(spec, context):
+    from response_decoders import DecoderSpecError, compile_decoder
+    try:
+        compile_decoder(spec)
+    except DecoderSpecError as e:
+        raise ProfileError(f"{context}: {e}") from e
+    return spec
+
+
+class DeviceProfile:
+    """一台设备的传输设置、已编译的命令帧和响应解码器。"""
+
+    def __init__(self, name, transport, settings, commands, decoders=None, coalesce=None):
+        self.name = name
+        self.transport = transport
+        self.settings = settings    # ip/port 或串口参数，以及响应读取设置
+        self.commands = commands    # 命令名 -> bytes
+        self.decoders = decoders or {}  # 命令名 -> 解码器定义（None 表示默认的 number）
+        self.coalesce = coalesce or {}  # 命令名 -> 合并组
+        self._compiled_decoders = {}
+
+    def frame(self, command_name):
+        try:
+            return self.commands[command_name]
+        except KeyError:
+            raise ProfileError(
+                f"设备 '{self.name}' 没有命令 '{command_name}'，可选: {', '.join(self.commands)}") from None
+
+    def decoder(self, command_name):
+        """命令的响应解码器，每个进程只编译一次。"""
+        decoder = self._compiled_decoders.get(command_name)
+        if decoder is None:
+            from response_decoders import compile_decoder
+            decoder = self._compiled_decoders[command_name] = compile_decoder(self.decoders.get(command_name))
+        return decoder
+
+    def coalesce_key(self, command_name):
+        """命令的合并键（"设备名:合并组"），命令不属于任何合并组时为 None。"""
+        group = self.coalesce.get(command_name)
+        return f"{self.name}:{group}" if group else None
+
+    def to_dict(self):
+        return {
+            'transport': self.transport,
+            'settings': self.settings,
+            'commands': {name: frame.hex() for name, frame in self.commands.items()},
+            'decoders': self.decoders,
+            'coalesce': self.coalesce,
+        }
+
+    @classmethod
+    def from_dict(cls, name, data):
+        commands = {command: bytes.fromhex(frame) for command, frame in data['commands'].items()}
+        return cls(name, data['transport'], data['settings'], commands, data.get('decoders'), data.get('coalesce'))
+
+
+def compile_device(name, config):
+    """校验一台设备的配置并编译其所有命令。"""
+    if not isinstance(config, dict):
+        raise ProfileError(f"设备 '{name}': 配置必须是字典")
+    transport = config.get('transport', 'tcp')
+    if transport not in TRANSPORTS:
+        raise ProfileError(f"设备 '{name}': 未知的传输方式 '{transport}'，可选: {', '.join(TRANSPORTS)}")
+    allowed = {'tcp': TCP_SETTINGS, 'udp': UDP_SETTINGS}.get(transport, SERIAL_SETTINGS)
+    unknown = set(config) - {'transport', 'commands', DECODE_KEY, COALESCE_KEY, *allowed, *ENCODING_KEYS}
+    if unknown:
+        raise ProfileError(f"设备 '{name}': 未知字段 {', '.join(sorted(unknown))}")
+
+    settings = {key: config[key] for key in allowed if key in config}
+    if transport in ('tcp', 'udp'):
+        if 'ip' not in settings or 'port' not in settings:
+            raise ProfileError(f"设备 '{name}': {transport.upper()} 设备需要 ip 和 port")
+        try:
+            settings['port'] = int(settings['port'])
+        except (TypeError, ValueError):
+            raise ProfileError(f"设备 '{name}': 无效的端口 '{settings['port']}'") from None
+        if 'framing' in settings:
+            from framing import parse_framing
+            try:
+                parse_framing(settings['framing'])
+            except ValueError as e:
+                raise ProfileError(f"设备 '{name}': {e}") from e
+    else:
+        if 'port' not in settings:
+            raise ProfileError(f"设备 '{name}': 串口设备需要 port")
+        if str(settings.get('parity', 'N')) not in ('N', 'E', 'O', 'M', 'S'):
+            raise ProfileError(f"设备 '{name}': 无效的校验位 '{settings['parity']}'")
+        from send_serial_data import DEFAULT_RESPONSE_MODE, check_response_mode
+        try:
+            check_response_mode(settings.get('response_mode', DEFAULT_RESPONSE_MODE),
+                                int(settings.get('expected_length', 0)))
+        except (TypeError, ValueError) as e:
+            raise ProfileError(f"设备 '{name}': {e}") from e
+
+    defaults = {key: config[key] for key in ENCODING_KEYS if key in config}
+    commands = config.get('commands') or {}
+    if not isinstance(commands, dict):
+        raise ProfileError(f"设备 '{name}': commands 必须是字典")
+    compiled = {str(command): _compile_command(name, command, entry, defaults)
+                for command, entry in commands.items()}
+    decoders = {}
+    for command, entry in commands.items():
+        spec = entry.get(DECODE_KEY) if isinstance(entry, dict) and DECODE_KEY in entry else config.get(DECODE_KEY)
+        if spec is not None:
+            decoders[str(command)] = _check_decoder(spec, f"设备 '{name}' 命令 '{command}'")
+    coalesce = {}
+    for command, entry in commands.items():
+        group = entry.get(COALESCE_KEY) if isinstance(entry, dict) and COALESCE_KEY in entry else config.get(COALESCE_KEY)
+        if group:
+            coalesce[str(command)] = str(group)
+    return DeviceProfile(name, transport, settings, compiled, decoders, coalesce)
+
+
+def compile_profiles(config):
+    return {str(name): compile_device(str(name), device) for name, device in (config or {}).items()}
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'source': os.path.abspath(path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+            'format': CACHE_FORMAT}
+
+
+def load_profiles(path=DEVICES_CONFIG_PATH, cache_path=COMPILED_CACHE_PATH):
+    """
+    加载设备档案。设备档案未修改时直接读取编译缓存，否则重新校验、编译并更新缓存。
+
+    Raises:
+        ProfileError: 设备档案无效。
+        OSError: 设备档案无法读取。
+    """
+    stamp = _source_stamp(path)
+    if cache_path:
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('stamp') == stamp:
+                return {name: DeviceProfile.from_dict(name, data) for name, data in cached['devices'].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    import yaml
+    with open(path, encoding='utf-8') as f:
+        profiles = compile_profiles(yaml.safe_load(f))
+
+    if cache_path:
+        temporary = f"{cache_path}.{os.getpid()}"
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump({'stamp': stamp, 'devices': {name: profile.to_dict()
+                                                       for name, profile in profiles.items()}}, f)
+            os.replace(temporary, cache_path)
+        except OSError:
+            pass
+    return profiles
+
+
+def get_profile(profiles, device_name):
+    try:
+        return profiles[device_name]
+    except KeyError:
+        raise ProfileError(f"未知的设备 '{device_name}'，可选: {', '.join(profiles)}") from None
+
+
+# ======== 发送 ========
+
+def tcp_options(profile):
+    """TCP 设备的连接 / 读取参数（tcp_exchange 与连接池共用的关键字参数）。"""
+    from send_tcp_command import DEFAULT_CONNECT_TIMEOUT, DEFAULT_FRAMING, DEFAULT_READ_TIMEOUT
+    settings = profile.settings
+    return {
+        'connect_timeout': float(settings.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+        'read_timeout': float(settings.get('read_timeout', DEFAULT_READ_TIMEOUT)),
+        'framing': settings.get('framing', DEFAULT_FRAMING),
+    }
+
+
+def udp_options(profile):
+    """UDP 设备收集应答的时间和是否为广播目标（udp_exchange 与守护进程共用的关键字参数）。"""
+    from udp_transport import DEFAULT_REPLY_WINDOW
+    return {'reply_window': float(profile.settings.get('reply_window', DEFAULT_REPLY_WINDOW)),
+            'broadcast': bool(profile.settings.get('broadcast', False))}
+
+
+def serial_options(profile, read_response=True):
+    """串口设备的参数（send_serial_data / send_via_broker 的关键字参数）。"""
+    import send_serial_data as serial_transport
+    settings = profile.settings
+    return {
+        'port': settings['port'],
+        'baudrate': int(settings.get('baudrate', serial_transport.DEFAULT_BAUDRATE)),
+        'bytesize': int(settings.get('bytesize', serial_transport.DEFAULT_BYTESIZE)),
+        'parity': str(settings.get('parity', serial_transport.DEFAULT_PARITY)),
+        'stopbits': float(settings.get('stopbits', serial_transport.DEFAULT_STOPBITS)),
+        'timeout': float(settings.get('timeout', serial_transport.DEFAULT_TIMEOUT)),
+        'read_response': read_response,
+        'response_mode': settings.get('response_mode', serial_transport.DEFAULT_RESPONSE_MODE),
+        'terminator': codecs.decode(str(settings.get('terminator', '\\r')), 'unicode_escape').encode('latin-1'),
+        'expected_length': int(settings.get('expected_length', 0)),
+    }
+
+
+def send_command(profile, command_name, read_response=True):
+    """
+    发送设备的一条具名命令。
+    属于合并组的命令经守护进程 / 串口代理发送时，同组命令连续触发只发送最后一条（见 command_coalescer.py）。
+
+    Returns:
+        bytes | None: 设备的响应；被同组更新的命令取代时为 None。
+
+    Raises:
+        ProfileError: 命令不存在。
+        OSError / ConnectionError: 发送失败。
+    """
+    frame = profile.frame(command_name)
+    settings = profile.settings
+    coalesce = {'coalesce_key': profile.coalesce_key(command_name)}
+    if 'coalesce_window' in settings:
+        coalesce['coalesce_window'] = float(settings['coalesce_window'])
+    if profile.transport == 'tcp':
+        from send_tcp_command import send_via_daemon, tcp_exchange
+        options = tcp_options(profile)
+        reply = send_via_daemon(settings['ip'], settings['port'], frame, read_response, **options, **coalesce)
+        if reply is None:
+            return tcp_exchange(settings['ip'], settings['port'], frame, read_response, **options)
+        if not reply.get('ok'):
+            raise ConnectionError(reply.get('error'))
+        return bytes.fromhex(reply['response']) if reply.get('response') else None
+    if profile.transport == 'udp':
+        from send_tcp_command import send_via_daemon, udp_exchange
+        options = udp_options(profile)
+        reply = send_via_daemon(settings['ip'], settings['port'], frame, read_response, transport='udp',
+                                **options, **coalesce)
+        if reply is None:
+            replies = udp_exchange(settings['ip'], settings['port'], frame, read_response, **options)
+            return replies[0][1] if replies else None
+        if not reply.get('ok'):
+            raise ConnectionError(reply.get('error'))
+        return bytes.fromhex(reply['response']) if reply.get('response') else None
+
+    import send_serial_data as serial_transport
+    options = serial_options(profile, read_response)
+    result = serial_transport.send_via_broker(frame, **options, **coalesce)
+    if result is None:
+        result = serial_transport.send_serial_data(frame, **options)
+    success, response = result
+    if not success:
+        raise ConnectionError(f"串口 {settings['port']} 发送失败")
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="设备档案：校验、列出并按名称发送命令。")
+    parser.add_argument("--config", default=DEVICES_CONFIG_PATH, help=f"设备档案文件 (默认: {DEVICES_CONFIG_PATH})")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("check", help="校验设备档案并列出编译后的字节帧")
+    send = sub.add_parser("send", help="发送一条具名命令")
+    send.add_argument("device")
+    send.add_argument("command")
+    send.add_argument("--read-response", default="true", help="是否读取响应 (true/false，默认: true)")
+    args = parser.parse_args()
+
+    try:
+        profiles = load_profiles(args.config)
+        if args.action == 'check':
+            for profile in profiles.values():
+                print(f"[{profile.name}] {profile.transport} {profile.settings}")
+                for command, frame in profile.commands.items():
+                    decoder = f"  -> {profile.decoder(command)!r}" if command in profile.decoders else ""
+                    group = f"  [合并组 {profile.coalesce[command]}]" if command in profile.coalesce else ""
+                    print(f"  {command:<20} {frame.hex(' ').upper()}{group}{decoder}")
+            print(f"设备档案有效: {len(profiles)} 台设备，"
+                  f"{sum(len(profile.commands) for profile in profiles.values())} 条命令。")
+            return 0
+
+        profile = get_profile(profiles, args.device)
+        frame = profile.frame(args.command)
+        print(f"发送 {profile.name}.{args.command} ({profile.transport}): {frame.hex().upper()}")
+        response = send_command(profile, args.command, args.read_response.lower() == 'true')
+    except (ProfileError, OSError, ConnectionError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    if not response:
+        print("未收到响应。")
+        return 0
+    try:
+        print(f"收到响应 (文本): '{response.decode('utf-8').strip()}'")
+    except UnicodeDecodeError:
+        print(f"收到响应 (HEX): {response.hex().upper()}")
+    if args.command in profile.decoders:
+        from response_decoders import DecodeError
+        try:
+            print(f"解析结果: {json.dumps(profile.decoder(args.command).decode(response), ensure_ascii=False)}")
+        except DecodeError as e:
+            print(f"错误: 无法解析响应: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+# fake_devices.py
+# 本地替身设备，用于基准测试和回放，不需要真实的矩阵或串口设备。
+#   FakeTcpDevice  本地 TCP 服务器，模拟矩阵：可配置应答延迟、分段发送、沉默（不应答）
+#   FakeUdpDevice  本地 UDP 设备：每个数据报回一个应答数据报，可配置应答延迟、沉默
+#   FakePtyDevice  基于 pty 的串口设备模拟器：pyserial 可以像打开真实串口一样打开它的从端
+import os
+import select
+import socket
+import threading
+import time
+import tty
+
+
+class FakeTcpDevice:
+    """
+    模拟 TCP 设备。收到一包数据后等待 `reply_delay` 秒，再把 `reply`（默认回显 b'OK ' + 请求）
+    按 `fragment_size` 字节分段、段间隔 `fragment_gap` 秒发回。
+    请求以 `silent_prefix` 开头时不应答，用于模拟设备不回复的情况。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, reply_delay=0.0, fragment_size=0, fragment_gap=0.0,
+                 reply=None, suffix=b'\r', silent_prefix=b'silent'):
+        self.reply_delay = reply_delay
+        self.fragment_size = fragment_size
+        self.fragment_gap = fragment_gap
+        self.reply = reply
+        self.suffix = suffix
+        self.silent_prefix = silent_prefix
+        self.received = []
+        self._server = socket.create_server((host, port), reuse_port=False)
+        self._server.settimeout(0.2)
+        self.host, self.port = self._server.getsockname()[:2]
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _respond(self, request):
+        if self.silent_prefix and request.startswith(self.silent_prefix):
+            return None
+        if callable(self.reply):
+            return self.reply(request)
+        if self.reply is not None:
+            return self.reply
+        return b'OK ' + request.rstrip(b'\r\n') + self.suffix
+
+    def _handle(self, conn):
+        with conn:
+            conn.settimeout(0.2)
+            while not self._stopped.is_set():
+                try:
+                    request = conn.recv(4096)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                if not request:
+                    return
+                self.received.append(request)
+                response = self._respond(request)
+                if not response:
+                    continue
+                if self.reply_delay:
+                    time.sleep(self.reply_delay)
+                size = self.fragment_size or len(response)
+                try:
+                    for offset in range(0, len(response), size):
+                        if offset and self.fragment_gap:
+                            time.sleep(self.fragment_gap)
+                        conn.sendall(response[offset:offset + size])
+                except OSError:
+                    return
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, name=f"fake-tcp-{self.port}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._server.close()
+        if self._thread:
+            self._thread.join(1)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeUdpDevice:
+    """
+    模拟 UDP 设备。收到一个数据报后等待 `reply_delay` 秒，把 `reply`（默认回显 b'OK ' + 请求）作为一个数据报发回来源地址。
+    请求以 `silent_prefix` 开头时不应答。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, reply_delay=0.0, reply=None, suffix=b'\r', silent_prefix=b'silent'):
+        self.reply_delay = reply_delay
+        self.reply = reply
+        self.suffix = suffix
+        self.silent_prefix = silent_prefix
+        self.received = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.2)
+        self.host, self.port = self._sock.getsockname()[:2]
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _respond(self, request):
+        if self.silent_prefix and request.startswith(self.silent_prefix):
+            return None
+        if callable(self.reply):
+            return self.reply(request)
+        if self.reply is not None:
+            return self.reply
+        return b'OK ' + request.rstrip(b'\r\n') + self.suffix
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                request, source = self._sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.received.append(request)
+            response = self._respond(request)
+            if not response:
+                continue
+            if self.reply_delay:
+                time.sleep(self.reply_delay)
+            try:
+                self._sock.sendto(response, source)
+            except OSError:
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, name=f"fake-udp-{self.port}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(1)
+        self._sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakePtyDevice:
+    """
+    模拟串口设备。`path` 是 pty 从端的路径，传给 serial.Serial(port=path) 即可。
+    收到数据后等待 `reply_delay` 秒，然后按 `baudrate` 对应的字符时间逐段写回应答，
+    以便接近真实串口线路上的到达节奏。
+    """
+
+    def __init__(self, reply_delay=0.0, baudrate=0, reply=None, suffix=b'\r', silent_prefix=b'silent'):
+        self.reply_delay = reply_delay
+        self.baudrate = baudrate
+        self.reply = reply
+        self.suffix = suffix
+        self.silent_prefix = silent_prefix
+        self.received = []
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _respond(self, request):
+        if self.silent_prefix and request.startswith(self.silent_prefix):
+            return None
+        if callable(self.reply):
+            return self.reply(request)
+        if self.reply is not None:
+            return self.reply
+        return b'OK ' + request.rstrip(b'\r\n') + self.suffix
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.2)
+            if not readable:
+                continue
+            try:
+                request = os.read(self._master, 4096)
+            except OSError:
+                return
+            self.received.append(request)
+            response = self._respond(request)
+            if not response:
+                continue
+            if self.reply_delay:
+                time.sleep(self.reply_delay)
+            if self.baudrate:
+                # 每 8 个字符写一次，按 10 位/字符的线路时间控制节奏
+                for offset in range(0, len(response), 8):
+                    chunk = response[offset:offset + 8]
+                    os.write(self._master, chunk)
+                    time.sleep(len(chunk) * 10 / self.baudrate)
+            else:
+                os.write(self._master, response)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, name="fake-pty", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(1)
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# fast_send.py
+# 快速启动的发送入口：shell_command 每发一条命令就启动一个 Python 进程，解释器启动和导入占了大部分耗时。
+# 与 send_tcp_command.py / send_serial_data.py 相比:
+#   - 常用的位置参数形式不经过 argparse，也不做只在详细日志下才输出的格式化；
+#   - 只导入当前路径真正用到的模块：TCP 编码和收发来自 tcp_wire.py、守护进程通信来自 unix_ipc.py
+#     （与完整入口共用同一份实现），两者都直接使用 _socket（socket 模块导入时要构造一批 IntEnum，
+#     比解释器启动本身还慢），连接池守护进程 / 串口代理运行时才导入 json；
+#   - 可以用 python -S 运行（不扫描 site-packages）：TCP 和经串口代理的串口发送只用标准库，
+#     只有直接打开串口（需要 pyserial）时才补做 site 初始化。
+# 熔断器（device_health.py）、流量追踪（trace_ring.py）和传输指标（transport_metrics.py）与完整入口相同。
+# 带 -- 选项的调用原样交给完整的 send_tcp_command.py / send_serial_data.py 处理。
+#
+# 用法:
+#   python -S fast_send.py tcp <ip> <port> <command> [append_cr] [send_hex] [encoding]
+#   python -S fast_send.py serial <data> [port] [baudrate] [is_hex] [read_response]
+# 位置参数的含义与 send_tcp_command.py / send_serial_data.py 相同，true/false 不区分大小写。
+# 启动耗时预算（相对空解释器的倍数 STARTUP_BUDGET_RATIO）由 startup_check.py 检查，修改本脚本或它导入的模块后运行 python startup_check.py。
+import os
+import sys
+
+import tcp_wire
+from transport_metrics import DETAIL, QUIET, SUMMARY, CallMetrics, vprint
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DAEMON_SOCKET_PATH = os.environ.get('HA_TCP_DAEMON_SOCKET', '/tmp/ha_tcp_daemon.sock')
+BROKER_SOCKET_PATH = os.environ.get('HA_SERIAL_BROKER_SOCKET', '/tmp/ha_serial_broker.sock')
+
+# 与 send_serial_data.py 的默认值相同（TCP 的默认值见 tcp_wire.py）
+DEFAULT_SERIAL_PORT = '/dev/ttyS1'
+DEFAULT_BAUDRATE = 9600
+DEFAULT_SERIAL_TIMEOUT = 1
+BROKER_WAIT_TIMEOUT = 25
+
+USAGE = ("用法: fast_send.py tcp <ip> <port> <command> [append_cr] [send_hex] [encoding]\n"
+         "      fast_send.py serial <data> [port] [baudrate] [is_hex] [read_response]")
+
+
+class UsageError(Exception):
+    """位置参数无效。"""
+
+
+def _enable_site():
+    """以 python -S 运行时补做 site 初始化，使 site-packages 中的模块（pyserial、yaml）可以导入。"""
+    if sys.flags.no_site:
+        import site
+        site.main()
+
+
+def _full_cli(script, argv):
+    """把调用原样交给完整的命令行入口（带选项的调用、或位置参数以外的用法）。"""
+    import runpy
+    _enable_site()
+    sys.argv = [os.path.join(SCRIPTS_DIR, script)] + argv
+    runpy.run_path(sys.argv[0], run_name='__main__')
+    return 0
+
+
+def _flag(value):
+    return value.lower() == 'true'
+
+
+def _ipc_request(path, payload, timeout):
+    """
+    向守护进程发送一个请求（见 unix_ipc.request）。
+
+    Returns:
+        dict | None: 守护进程的响应；守护进程未运行（socket 不存在或已退出）时返回 None。
+
+    Raises:
+        OSError: 守护进程在运行但通信失败（超时、连接中断、返回了无效的响应）。
+    """
+    if not os.path.exists(path):
+        return None
+    import unix_ipc
+    try:
+        return unix_ipc.request(path, payload, timeout)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # socket 文件残留但守护进程已退出
+        return None
+
+
+def _print_response(response):
+    """与 send_tcp_command.print_response 的摘要输出相同。"""
+    try:
+        vprint(SUMMARY, f"收到响应 (文本): '{response.decode('utf-8').strip()}'")
+    except UnicodeDecodeError:
+        vprint(SUMMARY, f"收到响应 (无法解码，HEX): {response.hex().upper()}")
+
+
+def _daemon_reply(reply, metrics, sent):
+    """处理守护进程 / 串口代理的响应（格式见 tcp_pool.py / serial_broker.py）。返回设备的响应。"""
+    metrics.mark('response')
+    metrics.bytes_sent = sent
+    if not reply.get('ok'):
+        metrics.finish(reply.get('error', 'Error').split(':', 1)[0])
+        raise ConnectionError(reply.get('error'))
+    if reply.get('suppressed'):
+        vprint(SUMMARY, "与上一次发送的内容相同，未重复发送。")
+    response = bytes.fromhex(reply['response']) if reply.get('response') else None
+    metrics.bytes_received = len(response or b'')
+    metrics.finish()
+    return response
+
+
+# ======== TCP ========
+
+def send_tcp(argv, metrics):
+    if len(argv) < 3 or len(argv) > 6:
+        raise UsageError("tcp 需要 <ip> <port> <command> [append_cr] [send_hex] [encoding]")
+    ip, port, command = argv[0], argv[1], argv[2]
+    append_cr = _flag(argv[3]) if len(argv) > 3 else False
+    send_hex = _flag(argv[4]) if len(argv) > 4 else False
+    encoding = argv[5] if len(argv) > 5 and argv[5] else 'utf-8'
+    try:
+        port = int(port)
+    except ValueError:
+        raise UsageError(f"无效的端口 '{port}'") from None
+    metrics.target = f"{ip}:{port}"
+    metrics.mark('parse')
+
+    try:
+        data = tcp_wire.encode_tcp_payload(command, append_cr, send_hex, encoding)
+    except (ValueError, LookupError) as e:
+        vprint(QUIET, f"错误: {e}")
+        metrics.finish(e)
+        return 1
+    metrics.mark('encode')
+    vprint(SUMMARY, f"{ip}:{port} 发送 (HEX): {data.hex().upper()}")
+    metrics.skip()
+
+    connect_timeout, read_timeout = tcp_wire.DEFAULT_CONNECT_TIMEOUT, tcp_wire.DEFAULT_READ_TIMEOUT
+    request = {'ip': ip, 'port': port, 'data': data.hex(), 'read_response': True,
+               'read_timeout': read_timeout, 'connect_timeout': connect_timeout, 'framing': tcp_wire.DEFAULT_FRAMING}
+    try:
+        reply = _ipc_request(DAEMON_SOCKET_PATH, request, connect_timeout + read_timeout + 5)
+        if reply is not None:
+            vprint(DETAIL, "数据已通过连接池守护进程发送。")
+            response = _daemon_reply(reply, metrics, len(data))
+        else:
+            response = tcp_wire.tcp_exchange(ip, port, data, metrics=metrics)
+            metrics.finish()
+    except ConnectionRefusedError as e:
+        metrics.finish(e)
+        vprint(QUIET, "错误: 连接被拒绝。请检查 IP 地址和端口，或目标设备是否在线。")
+        return 0
+    except TimeoutError as e:
+        metrics.finish(e)
+        vprint(QUIET, "错误: Socket 操作超时（连接或发送）。")
+        return 0
+    except OSError as e:
+        # 包括熔断器打开（DeviceUnavailableError）和守护进程报告的错误；与 send_tcp_command.py 一样不以非零码退出
+        if metrics.error is None:
+            metrics.finish(e)
+        vprint(QUIET, f"错误: {e}")
+        return 0
+    if response:
+        _print_response(response)
+    else:
+        vprint(SUMMARY, f"未收到响应（在 {read_timeout} 秒内未收到数据）。")
+    return 0
+
+
+# ======== 串口 ========
+
+def send_serial(argv, metrics):
+    if not 1 <= len(argv) <= 5:
+        raise UsageError("serial 需要 <data> [port] [baudrate] [is_hex] [read_response]")
+    data = argv[0]
+    port = argv[1] if len(argv) > 1 and argv[1] else DEFAULT_SERIAL_PORT
+    try:
+        baudrate = int(argv[2]) if len(argv) > 2 and argv[2] else DEFAULT_BAUDRATE
+    except ValueError:
+        raise UsageError(f"无效的波特率 '{argv[2]}'") from None
+    is_hex = _flag(argv[3]) if len(argv) > 3 else False
+    read_response = _flag(argv[4]) if len(argv) > 4 else False
+    metrics.target = port
+    if is_hex:
+        try:
+            data = bytes.fromhex(data.replace(" ", ""))
+        except ValueError as e:
+            vprint(QUIET, f"错误: 无效的十六进制数据 '{data}' - {e}", file=sys.stderr)
+            metrics.finish(e)
+            return 1
+    else:
+        # 与 send_serial_data.encode_data 相同：默认 ASCII，无法编码时回退到 UTF-8
+        data = data.encode('ascii') if data.isascii() else data.encode('utf-8')
+    metrics.mark('parse')
+
+    request = {'port': port, 'baudrate': baudrate, 'bytesize': 8, 'parity': 'N', 'stopbits': 1,
+               'timeout': DEFAULT_SERIAL_TIMEOUT, 'data': data.hex(), 'read_response': read_response,
+               'response_mode': 'sleep', 'terminator': '0d', 'expected_length': 0, 'gap': None,
+               'wait_timeout': BROKER_WAIT_TIMEOUT}
+    try:
+        reply = _ipc_request(BROKER_SOCKET_PATH, request, DEFAULT_SERIAL_TIMEOUT + 30)
+    except OSError as e:
+        metrics.finish(e)
+        vprint(QUIET, f"串口代理错误: {e}", file=sys.stderr)
+        return 1
+    if reply is None:
+        # 没有串口代理：直接打开串口需要 pyserial
+        _enable_site()
+        from send_serial_data import send_serial_data
+        success, response = send_serial_data(data, port=port, baudrate=baudrate, read_response=read_response,
+                                             metrics=metrics)
+        return 0 if success else 1
+    try:
+        response = _daemon_reply(reply, metrics, len(data))
+    except ConnectionError as e:
+        vprint(QUIET, f"串口代理错误: {e}", file=sys.stderr)
+        return 1
+    if read_response:
+        vprint(SUMMARY, f"收到响应: {response!r}" if response else "未收到响应.")
+    return 0
+
+
+TRANSPORTS = {
+    'tcp': (send_tcp, 'send_tcp_command.py'),
+    'serial': (send_serial, 'send_serial_data.py'),
+}
+
+
+def main(argv):
+    if not argv or argv[0] not in TRANSPORTS:
+        print(USAGE, file=sys.stderr)
+        return 2
+    handler, full_script = TRANSPORTS[argv[0]]
+    if any(arg.startswith('--') for arg in argv[1:]):
+        return _full_cli(full_script, argv[1:])
+    metrics = CallMetrics(argv[0], None, process_start=True)
+    try:
+        return handler(argv[1:], metrics)
+    except UsageError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,146 @@
+# framing.py
+# TCP 响应分帧：按终止符、固定长度、长度前缀或空闲间隔判断一帧响应何时结束。
+# 一旦收到完整的一帧立即返回，不再等待固定的超时时间，也不会截断超过 1024 字节或分段到达的响应。
+import codecs
+import time
+
+MAX_FRAME_SIZE = 65536    # 单帧响应的最大字节数，防止异常设备无限发送
+RECV_BUFFER_SIZE = 4096
+
+FRAMING_MODES = ('once', 'terminator', 'length', 'prefix', 'idle')
+
+
+class ResponseFraming:
+    """
+    响应分帧规则。
+
+    mode:
+        once        旧行为：只调用一次 recv()，收到多少算多少。
+        terminator  读到终止符（例如 b'\\r'）为止，返回值包含终止符。
+        length      读满固定的 `length` 字节为止。
+        prefix      帧头为 `prefix_size` 字节的无符号长度，随后是该长度的数据。
+        idle        收到首字节后，连续 `idle_gap` 秒没有新数据即认为一帧结束。
+    """
+
+    def __init__(self, mode='once', terminator=b'\r', length=0, prefix_size=2,
+                 byteorder='big', idle_gap=0.05, max_size=MAX_FRAME_SIZE):
+        if mode not in FRAMING_MODES:
+            raise ValueError(f"未知的分帧模式 '{mode}'，可选: {', '.join(FRAMING_MODES)}")
+        if mode == 'terminator' and not terminator:
+            raise ValueError("terminator 模式需要非空的终止符。")
+        if mode == 'length' and length <= 0:
+            raise ValueError("length 模式需要正整数长度。")
+        if mode == 'prefix' and prefix_size not in (1, 2, 4):
+            raise ValueError("prefix 模式的帧头长度只能是 1、2 或 4 字节。")
+        self.mode = mode
+        self.terminator = terminator
+        self.length = length
+        self.prefix_size = prefix_size
+        self.byteorder = byteorder
+        self.idle_gap = idle_gap
+        self.max_size = max_size
+
+    def __repr__(self):
+        return f"ResponseFraming(mode={self.mode!r})"
+
+    def complete_size(self, buffer):
+        """如果 `buffer` 中已有完整的一帧，返回帧长度；否则返回 None。"""
+        if self.mode == 'terminator':
+            index = buffer.find(self.terminator)
+            return None if index < 0 else index + len(self.terminator)
+        if self.mode == 'length':
+            return self.length if len(buffer) >= self.length else None
+        if self.mode == 'prefix':
+            if len(buffer) < self.prefix_size:
+                return None
+            size = self.prefix_size + int.from_bytes(buffer[:self.prefix_size], self.byteorder)
+            return size if len(buffer) >= size else None
+        # once / idle 模式没有帧内结束标志
+        return None
+
+
+def parse_framing(spec):
+    """
+    把命令行 / 服务调用中的分帧描述解析为 ResponseFraming。
+
+    支持的写法::
+
+        once
+        terminator            (默认终止符 \\r)
+        terminator:\\r\\n       (支持反斜杠转义)
+        length:12
+        prefix:2              (2 字节大端长度)
+        prefix:2:little
+        idle:0.05             (空闲间隔，秒)
+    """
+    if isinstance(spec, ResponseFraming):
+        return spec
+    if not spec:
+        return ResponseFraming()
+    mode, _, arg = spec.partition(':')
+    mode = mode.strip().lower()
+    if mode == 'terminator':
+        terminator = codecs.decode(arg, 'unicode_escape').encode('latin-1') if arg else b'\r'
+        return ResponseFraming('terminator', terminator=terminator)
+    if mode == 'length':
+        return ResponseFraming('length', length=int(arg))
+    if mode == 'prefix':
+        size, _, byteorder = arg.partition(':')
+        return ResponseFraming('prefix', prefix_size=int(size or 2), byteorder=byteorder or 'big')
+    if mode == 'idle':
+        return ResponseFraming('idle', idle_gap=float(arg) if arg else 0.05)
+    return ResponseFraming(mode)
+
+
+def read_frame(sock, framing, timeout, on_first_byte=None, on_chunk=None):
+    """
+    按 `framing` 从 `sock` 读取一帧响应。
+
+    Args:
+        sock: 已连接的 TCP socket。
+        framing: ResponseFraming 实例。
+        timeout: 整帧的最长等待时间（秒），从调用开始计算。
+        on_first_byte: （可选）收到第一段数据时调用的无参函数，用于记录首字节时间。
+        on_chunk: （可选）每收到一段属于本帧的数据时调用，参数为该段数据（例如增量解码器的 feed）。
+
+    Returns:
+        tuple[bytes | None, bool]:
+            第一个元素是收到的数据（完整帧，超时时为已收到的部分，什么都没收到则为 None）；
+            第二个元素表示对端是否已关闭连接。
+    """
+    deadline = time.monotonic() + timeout
+    buffer = b''
+    closed = False
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if framing.mode == 'idle' and buffer:
+            remaining = min(remaining, framing.idle_gap)
+        sock.settimeout(remaining)
+        try:
+            chunk = sock.recv(RECV_BUFFER_SIZE)
+        except TimeoutError:  # socket.timeout 是 TimeoutError 的别名；不导入 socket，fast_send.py 经 tcp_wire 使用本模块
+            break
+        if not chunk:
+            closed = True
+            break
+        if not buffer and on_first_byte is not None:
+            on_first_byte()
+        start = len(buffer)
+        buffer += chunk
+        if framing.mode == 'once':
+            if on_chunk is not None:
+                on_chunk(chunk)
+            break
+        size = framing.complete_size(buffer)
+        if size is not None:
+            # 多余的数据属于下一帧（或是噪声），不计入本次响应
+            buffer = buffer[:size]
+        if on_chunk is not None:
+            on_chunk(buffer[start:])
+        if size is not None:
+            break
+        if len(buffer) >= framing.max_size:
+            break
+    return (buffer or None), closed
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# macro_engine.py
+# 时间线宏：按 macros.yaml 中声明的时间线，在一个事件循环上精确调度多台设备的命令（TCP / UDP / 串口 / 矩阵路由），
+# 代替在 scripts.yaml 里串联 send_tcp_command_script、send_rs232_data_script 和 delay ——
+# 那样每一步都要等上一步的进程结束，延迟叠加在传输耗时之上，整个场景比需要的时间长好几倍。
+#
+#   - at     绝对偏移：步骤在宏开始后第 at 秒开始，与其他步骤的耗时无关；没有依赖关系的步骤并行执行；
+#   - after  依赖：等列出的步骤成功（收到应答并满足 expect）后再开始，delay 为之后再等待的秒数；
+#            依赖的步骤失败时，本步骤跳过（以及依赖它的步骤）；同时给出 at 时取两者中较晚的时刻；
+#   - 每一步报告计划时刻（假设所有应答都是即时的）、实际开始时刻、调度偏差和耗时；
+#   - 同一 group（默认 scene）同时只运行一个宏：启动新的宏会取消正在运行的宏，尚未开始的步骤不再发送。
+#
+# 步骤的执行由调用方提供：HA 集成（custom_components/av_control）在 HA 的事件循环中直接收发，
+# 命令行在线程中调用 device_profiles.send_command / matrix_router.apply_routes。
+#
+# 用法:
+#   python macro_engine.py check                 校验 macros.yaml（包括引用的设备命令和矩阵）
+#   python macro_engine.py plan <宏>             显示时间线计划
+#   python macro_engine.py run <宏> [--dry-run]  运行宏并报告每一步的计划 / 实际时刻（--dry-run 不发送任何数据）
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+
+CONFIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MACROS_CONFIG_PATH = os.environ.get('HA_MACROS_CONFIG', os.path.join(CONFIG_DIR, 'macros.yaml'))
+
+DEFAULT_GROUP = 'scene'
+SLEEP_MARGIN = 0.02     # 等待步骤开始时，最后一段短睡眠的长度（秒）
+MACRO_KEYS = ('description', 'group', 'steps')
+STEP_KEYS = ('id', 'device', 'command', 'matrix', 'routes', 'preset', 'force',
+             'at', 'after', 'delay', 'expect', 'read_response')
+
+OK, FAILED, SKIPPED, CANCELLED = 'ok', 'failed', 'skipped', 'cancelled'
+
+
+class MacroError(Exception):
+    """宏定义无效，或引用了不存在的宏 / 设备命令 / 矩阵。"""
+
+
+class MacroStep:
+    """时间线上的一步：一条设备命令，或一次矩阵路由。"""
+
+    def __init__(self, id, at=0.0, after=(), delay=0.0, expect=None, read_response=True,
+                 device=None, command=None, matrix=None, routes=None, preset=None, force=False):
+        self.id = id
+        self.at = at
+        self.after = tuple(after)
+        self.delay = delay
+        self.expect = re.compile(expect) if expect else None
+        self.read_response = read_response
+        self.device = device
+        self.command = command
+        self.matrix = matrix
+        self.routes = routes
+        self.preset = preset
+        self.force = force
+
+    @property
+    def kind(self):
+        return 'matrix' if self.matrix else 'device'
+
+    def describe(self):
+        if self.kind == 'matrix':
+            target = f"预设 {self.preset}" if self.preset else ', '.join(f"{o}←{i}" for o, i in self.routes.items())
+            return f"矩阵 {self.matrix}: {target}"
+        return f"{self.device}.{self.command}"
+
+
+class Macro:
+    """一个宏：按书写顺序的步骤、按依赖关系排好序的步骤，以及每一步的计划开始时刻。"""
+
+    def __init__(self, name, steps, ordered, description='', group=DEFAULT_GROUP):
+        self.name = name
+        self.steps = steps
+        self.ordered = ordered
+        self.description = description
+        self.group = group
+        self.planned = {}
+        for step in ordered:
+            # 计划时刻假设所有应答都是即时的；实际时刻与它的差就是传输和设备耗时造成的推迟
+            self.planned[step.id] = max([step.at] + [self.planned[d] + step.delay for d in step.after])
+
+
+def _number(value, context, name):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise MacroError(f"{context}: {name} 必须是数字") from None
+    if number < 0:
+        raise MacroError(f"{context}: {name} 不能为负数")
+    return number
+
+
+def _parse_step(index, entry, macro_name):
+    context = f"宏 '{macro_name}' 第 {index + 1} 步"
+    if not isinstance(entry, dict):
+        raise MacroError(f"{context}: 步骤必须是字典")
+    unknown = set(entry) - set(STEP_KEYS)
+    if unknown:
+        raise MacroError(f"{context}: 未知字段 {', '.join(sorted(unknown))}")
+    if ('device' in entry) == ('matrix' in entry):
+        raise MacroError(f"{context}: 需要 device + command，或 matrix + routes / preset（二选一）")
+    if 'device' in entry and 'command' not in entry:
+        raise MacroError(f"{context}: 设备步骤缺少 command")
+    if 'matrix' in entry and ('routes' in entry) == ('preset' in entry):
+        raise MacroError(f"{context}: 矩阵步骤需要 routes 或 preset（二选一）")
+    if 'routes' in entry and not isinstance(entry['routes'], dict):
+        raise MacroError(f"{context}: routes 必须是 输出 -> 输入 的字典")
+
+    after = entry.get('after', [])
+    if not isinstance(after, list):
+        after = [after]
+    if 'device' in entry:
+        default_id = f"{entry['device']}.{entry['command']}"
+    else:
+        default_id = f"{entry['matrix']}.{entry.get('preset') or 'routes'}"
+    expect = entry.get('expect')
+    if expect:
+        try:
+            re.compile(expect)
+        except re.error as e:
+            raise MacroError(f"{context}: 无效的 expect 正则: {e}") from None
+    return MacroStep(
+        id=str(entry.get('id', default_id)),
+        at=_number(entry.get('at', 0), context, 'at'),
+        after=[str(d) for d in after],
+        delay=_number(entry.get('delay', 0), context, 'delay'),
+        expect=expect,
+        read_response=bool(entry.get('read_response', True)),
+        device=str(entry['device']) if 'device' in entry else None,
+        command=str(entry['command']) if 'command' in entry else None,
+        matrix=str(entry['matrix']) if 'matrix' in entry else None,
+        routes={str(o): str(i) for o, i in entry['routes'].items()} if 'routes' in entry else None,
+        preset=str(entry['preset']) if 'preset' in entry else None,
+        force=bool(entry.get('force', False)),
+    )
+
+
+def _order_steps(steps, macro_name):
+    """按依赖关系排序（依赖在前，同层保持书写顺序），检查重复的 id、未知的依赖和循环依赖。"""
+    by_id = {}
+    for step in steps:
+        if step.id in by_id:
+            raise MacroError(f"宏 '{macro_name}': 步骤 id '{step.id}' 重复，请为步骤指定不同的 id")
+        by_id[step.id] = step
+    for step in steps:
+        for dependency in step.after:
+            if dependency not in by_id:
+                raise MacroError(f"宏 '{macro_name}' 步骤 '{step.id}': after 引用了不存在的步骤 '{dependency}'")
+    ordered, placed = [], set()
+    while len(ordered) < len(steps):
+        ready = [step for step in steps if step.id not in placed and all(d in placed for d in step.after)]
+        if not ready:
+            cycle = [step.id for step in steps if step.id not in placed]
+            raise MacroError(f"宏 '{macro_name}': 步骤之间存在循环依赖: {', '.join(cycle)}")
+        ordered.extend(ready)
+        placed.update(step.id for step in ready)
+    return ordered
+
+
+def parse_macro(name, config):
+    """校验一个宏的定义。"""
+    if not isinstance(config, dict):
+        raise MacroError(f"宏 '{name}': 定义必须是字典")
+    unknown = set(config) - set(MACRO_KEYS)
+    if unknown:
+        raise MacroError(f"宏 '{name}': 未知字段 {', '.join(sorted(unknown))}")
+    entries = config.get('steps')
+    if not isinstance(entries, list) or not entries:
+        raise MacroError(f"宏 '{name}': steps 必须是非空列表")
+    steps = [_parse_step(index, entry, name) for index, entry in enumerate(entries)]
+    return Macro(name, steps, _order_steps(steps, name), str(config.get('description') or ''), str(config.get('group') or DEFAULT_GROUP))
+
+
+def load_macros(path=MACROS_CONFIG_PATH):
+    """
+    读取并校验 macros.yaml。
+
+    Raises:
+        MacroError: 宏定义无效。
+        OSError: 文件无法读取。
+    """
+    import yaml
+    with open(path, encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict):
+        raise MacroError("macros.yaml 的顶层必须是 宏名 -> 定义 的字典")
+    return {str(name): parse_macro(str(name), macro) for name, macro in config.items()}
+
+
+def check_references(macros, profiles, matrices):
+    """检查宏引用的设备命令、矩阵、输出 / 输入和预设都存在。"""
+    from device_profiles import ProfileError, get_profile
+    from matrix_router import MatrixError
+    for macro in macros.values():
+        for step in macro.steps:
+            context = f"宏 '{macro.name}' 步骤 '{step.id}'"
+            try:
+                if step.kind == 'device':
+                    get_profile(profiles, step.device).frame(step.command)
+                    continue
+                matrix = matrices.get(step.matrix)
+                if matrix is None:
+                    raise MacroError(f"{context}: 未知的矩阵 '{step.matrix}'，可选: {', '.join(matrices)}")
+                if step.preset is not None and step.preset not in matrix.presets:
+                    raise MacroError(f"{context}: 矩阵 '{step.matrix}' 没有预设 '{step.preset}'")
+                if step.routes is not None:
+                    matrix.validate_routes(step.routes, context)
+            except (ProfileError, MatrixError) as e:
+                raise MacroError(f"{context}: {e}") from None
+
+
+def get_macro(macros, name):
+    try:
+        return macros[name]
+    except KeyError:
+        raise MacroError(f"未知的宏 '{name}'，可选: {', '.join(macros)}") from None
+
+
+def _format_response(response):
+    if response is None:
+        return None
+    try:
+        return response.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return response.hex(' ').upper()
+
+
+class MacroRun:
+    """
+    一次宏的运行。`execute` 是异步可调用对象，接收 MacroStep，返回设备的响应（bytes 或 None），失败时抛出异常。
+    `cancel()` 可以在任意时刻取消：正在发送的步骤被中断，尚未开始的步骤不再发送。
+    """
+
+    def __init__(self, macro, execute):
+        self.macro = macro
+        self.execute = execute
+        self.cancel_reason = None
+        self.results = {step.id: {'id': step.id, 'action': step.describe(), 'status': None,
+                                  'planned_ms': round(macro.planned[step.id] * 1000, 1)}
+                        for step in macro.steps}
+        self._tasks = {}
+        self._start = None
+
+    def cancel(self, reason='已取消'):
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        for task in self._tasks.values():
+            task.cancel()
+
+    def _offset_ms(self, loop):
+        return round((loop.time() - self._start) * 1000, 1)
+
+    async def _run_step(self, step):
+        loop = asyncio.get_running_loop()
+        result = self.results[step.id]
+        try:
+            target = self._start + step.at
+            if step.after:
+                # 依赖的任务结束即为应答到达（或失败），不需要额外的事件
+                await asyncio.wait([self._tasks[d] for d in step.after])
+                failed = [d for d in step.after if self.results[d]['status'] != OK]
+                if failed:
+                    result['status'] = SKIPPED
+                    result['error'] = f"依赖的步骤未成功: {', '.join(failed)}"
+                    return
+                ready = max(self._start + self.results[d]['finished_ms'] / 1000 for d in step.after)
+                target = max(target, ready + step.delay)
+            result['scheduled_ms'] = round((target - self._start) * 1000, 1)
+            # 长时间睡眠的唤醒误差随时长增加：先睡到目标前 SLEEP_MARGIN，再睡剩下的一小段
+            while (remaining := target - loop.time()) > 0:
+                await asyncio.sleep(remaining - SLEEP_MARGIN if remaining > 2 * SLEEP_MARGIN else remaining)
+            result['started_ms'] = self._offset_ms(loop)
+            result['lag_ms'] = round(result['started_ms'] - result['scheduled_ms'], 1)
+            try:
+                response = await self.execute(step)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result['status'] = FAILED
+                result['error'] = f"{type(e).__name__}: {e}"
+                return
+            finally:
+                if 'started_ms' in result:
+                    result['finished_ms'] = self._offset_ms(loop)
+                    result['duration_ms'] = round(result['finished_ms'] - result['started_ms'], 1)
+            result['response'] = _format_response(response)
+            if step.expect is not None and not step.expect.search(result['response'] or ''):
+                result['status'] = FAILED
+                result['error'] = f"响应不符合 expect '{step.expect.pattern}'"
+                return
+            result['status'] = OK
+        except asyncio.CancelledError:
+            result['status'] = CANCELLED
+            result['error'] = self.cancel_reason
+            raise
+
+    async def run(self):
+        """
+        运行整个宏，所有步骤结束（或被取消）后返回报告::
+
+            {"macro": 名称, "status": "ok" | "failed" | "cancelled", "elapsed_ms": ...,
+             "steps": [{"id", "action", "status", "planned_ms", "scheduled_ms", "started_ms", "lag_ms",
+                        "finished_ms", "duration_ms", "response", "error"}, ...]}
+
+        planned_ms 为假设应答即时时的计划时刻，scheduled_ms 为按依赖实际完成时刻算出的目标时刻，
+        lag_ms 为实际开始时刻相对 scheduled_ms 的调度偏差。
+        """
+        loop = asyncio.get_running_loop()
+        started_at = time.time()
+        self._start = loop.time()
+        for step in self.macro.ordered:
+            # 按依赖顺序创建任务，依赖的任务总是先创建
+            self._tasks[step.id] = loop.create_task(self._run_step(step))
+        if self.cancel_reason is not None:
+            self.cancel(self.cancel_reason)
+        try:
+            await asyncio.wait(self._tasks.values())
+        finally:
+            # 外层被取消（例如 HA 停止）时不留下仍在运行的步骤
+            for task in self._tasks.values():
+                task.cancel()
+        statuses = {result['status'] for result in self.results.values()}
+        if CANCELLED in statuses:
+            status = CANCELLED
+        elif statuses == {OK}:
+            status = OK
+        else:
+            status = FAILED
+        return {
+            'macro': self.macro.name,
+            'status': status,
+            'started': round(started_at, 3),
+            'elapsed_ms': self._offset_ms(loop),
+            'steps': list(self.results.values()),
+        }
+
+
+class MacroRunner:
+    """按 group 管理正在运行的宏：同一 group 中启动新的宏会取消旧的宏。"""
+
+    def __init__(self):
+        self.running = {}           # group -> MacroRun
+
+    async def run(self, macro, execute):
+        previous = self.running.get(macro.group)
+        if previous is not None:
+            previous.cancel(f"被宏 '{macro.name}' 取代")
+        run = self.running[macro.group] = MacroRun(macro, execute)
+        try:
+            return await run.run()
+        finally:
+            if self.running.get(macro.group) is run:
+                del self.running[macro.group]
+
+    def cancel(self, group=None, reason='已取消'):
+        """取消某个 group（或全部）正在运行的宏，返回被取消的宏名列表。"""
+        runs = [self.running[group]] if group in self.running else [] if group else list(self.running.values())
+        for run in runs:
+            run.cancel(reason)
+        return [run.macro.name for run in runs]
+
+
+# ======== 命令行 ========
+
+def thread_executor(profiles, matrices):
+    """命令行使用的步骤执行函数：在线程中调用同步的传输代码（守护进程 / 串口代理运行时经由它们发送）。"""
+    from device_profiles import get_profile, send_command
+    from matrix_router import apply_routes
+
+    def execute_sync(step):
+        if step.kind == 'device':
+            return send_command(get_profile(profiles, step.device), step.command, step.read_response)
+        matrix = matrices[step.matrix]
+        routes = matrix.presets[step.preset] if step.preset is not None else step.routes
+        apply_routes(matrix, routes, force=step.force)
+        return None
+
+    async def execute(step):
+        return await asyncio.to_thread(execute_sync, step)
+    return execute
+
+
+async def _dry_run(step):
+    return None
+
+
+def print_plan(macro):
+    print(f"宏 '{macro.name}'（group: {macro.group}）{macro.description}")
+    for step in sorted(macro.steps, key=lambda step: macro.planned[step.id]):
+        dependency = f"  在 {', '.join(step.after)} 成功后 +{step.delay:g}s" if step.after else ""
+        print(f"  {macro.planned[step.id]:>8.2f}s  {step.id:<24} {step.describe()}{dependency}")
+
+
+def print_report(report):
+    print(f"宏 '{report['macro']}': {report['status']}，总耗时 {report['elapsed_ms']} ms")
+    print(f"  {'步骤':<24} {'状态':<10} {'计划(ms)':>9} {'目标(ms)':>9} {'开始(ms)':>9} {'偏差(ms)':>9} "
+          f"{'耗时(ms)':>9}  响应/错误")
+    for step in report['steps']:
+        detail = step.get('error') or step.get('response') or ''
+        print(f"  {step['id']:<24} {step['status']:<10} {step['planned_ms']!s:>9} {step.get('scheduled_ms', '-')!s:>9} "
+              f"{step.get('started_ms', '-')!s:>9} {step.get('lag_ms', '-')!s:>9} "
+              f"{step.get('duration_ms', '-')!s:>9}  {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="时间线宏：校验、查看计划并运行 macros.yaml 中的宏。")
+    parser.add_argument("--config", default=MACROS_CONFIG_PATH, help=f"宏定义文件 (默认: {MACROS_CONFIG_PATH})")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("check", help="校验宏定义以及引用的设备命令和矩阵")
+    plan = sub.add_parser("plan", help="显示宏的时间线计划")
+    plan.add_argument("macro")
+    run = sub.add_parser("run", help="运行宏并报告每一步的计划 / 实际时刻")
+    run.add_argument("macro")
+    run.add_argument("--dry-run", action="store_true", help="不发送任何数据，只验证调度")
+    run.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    args = parser.parse_args()
+
+    from device_profiles import ProfileError, load_profiles
+    from matrix_router import MatrixError, load_matrices
+    try:
+        macros = load_macros(args.config)
+        profiles = load_profiles()
+        matrices = load_matrices()
+        check_references(macros, profiles, matrices)
+        if args.action == 'check':
+            for macro in macros.values():
+                print_plan(macro)
+            print(f"宏定义有效: {len(macros)} 个宏，{sum(len(macro.steps) for macro in macros.values())} 个步骤。")
+            return 0
+        macro = get_macro(macros, args.macro)
+    except (MacroError, ProfileError, MatrixError, OSError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    if args.action == 'plan':
+        print_plan(macro)
+        return 0
+
+    execute = _dry_run if args.dry_run else thread_executor(profiles, matrices)
+    report = asyncio.run(MacroRun(macro, execute).run())
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        print_report(report)
+    return 0 if report['status'] == OK else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# matrix_router.py
+# 数据驱动的矩阵路由引擎：从 matrices.yaml 读取任意数量的矩阵，缓存每个矩阵的交叉点状态，
+# 只发送真正发生变化的交叉点；重复选择当前路由时不发送任何数据。
+# 经 TCP 连接池守护进程发送时，每个输出使用独立的合并键：快速连续切换同一输出（例如连续翻动输入选择）
+# 只有最后一次切换会发往矩阵，旧的切换被取代后直接返回（见 command_coalescer.py）。
+#
+# 用法:
+#   python matrix_router.py route <matrix> <output> <input> [--force]
+#   python matrix_router.py preset <matrix> <preset> [--force]
+#   python matrix_router.py state [matrix]
+#   python matrix_router.py forget [matrix]
+import argparse
+import codecs
+import fcntl
+import json
+import os
+import sys
+from contextlib import contextmanager
+
+from framing import parse_framing
+from send_tcp_command import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_FRAMING,
+    DEFAULT_READ_TIMEOUT,
+    build_tcp_payload,
+    send_via_daemon,
+    tcp_exchange,
+)
+
+CONFIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MATRIX_CONFIG_PATH = os.environ.get('HA_MATRIX_CONFIG', os.path.join(CONFIG_DIR, 'matrices.yaml'))
+# 交叉点缓存文件。放在 /tmp 下，主机重启（矩阵通常也一起断电）后自动失效。
+MATRIX_STATE_PATH = os.environ.get('HA_MATRIX_STATE', '/tmp/ha_matrix_state.json')
+
+
+class MatrixError(Exception):
+    """矩阵配置或路由请求无效。"""
+
+
+class Matrix:
+    def __init__(self, name, config):
+        self.name = name
+        try:
+            self.ip = config['ip']
+            self.port = int(config['port'])
+            self.command = config['command']
+            self.inputs = {str(k): str(v) for k, v in config['inputs'].items()}
+            self.outputs = {str(k): str(v) for k, v in config['outputs'].items()}
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise MatrixError(f"矩阵 '{name}' 配置不完整: {e}") from e
+        self.multi_command = config.get('multi_command')
+        self.output_separator = config.get('output_separator', ',')
+        self.append_cr = bool(config.get('append_cr', False))
+        self.send_hex = bool(config.get('send_hex', False))
+        self.encoding = config.get('encoding', 'utf-8')
+        self.framing = config.get('framing', DEFAULT_FRAMING)
+        try:
+            parse_framing(self.framing)
+            codecs.lookup(self.encoding)
+        except (ValueError, LookupError) as e:
+            raise MatrixError(f"矩阵 '{name}' 配置无效: {e}") from e
+        self.read_timeout = float(config.get('read_timeout', DEFAULT_READ_TIMEOUT))
+        window = config.get('coalesce_window')
+        self.coalesce_window = float(window) if window is not None else None
+        self.presets = config.get('presets') or {}
+        for preset, routes in self.presets.items():
+            self.validate_routes(routes, f"预设 '{preset}'")
+
+    def preset(self, name):
+        """预设的路由（输出 -> 输入）。"""
+        try:
+            return self.presets[name]
+        except KeyError:
+            raise MatrixError(f"矩阵 '{self.name}' 没有预设 '{name}'") from None
+
+    def validate_routes(self, routes, context='路由'):
+        for output, source in routes.items():
+            if output not in self.outputs:
+                raise MatrixError(f"{context}: 矩阵 '{self.name}' 没有输出 '{output}'")
+            if source not in self.inputs:
+                raise MatrixError(f"{context}: 矩阵 '{self.name}' 没有输入 '{source}'")
+
+    def plan(self, routes, current):
+        """
+        计算把矩阵切换到 `routes` 所需发送的命令。
+
+        Args:
+            routes: 输出友好名称 -> 输入友好名称。
+            current: 缓存中的当前交叉点（同样的格式）。
+
+        Returns:
+            list[tuple[str, list[str]]]: (命令字符串, 该命令覆盖的输出列表)。
+
+        Raises:
+            MatrixError: 命令模板中有未知的占位符。
+        """
+        changes = {output: source for output, source in routes.items() if current.get(output) != source}
+        by_input = {}
+        for output, source in changes.items():
+            by_input.setdefault(source, []).append(output)
+
+        commands = []
+        try:
+            for source, outputs in by_input.items():
+                if self.multi_command and len(outputs) > 1:
+                    codes = self.output_separator.join(self.outputs[output] for output in outputs)
+                    commands.append((self.multi_command.format(outputs=codes, input=self.inputs[source]), outputs))
+                else:
+                    for output in outputs:
+                        command = self.command.format(output=self.outputs[output], input=self.inputs[source])
+                        commands.append((command, [output]))
+        except (KeyError, IndexError, ValueError) as e:
+            raise MatrixError(f"矩阵 '{self.name}' 的命令模板无效: {type(e).__name__}: {e}") from e
+        return commands
+
+    def payload(self, command):
+        """
+        按矩阵的 HEX / 文本设置把命令字符串编码为要发送的字节。
+
+        Raises:
+            MatrixError: HEX 字符串无效或编码失败。
+        """
+        try:
+            return build_tcp_payload(command, self.append_cr, self.send_hex, self.encoding, verbose=False)
+        except (ValueError, LookupError) as e:
+            raise MatrixError(f"矩阵 '{self.name}' 的命令 '{command}' 无法编码: {e}") from e
+
+
+def load_matrices(path=MATRIX_CONFIG_PATH):
+    import yaml
+    with open(path, encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    return {name: Matrix(name, matrix_config) for name, matrix_config in config.items()}
+
+
+def get_matrix(matrices, name):
+    try:
+        return matrices[name]
+    except KeyError:
+        raise MatrixError(f"未知的矩阵 '{name}'，可选: {', '.join(matrices)}") from None
+
+
+@contextmanager
+def locked_state(path=MATRIX_STATE_PATH):
+    """以独占锁打开交叉点缓存，保证同时触发的多个切换不会互相覆盖缓存。只在读写缓存时持有，发送期间不持有。"""
+    with open(path, 'a+', encoding='utf-8') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            state = json.loads(f.read() or '{}')
+        except ValueError:
+            state = {}
+        try:
+            yield state
+        finally:
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state, ensure_ascii=False))
+
+
+def coalesce_key(matrix, outputs):
+    """一条矩阵命令的合并键：同一矩阵、同一组输出上的切换互相取代。"""
+    return f"matrix:{matrix.name}:{','.join(sorted(outputs))}"
+
+
+def _send(matrix, data_to_send, outputs=None):
+    """
+    发送一条已编码的矩阵命令。给出 `outputs` 时按输出合并（需要守护进程）。
+
+    Returns:
+        bool: False 表示该命令被同一输出上更新的切换取代，没有发往矩阵。
+    """
+    options = {
+        'connect_timeout': DEFAULT_CONNECT_TIMEOUT,
+        'read_timeout': matrix.read_timeout,
+        'framing': matrix.framing,
+    }
+    reply = send_via_daemon(matrix.ip, matrix.port, data_to_send,
+                            coalesce_key=coalesce_key(matrix, outputs) if outputs else None,
+                            coalesce_window=matrix.coalesce_window, **options)
+    if reply is None:
+        tcp_exchange(matrix.ip, matrix.port, data_to_send, **options)
+    elif not reply.get('ok'):
+        raise ConnectionError(reply.get('error'))
+    return not (reply or {}).get('superseded')
+
+
+def apply_routes(matrix, routes, force=False):
+    """
+    把 `matrix` 切换到 `routes`，只发送发生变化的交叉点。
+
+    所有命令先编码，编码失败时不改动缓存。缓存在发送前就更新为目标路由并释放锁，
+    这样紧接着触发的切换能看到最新的意图，并在守护进程中取代本次尚未发出的命令；
+    发送中出现任何错误时再把失败和尚未发送的输出从缓存中移除。
+    `force` 为 True 时忽略缓存，也不参与合并。
+
+    Returns:
+        int: 实际发往矩阵的命令数（被更新的切换取代的命令不计入）。
+
+    Raises:
+        MatrixError: 路由无效、命令无法编码或发送失败。
+    """
+    matrix.validate_routes(routes)
+    with locked_state() as state:
+        current = {} if force else state.get(matrix.name, {})
+        commands = matrix.plan(routes, current)
+        if not commands:
+            print(f"矩阵 '{matrix.name}' 已处于目标路由，无需发送。")
+            return 0
+        payloads = [matrix.payload(command) for command, _ in commands]
+        cached = state.setdefault(matrix.name, {})
+        for _, outputs in commands:
+            for output in outputs:
+                cached[output] = routes[output]
+
+    sent = 0
+    for index, ((command, outputs), data_to_send) in enumerate(zip(commands, payloads)):
+        print(f"发送矩阵命令: '{command}' 到 {matrix.ip}:{matrix.port} (输出: {', '.join(outputs)})")
+        try:
+            if _send(matrix, data_to_send, None if force else outputs):
+                sent += 1
+            else:
+                print(f"输出 {', '.join(outputs)} 的切换已被更新的切换取代。")
+        except Exception as e:
+            # 发送失败（以及尚未发送）的输出状态未知，清除缓存以便下次重新发送；
+            # 已被其他切换改写的输出由那次切换负责
+            with locked_state() as state:
+                cached = state.get(matrix.name, {})
+                for _, unsent in commands[index:]:
+                    for output in unsent:
+                        if cached.get(output) == routes[output]:
+                            cached.pop(output, None)
+            raise MatrixError(f"发送 '{command}' 失败: {e}") from e
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="矩阵路由引擎：只发送变化的交叉点。")
+    parser.add_argument("--config", default=MATRIX_CONFIG_PATH, help=f"矩阵配置文件 (默认: {MATRIX_CONFIG_PATH})")
+    sub = parser.add_subparsers(dest="action", required=True)
+    route = sub.add_parser("route", help="把一个输出切换到一个输入")
+    route.add_argument("matrix")
+    route.add_argument("output")
+    route.add_argument("input")
+    route.add_argument("--force", action="store_true", help="忽略缓存，强制发送")
+    preset = sub.add_parser("preset", help="应用一个预设（同时切换多个输出）")
+    preset.add_argument("matrix")
+    preset.add_argument("preset")
+    preset.add_argument("--force", action="store_true", help="忽略缓存，强制发送")
+    state = sub.add_parser("state", help="显示缓存的交叉点状态")
+    state.add_argument("matrix", nargs="?")
+    forget = sub.add_parser("forget", help="清除缓存（例如矩阵被面板手动切换过）")
+    forget.add_argument("matrix", nargs="?")
+    args = parser.parse_args()
+
+    if args.action in ('state', 'forget'):
+        with locked_state() as cache:
+            if args.action == 'state':
+                print(json.dumps(cache.get(args.matrix, {}) if args.matrix else cache, ensure_ascii=False, indent=2))
+            elif args.matrix:
+                cache.pop(args.matrix, None)
+            else:
+                cache.clear()
+        return 0
+
+    try:
+        matrix = get_matrix(load_matrices(args.config), args.matrix)
+        routes = {args.output: args.input} if args.action == 'route' else matrix.preset(args.preset)
+        sent = apply_routes(matrix, routes, force=args.force)
+    except (OSError, MatrixError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    print(f"矩阵 '{matrix.name}' 切换完成，共发送 {sent} 条命令。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+# response_decoders.py
+# 响应解码器：把设备的应答解析为带类型的字段，而不是从整条应答里猜一个数值。
+# 解码器在加载设备档案（或解析命令行参数）时编译一次，之后每条应答只做匹配 / 解包。
+#
+# 解码器写法（devices.yaml 的 decode 字段，或命令行的 --decode）:
+#   number                                      旧行为：整条应答按整数 / 浮点数 / 文本解析 -> {value}
+#   regex:VOL=(?P<volume>\d+)                   正则表达式，命名分组为字段（默认按文本）
+#   {type: regex, pattern: 'VOL=(?P<volume>\d+)', fields: {volume: int}}
+#   struct:>BBH:header,status,value             struct 格式和字段名（'_' 表示忽略）
+#   {type: struct, format: '>BBH', fields: [header, status, value], offset: 0, scale: {value: 0.1}}
+#   {type: modbus, start: 0, registers: {volume: 0, temperature: {address: 1, type: int16, scale: 0.1}}}
+#                                               Modbus 读寄存器应答（RTU 带 CRC 校验，protocol: tcp 为 MBAP 帧头）
+#
+# 解码支持增量进行：stream = decoder.stream()，每收到一段数据调用 stream.feed(chunk)，
+# 字段齐全时立即得到结果；帧结束时调用 stream.finish() 取得最终结果。
+import json
+import re
+import struct
+
+FIELD_TYPES = {
+    'int': int,
+    'float': float,
+    'str': str,
+    'hex': lambda text: int(text, 16),
+    'bool': lambda text: text.strip().lower() in ('1', 'on', 'true', 'yes'),
+}
+
+# 寄存器类型 -> (寄存器个数, struct 格式)
+REGISTER_TYPES = {
+    'uint16': (1, 'H'),
+    'int16': (1, 'h'),
+    'uint32': (2, 'I'),
+    'int32': (2, 'i'),
+    'float32': (2, 'f'),
+}
+
+
+class DecodeError(ValueError):
+    """应答与解码器不匹配（格式错误、校验失败、设备返回异常码等）。"""
+
+
+class DecoderSpecError(ValueError):
+    """解码器定义无效。"""
+
+
+def _scaled(value, scale):
+    return value * scale if scale is not None else value
+
+
+class DecodeStream:
+    """一条应答的增量解码状态。"""
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.buffer = bytearray()
+        self.fields = None
+
+    def feed(self, chunk):
+        """追加一段数据。字段已经齐全时返回解码结果，否则返回 None。"""
+        self.buffer += chunk
+        if self.fields is None:
+            self.fields = self.decoder.try_decode(bytes(self.buffer), final=False)
+        return self.fields
+
+    def finish(self):
+        """帧已结束：返回解码结果（没有收到数据时为 None）。"""
+        if self.fields is None and self.buffer:
+            self.fields = self.decoder.try_decode(bytes(self.buffer), final=True)
+        return self.fields
+
+
+class Decoder:
+    kind = None
+
+    def stream(self):
+        return DecodeStream(self)
+
+    def decode(self, data):
+        """一次性解码完整的应答。"""
+        stream = self.stream()
+        if data:
+            stream.feed(data)
+        return stream.finish()
+
+    def try_decode(self, data, final):
+        """
+        尝试解码。数据还不完整时返回 None（final 为 True 时改为抛出 DecodeError）。
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class NumberDecoder(Decoder):
+    """旧行为：UTF-8 解码后尝试 int() / float()，否则返回文本；无法解码时返回 HEX。"""
+
+    kind = 'number'
+
+    def try_decode(self, data, final):
+        if not final:
+            # 整条应答才能判断是不是一个数，只在帧结束时解码
+            return None
+        try:
+            text = data.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            return {'value': data.hex().upper()}
+        for convert in (int, float):
+            try:
+                return {'value': convert(text)}
+            except ValueError:
+                pass
+        return {'value': text}
+
+
+class RegexDecoder(Decoder):
+    """
+    按正则表达式提取字段。有命名分组时每个分组是一个字段，否则整个匹配（或第一个分组）作为 value。
+    增量解码时，只有匹配之后还有数据（例如终止符）才认为匹配已经完整，避免 \\d+ 只匹配到一半。
+    """
+
+    kind = 'regex'
+
+    def __init__(self, pattern, fields=None, encoding='latin-1'):
+        try:
+            self.regex = re.compile(pattern.encode(encoding))
+        except (re.error, UnicodeEncodeError) as e:
+            raise DecoderSpecError(f"无效的正则表达式 '{pattern}': {e}") from e
+        self.encoding = encoding
+        self.converters = {}
+        for name, spec in (fields or {}).items():
+            if isinstance(spec, dict):
+                type_name, scale = spec.get('type', 'str'), spec.get('scale')
+            else:
+                type_name, scale = spec, None
+            if type_name not in FIELD_TYPES:
+                raise DecoderSpecError(f"字段 '{name}' 的类型 '{type_name}' 无效，可选: {', '.join(FIELD_TYPES)}")
+            self.converters[name] = (FIELD_TYPES[type_name], scale)
+        unknown = set(self.converters) - set(self.regex.groupindex)
+        if unknown:
+            raise DecoderSpecError(f"正则表达式中没有分组: {', '.join(sorted(unknown))}")
+
+    def __repr__(self):
+        return f"RegexDecoder({self.regex.pattern.decode(self.encoding)!r})"
+
+    def try_decode(self, data, final):
+        match = self.regex.search(data)
+        if match is None or (not final and match.end() >= len(data)):
+            if final:
+                raise DecodeError(f"应答与正则表达式 '{self.regex.pattern.decode(self.encoding)}' 不匹配")
+            return None
+        if not self.regex.groupindex:
+            text = (match.group(1) if self.regex.groups else match.group(0)).decode(self.encoding)
+            return {'value': text}
+        fields = {}
+        for name, raw in match.groupdict().items():
+            if raw is None:
+                fields[name] = None
+                continue
+            text = raw.decode(self.encoding)
+            convert, scale = self.converters.get(name, (str, None))
+            try:
+                fields[name] = _scaled(convert(text), scale)
+            except ValueError as e:
+                raise DecodeError(f"字段 '{name}' 的值 '{text}' 无法转换: {e}") from e
+        return fields
+
+
+class StructDecoder(Decoder):
+    """按 struct 格式解包二进制应答，`offset` 为跳过的帧头字节数。"""
+
+    kind = 'struct'
+
+    def __init__(self, format, fields, offset=0, scale=None):
+        try:
+            self.struct = struct.Struct(format)
+        except struct.error as e:
+            raise DecoderSpecError(f"无效的 struct 格式 '{format}': {e}") from e
+        self.fields = [str(name) for name in fields]
+        count = len(self.struct.unpack(bytes(self.struct.size)))
+        if len(self.fields) != count:
+            raise DecoderSpecError(f"struct 格式 '{format}' 有 {count} 个值，但给出了 {len(self.fields)} 个字段名")
+        self.offset = int(offset)
+        self.scale = dict(scale or {})
+
+    def __repr__(self):
+        return f"StructDecoder({self.struct.format!r}, {self.fields})"
+
+    def try_decode(self, data, final):
+        end = self.offset + self.struct.size
+        if len(data) < end:
+            if final:
+                raise DecodeError(f"应答长度 {len(data)} 字节，不足 {end} 字节")
+            return None
+        values = self.struct.unpack_from(data, self.offset)
+        return {name: _scaled(value, self.scale.get(name))
+                for name, value in zip(self.fields, values) if name != '_'}
+
+
+class ModbusDecoder(Decoder):
+    """
+    解析 Modbus 读保持 / 输入寄存器（功能码 3 / 4）的应答，并按寄存器表取出字段。
+
+    registers: 字段名 -> 寄存器地址，或 {address, type, scale, word_order}；地址为绝对地址，
+    减去 `start`（请求的起始地址）得到在应答中的位置。
+    """
+
+    kind = 'modbus'
+
+    def __init__(self, registers, start=0, protocol='rtu', check_crc=True, byteorder='big'):
+        if protocol not in ('rtu', 'tcp'):
+            raise DecoderSpecError(f"未知的 Modbus 帧格式 '{protocol}'，可选: rtu, tcp")
+        self.protocol = protocol
+        # 字节计数之前的字节数（RTU: 地址 + 功能码；TCP: 7 字节 MBAP 帧头 + 功能码）
+        self.header_size = 2 if protocol == 'rtu' else 8
+        self.check_crc = check_crc and protocol == 'rtu'
+        self.byteorder = '>' if byteorder == 'big' else '<'
+        self.registers = []
+        for name, spec in (registers or {}).items():
+            if not isinstance(spec, dict):
+                spec = {'address': spec}
+            type_name = spec.get('type', 'uint16')
+            if type_name not in REGISTER_TYPES:
+                raise DecoderSpecError(f"寄存器 '{name}' 的类型 '{type_name}' 无效，可选: {', '.join(REGISTER_TYPES)}")
+            count, code = REGISTER_TYPES[type_name]
+            index = int(spec.get('address', 0)) - int(start)
+            if index < 0:
+                raise DecoderSpecError(f"寄存器 '{name}' 的地址小于起始地址 {start}")
+            self.registers.append((str(name), index, count, code, spec.get('scale'),
+                                   spec.get('word_order', 'big') == 'little'))
+        if not self.registers:
+            raise DecoderSpecError("Modbus 解码器至少需要一个寄存器")
+
+    def __repr__(self):
+        return f"ModbusDecoder({self.protocol}, {[register[0] for register in self.registers]})"
+
+    def _frame_size(self, data):
+        function_at = self.header_size - 1
+        if len(data) <= function_at:
+            return None
+        if data[function_at] & 0x80:
+            # 异常应答: 功能码 | 0x80，随后一个字节是异常码
+            return self.header_size + 1 + (2 if self.protocol == 'rtu' else 0)
+        if len(data) <= self.header_size:
+            return None
+        return self.header_size + 1 + data[self.header_size] + (2 if self.protocol == 'rtu' else 0)
+
+    def try_decode(self, data, final):
+        size = self._frame_size(data)
+        if size is None or len(data) < size:
+            if final:
+                raise DecodeError(f"Modbus 应答不完整（{len(data)} 字节）")
+            return None
+        frame = data[:size]
+        if self.check_crc:
+            from device_profiles import CHECKSUMS
+            if CHECKSUMS['crc16_modbus'](frame[:-2]) != frame[-2:]:
+                raise DecodeError(f"Modbus CRC 校验失败: {frame.hex(' ').upper()}")
+        function = frame[self.header_size - 1]
+        if function & 0x80:
+            raise DecodeError(f"设备返回 Modbus 异常码 {frame[self.header_size]}（功能码 {function & 0x7F}）")
+        payload = frame[self.header_size + 1:self.header_size + 1 + frame[self.header_size]]
+        fields = {}
+        for name, index, count, code, scale, swap_words in self.registers:
+            raw = payload[index * 2:(index + count) * 2]
+            if len(raw) < count * 2:
+                raise DecodeError(f"应答中没有寄存器 '{name}'（只返回了 {len(payload) // 2} 个寄存器）")
+            if swap_words:
+                raw = raw[2:] + raw[:2]
+            fields[name] = _scaled(struct.unpack(self.byteorder + code, raw)[0], scale)
+        return fields
+
+
+DECODERS = {
+    'number': NumberDecoder,
+    'regex': RegexDecoder,
+    'struct': StructDecoder,
+    'modbus': ModbusDecoder,
+}
+
+NUMBER = NumberDecoder()
+
+
+def parse_decoder_spec(text):
+    """
+    把命令行中的解码器描述解析为字典::
+
+        number
+        regex:<pattern>
+        struct:<format>:<字段1,字段2,...>
+        {"type": "modbus", ...}          (JSON)
+    """
+    text = text.strip()
+    if text.startswith('{'):
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            raise DecoderSpecError(f"无效的解码器 JSON: {e}") from e
+    kind, _, arg = text.partition(':')
+    if kind == 'regex':
+        return {'type': 'regex', 'pattern': arg}
+    if kind == 'struct':
+        format, _, names = arg.partition(':')
+        return {'type': 'struct', 'format': format, 'fields': [name for name in names.split(',') if name]}
+    return {'type': kind}
+
+
+def compile_decoder(spec):
+    """
+    编译解码器。`spec` 可以是 None（默认 number）、字符串简写、字典，或已编译的解码器。
+
+    Raises:
+        DecoderSpecError: 解码器定义无效。
+    """
+    if spec is None:
+        return NUMBER
+    if isinstance(spec, Decoder):
+        return spec
+    if isinstance(spec, str):
+        spec = parse_decoder_spec(spec)
+    if not isinstance(spec, dict):
+        raise DecoderSpecError("解码器必须是字符串或字典")
+    options = dict(spec)
+    kind = options.pop('type', 'number')
+    decoder_class = DECODERS.get(kind)
+    if decoder_class is None:
+        raise DecoderSpecError(f"未知的解码器类型 '{kind}'，可选: {', '.join(DECODERS)}")
+    if decoder_class is NumberDecoder:
+        return NUMBER
+    try:
+        return decoder_class(**options)
+    except TypeError as e:
+        raise DecoderSpecError(f"{kind} 解码器参数无效: {e}") from e
@@ -1,20 +1,310 @@
-import serial
+import codecs
+import os
 import sys
 import time
-import argparse # 引入 argparse 模块用于命令行参数解析
+
+# pyserial 只在真正打开串口时导入（serial_broker.py 的客户端和 fast_send.py 经代理发送时不需要它）
+import trace_ring
+from transport_metrics import DETAIL, QUIET, SUMMARY, CallMetrics, vprint
 
 # --- 默认串口参数设置 ---
 # 这些值将作为 send_serial_data 函数的默认参数，
 # 也可以通过命令行参数或直接在函数调用时覆盖。
 DEFAULT_PORT = '/dev/ttyS1'    # 默认串口路径
 DEFAULT_BAUDRATE = 9600        # 默认波特率
-DEFAULT_BYTESIZE = serial.EIGHTBITS # 默认数据位 (8)
-DEFAULT_PARITY = serial.PARITY_NONE # 默认校验位 (None)
-DEFAULT_STOPBITS = serial.STOPBITS_ONE # 默认停止位 (1)
+DEFAULT_BYTESIZE = 8           # 默认数据位 (serial.EIGHTBITS)
+DEFAULT_PARITY = 'N'           # 默认校验位 (serial.PARITY_NONE)
+DEFAULT_STOPBITS = 1           # 默认停止位 (serial.STOPBITS_ONE)
 DEFAULT_TIMEOUT = 1            # 默认读取超时时间（秒）
 DEFAULT_READ_RESPONSE = False  # 默认不读取响应
+DEFAULT_RESPONSE_MODE = 'sleep' # 默认响应读取方式（旧行为：固定等待 0.1 秒后读取已到达的数据）
+DEFAULT_TERMINATOR = b'\r'      # terminator 模式下的默认终止符
+
+# 响应读取方式:
+#   sleep       固定等待 0.1 秒后 read_all()（旧行为）
+#   gap         收到首字节后，线路静默超过字符间隔（Modbus-RTU 的 3.5 个字符时间）即结束
+#   terminator  读到终止符为止
+#   length      读满期望的字节数为止
+RESPONSE_MODES = ('sleep', 'gap', 'terminator', 'length')
+
+# 字符间隔的下限（秒）。USB 转串口芯片通常会把数据攒到 1~16ms 再上报，
+# 高波特率下纯按字符时间计算的间隔会小于这个延迟，导致把一帧切成两半。
+MIN_INTER_FRAME_GAP = 0.01
+
+# 串口代理的 Unix socket 路径（见 serial_broker.py）。
+# 代理运行时命令行只作为它的客户端；否则回退到直接打开串口。
+BROKER_SOCKET_PATH = os.environ.get('HA_SERIAL_BROKER_SOCKET', '/tmp/ha_serial_broker.sock')
+# 请求在串口代理中排队的最长时间（秒），超过后代理丢弃请求、不再写入串口。
+# 客户端等待代理响应的超时为串口 timeout + 30 秒，比排队上限多出一次串口读写的时间
+BROKER_WAIT_TIMEOUT = 25
+
+def encode_data(data_to_send: str | bytes, encoding: str = 'ascii') -> bytes:
+    """把要发送的数据转换为字节串，编码失败时回退到 UTF-8。"""
+    if isinstance(data_to_send, str):
+        try:
+            data_to_send_bytes = data_to_send.encode(encoding)
+            vprint(DETAIL, f"数据编码为 {encoding.upper()}: {data_to_send_bytes!r}")
+        except UnicodeEncodeError as e:
+            vprint(QUIET, f"错误: 编码为 {encoding.upper()} 失败: {e}", file=sys.stderr)
+            vprint(QUIET, f"警告: 尝试使用 'utf-8' 编码: {data_to_send!r}")
+            data_to_send_bytes = data_to_send.encode('utf-8')
+    elif isinstance(data_to_send, bytes):
+        data_to_send_bytes = data_to_send
+        vprint(DETAIL, f"数据已经是字节串: {data_to_send_bytes!r}")
+    else:
+        vprint(QUIET, f"警告: 传入数据类型非字符串或字节串 ({type(data_to_send)})，尝试转换为字符串并用 'ascii' 编码: {data_to_send!r}")
+        data_to_send_bytes = str(data_to_send).encode('ascii')
+    return data_to_send_bytes
+
+def char_time(baudrate: int, bytesize: int, parity: str, stopbits: float) -> float:
+    """按串口参数计算传输一个字符所需的时间（秒）：起始位 + 数据位 + 校验位 + 停止位。"""
+    parity_bits = 0 if parity == 'N' else 1
+    return (1 + bytesize + parity_bits + stopbits) / baudrate
+
+def inter_frame_gap(baudrate: int, bytesize: int, parity: str, stopbits: float) -> float:
+    """
+    计算判定一帧结束的静默间隔（秒）。
+
+    采用 Modbus-RTU 的规则：3.5 个字符时间；波特率高于 19200 时固定为 1.75ms。
+    结果不小于 MIN_INTER_FRAME_GAP。
+    """
+    if baudrate > 19200:
+        gap = 0.00175
+    else:
+        gap = 3.5 * char_time(baudrate, bytesize, parity, stopbits)
+    return max(gap, MIN_INTER_FRAME_GAP)
+
+def check_response_mode(response_mode: str, expected_length: int) -> None:
+    """
+    校验响应读取方式。length 模式没有给出期望长度时只会读到首字节，因此直接拒绝。
+
+    Raises:
+        ValueError: 未知的读取方式，或 length 模式的 expected_length 不大于 0。
+    """
+    if response_mode not in RESPONSE_MODES:
+        raise ValueError(f"未知的响应读取方式 '{response_mode}'，可选: {', '.join(RESPONSE_MODES)}")
+    if response_mode == 'length' and expected_length <= 0:
+        raise ValueError("length 模式需要 expected_length 大于 0。")
 
-print(f"脚本启动，默认串口配置: PORT={DEFAULT_PORT}, BAUDRATE={DEFAULT_BAUDRATE}, ...")
+def read_response_data(
+    ser: 'serial.Serial',
+    response_mode: str = DEFAULT_RESPONSE_MODE,
+    terminator: bytes = DEFAULT_TERMINATOR,
+    expected_length: int = 0,
+    gap: float | None = None,
+    on_first_byte=None,
+) -> bytes:
+    """
+    按 response_mode 从串口读取一次响应，帧完整后立即返回。
+
+    首字节的最长等待时间为串口的 timeout；读取结束后恢复串口原来的 timeout。
+    on_first_byte 为收到首字节时调用的无参函数（sleep 模式无法区分首字节，不会调用）。
+
+    Raises:
+        ValueError: 见 check_response_mode()。
+    """
+    check_response_mode(response_mode, expected_length)
+    if response_mode == 'sleep':
+        time.sleep(0.1) # 给予设备响应时间，等待响应
+        # 尝试读取所有可用数据直到超时
+        return ser.read_all()
+
+    # 其他模式都先单独等待首字节，以便记录首字节时间
+    buffer = ser.read(1)
+    if not buffer:
+        return buffer
+    if on_first_byte is not None:
+        on_first_byte()
+    if response_mode == 'terminator':
+        # 每次读到终止符的最后一个字节为止，再检查完整的终止符（支持多字节终止符跨越首字节）；
+        # 总等待时间仍以串口的 timeout 为上限
+        original_timeout = ser.timeout
+        deadline = None if original_timeout is None else time.monotonic() + original_timeout
+        try:
+            while not buffer.endswith(terminator):
+                remaining = expected_length - len(buffer) if expected_length else None
+                if remaining is not None and remaining <= 0:
+                    break
+                if deadline is not None:
+                    ser.timeout = max(0.0, deadline - time.monotonic())
+                chunk = ser.read_until(terminator[-1:], remaining)
+                if not chunk:
+                    break
+                buffer += chunk
+        finally:
+            ser.timeout = original_timeout
+        return buffer
+    if response_mode == 'length':
+        return buffer + ser.read(expected_length - 1) if expected_length > 1 else buffer
+
+    # gap 模式: 收到首字节后，一直读到线路静默超过字符间隔
+    if gap is None:
+        gap = inter_frame_gap(ser.baudrate, ser.bytesize, ser.parity, ser.stopbits)
+    original_timeout = ser.timeout
+    try:
+        ser.timeout = gap
+        while buffer:
+            waiting = ser.in_waiting
+            if waiting:
+                buffer += ser.read(waiting)
+                continue
+            chunk = ser.read(1)
+            if not chunk:
+                break
+            buffer += chunk
+            if expected_length and len(buffer) >= expected_length:
+                break
+    finally:
+        ser.timeout = original_timeout
+    return buffer
+
+def transact(
+    ser: 'serial.Serial',
+    data_to_send_bytes: bytes,
+    read_response: bool,
+    response_mode: str = DEFAULT_RESPONSE_MODE,
+    terminator: bytes = DEFAULT_TERMINATOR,
+    expected_length: int = 0,
+    gap: float | None = None,
+    metrics: CallMetrics | None = None,
+) -> bytes | None:
+    """
+    在已打开的串口上写入数据，并可选地读取响应。
+
+    由 send_serial_data() 和常驻串口代理 (serial_broker.py) 共用。
+    传入 CallMetrics 时记录 send / first_byte / response 各阶段的耗时和收发字节数。
+    设置了 HA_TRANSPORT_TRACE 时，收发的原始字节写入追踪文件（见 trace_ring.py）。
+
+    Returns:
+        bytes | None: 收到的响应数据；未读取或未收到时为 None。
+
+    Raises:
+        ValueError: 响应读取方式无效（见 check_response_mode()），此时不会写入任何数据。
+    """
+    check_response_mode(response_mode, expected_length)
+    if metrics is None:
+        metrics = CallMetrics('serial', ser.port, enabled=False)
+    received_data = None
+    vprint(DETAIL, f"发送数据 (字节): {data_to_send_bytes!r}, 长度: {len(data_to_send_bytes)} 字节")
+    metrics.skip()
+    ser.reset_input_buffer() # 丢弃上一次交互残留的数据，避免混入本次响应
+    ser.write(data_to_send_bytes)
+    sent_at = time.perf_counter()
+    trace_ring.record('serial', ser.port, trace_ring.TX, data_to_send_bytes)
+    metrics.bytes_sent += len(data_to_send_bytes)
+
+    if not read_response:
+        if response_mode == 'sleep':
+            time.sleep(0.1) # 旧行为：写入后固定等待
+        else:
+            ser.flush() # 只等待数据真正发送完毕
+        metrics.mark('send')
+        vprint(DETAIL, "数据已写入串口.")
+        return None
+    metrics.mark('send')
+    vprint(DETAIL, "数据已写入串口.")
+    metrics.skip()
+
+    read_data = read_response_data(ser, response_mode, terminator, expected_length, gap,
+                                   on_first_byte=lambda: metrics.mark('first_byte'))
+    trace_ring.record('serial', ser.port, trace_ring.RX, read_data, time.perf_counter() - sent_at)
+    metrics.bytes_received += len(read_data or b'')
+    metrics.mark('response')
+    if read_data:
+        received_data = read_data
+        vprint(SUMMARY, f"收到响应: {received_data!r}")
+        try:
+            vprint(DETAIL, f"响应 (尝试解码为 UTF-8): {received_data.decode('utf-8')!r}")
+        except UnicodeDecodeError:
+            vprint(DETAIL, "响应无法解码为 UTF-8。")
+    else:
+        vprint(SUMMARY, "未收到响应.")
+    metrics.skip()
+    return received_data
+
+def send_via_broker(
+    data_to_send: str | bytes,
+    port: str,
+    baudrate: int,
+    bytesize: int,
+    parity: str,
+    stopbits: float,
+    timeout: float,
+    read_response: bool,
+    encoding: str = 'ascii',
+    response_mode: str = DEFAULT_RESPONSE_MODE,
+    terminator: bytes = DEFAULT_TERMINATOR,
+    expected_length: int = 0,
+    gap: float | None = None,
+    metrics: CallMetrics | None = None,
+    coalesce_key: str | None = None,
+    coalesce_window: float | None = None,
+) -> tuple[bool, bytes | None] | None:
+    """
+    通过常驻串口代理发送数据。
+    经代理发送时打开串口、写入和读取都在代理内完成，整个往返计入 metrics 的 response 阶段。
+    给出 `coalesce_key` 时，同一合并键上连续的命令只发送最后一条（见 command_coalescer.py），
+    被取代或幂等重复的命令不会写入串口。
+
+    Returns:
+        与 send_serial_data() 相同的 (success, response) 元组；代理未运行时返回 None。
+        请求发出后与代理的通信失败（超时、无效响应）返回 (False, None)，调用方不应再直接发送。
+    """
+    if not os.path.exists(BROKER_SOCKET_PATH):
+        return None
+    import unix_ipc
+    if metrics is None:
+        metrics = CallMetrics('serial', port, enabled=False)
+    metrics.skip()
+    data_to_send_bytes = encode_data(data_to_send, encoding)
+    metrics.mark('encode')
+    request = {
+        'port': port,
+        'baudrate': baudrate,
+        'bytesize': bytesize,
+        'parity': parity,
+        'stopbits': stopbits,
+        'timeout': timeout,
+        'data': data_to_send_bytes.hex(),
+        'read_response': read_response,
+        'response_mode': response_mode,
+        'terminator': terminator.hex(),
+        'expected_length': expected_length,
+        'gap': gap,
+        'wait_timeout': BROKER_WAIT_TIMEOUT,
+    }
+    if coalesce_key:
+        request['coalesce_key'] = coalesce_key
+        if coalesce_window is not None:
+            request['coalesce_window'] = coalesce_window
+    try:
+        reply = unix_ipc.request(BROKER_SOCKET_PATH, request, timeout=timeout + 30)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # socket 文件残留但代理已退出
+        return None
+    except OSError as e:
+        # 请求已交给代理：代理可能已经写入串口，不能回退到直接打开串口（代理独占该串口），也不能重发
+        vprint(QUIET, f"串口代理错误: {e}", file=sys.stderr)
+        metrics.finish(e)
+        return False, None
+    metrics.mark('response')
+    metrics.bytes_sent = len(data_to_send_bytes)
+    if not reply.get('ok'):
+        vprint(QUIET, f"串口代理错误: {reply.get('error')}", file=sys.stderr)
+        metrics.finish(reply.get('error', 'Error').split(':', 1)[0])
+        return False, None
+    if reply.get('superseded'):
+        metrics.finish()
+        vprint(SUMMARY, f"已被合并键 '{coalesce_key}' 上更新的命令取代，未发送。")
+        return True, None
+    if reply.get('suppressed'):
+        vprint(SUMMARY, "与上一次发送的内容相同，未重复发送。")
+    response = bytes.fromhex(reply['response']) if reply.get('response') else None
+    metrics.bytes_received = len(response or b'')
+    metrics.finish()
+    if read_response:
+        vprint(SUMMARY, f"收到响应: {response!r}" if response else "未收到响应.")
+    return True, response
 
 def send_serial_data(
     data_to_send: str | bytes,
@@ -25,7 +315,12 @@ def send_serial_data(
     stopbits: float = DEFAULT_STOPBITS,
     timeout: float = DEFAULT_TIMEOUT,
     read_response: bool = DEFAULT_READ_RESPONSE, # 新增参数：是否读取响应
-    encoding: str = 'ascii' # 新增参数：数据编码方式
+    encoding: str = 'ascii', # 新增参数：数据编码方式
+    response_mode: str = DEFAULT_RESPONSE_MODE,
+    terminator: bytes = DEFAULT_TERMINATOR,
+    expected_length: int = 0,
+    gap: float | None = None,
+    metrics: CallMetrics | None = None,
 ) -> tuple[bool, bytes | None]:
     """
     通过串口发送数据，并可选地读取响应。
@@ -40,73 +335,77 @@ def send_serial_data(
         timeout: 读取超时时间（秒）。
         read_response: 如果为 True，将尝试从串口读取响应数据。
         encoding: 当 data_to_send 为字符串时，用于编码的字符集，默认为 'ascii'。
+        response_mode: 响应读取方式 ('sleep', 'gap', 'terminator', 'length')，见 RESPONSE_MODES。
+        terminator: terminator 模式下的终止符。
+        expected_length: length 模式下期望的响应字节数；其他模式下作为上限（0 表示不限）。
+        gap: gap 模式下的静默间隔（秒），为 None 时按波特率/数据位/校验位/停止位自动计算。
+        metrics: （可选）CallMetrics 实例；为 None 时按 HA_TRANSPORT_METRICS 新建一个。
 
     Returns:
         tuple[bool, bytes | None]:
             第一个元素是布尔值，表示数据发送是否成功 (True/False)。
             第二个元素是字节串，如果 read_response 为 True 且收到数据，则为接收到的数据；否则为 None。
     """
-    print(f"send_serial_data 函数被调用，准备发送: {data_to_send!r}")
-    print(f"当前使用的串口参数: PORT={port}, BAUDRATE={baudrate}, BYTESIZE={bytesize}, PARITY={parity}, STOPBITS={stopbits}, TIMEOUT={timeout}, READ_RESPONSE={read_response}")
+    import serial
+    vprint(DETAIL, f"send_serial_data 函数被调用，准备发送: {data_to_send!r}")
+    vprint(DETAIL, f"当前使用的串口参数: PORT={port}, BAUDRATE={baudrate}, BYTESIZE={bytesize}, PARITY={parity}, STOPBITS={stopbits}, TIMEOUT={timeout}, READ_RESPONSE={read_response}")
+    if metrics is None:
+        metrics = CallMetrics('serial', port)
+    metrics.skip()
     
     received_data = None
     try:
-        ser = serial.Serial(
-            port=port,
-            baudrate=baudrate,
-            bytesize=bytesize,
-            parity=parity,
-            stopbits=stopbits,
-            timeout=timeout
-        )
-        print(f"串口 {port} 已成功打开。")
-
-        data_to_send_bytes: bytes
-        if isinstance(data_to_send, str):
-            try:
-                data_to_send_bytes = data_to_send.encode(encoding)
-                print(f"数据编码为 {encoding.upper()}: {data_to_send_bytes!r}")
-            except UnicodeEncodeError as e:
-                print(f"错误: 编码为 {encoding.upper()} 失败: {e}", file=sys.stderr)
-                print(f"警告: 尝试使用 'utf-8' 编码: {data_to_send!r}")
-                data_to_send_bytes = data_to_send.encode('utf-8')
-        elif isinstance(data_to_send, bytes):
-            data_to_send_bytes = data_to_send
-            print(f"数据已经是字节串: {data_to_send_bytes!r}")
-        else:
-            print(f"警告: 传入数据类型非字符串或字节串 ({type(data_to_send)})，尝试转换为字符串并用 'ascii' 编码: {data_to_send!r}")
-            data_to_send_bytes = str(data_to_send).encode('ascii')
-
-        print(f"发送数据 (字节): {data_to_send_bytes!r}, 长度: {len(data_to_send_bytes)} 字节")
-        ser.write(data_to_send_bytes)
-        print("数据已写入串口.")
-        time.sleep(0.1) # 给予设备响应时间，等待响应
+        check_response_mode(response_mode, expected_length)
+        data_to_send_bytes = encode_data(data_to_send, encoding)
+        metrics.mark('encode')
+        try:
+            ser = serial.Serial(
+                port=port,
+                baudrate=baudrate,
+                bytesize=bytesize,
+                parity=parity,
+                stopbits=stopbits,
+                timeout=timeout
+            )
+        finally:
+            metrics.mark('connect')
+        vprint(DETAIL, f"串口 {port} 已成功打开。")
+        metrics.skip()
 
-        if read_response:
-            # 尝试读取所有可用数据直到超时
-            read_data = ser.read_all()
-            if read_data:
-                received_data = read_data
-                print(f"收到响应: {received_data!r}")
-                try:
-                    print(f"响应 (尝试解码为 UTF-8): {received_data.decode('utf-8')!r}")
-                except UnicodeDecodeError:
-                    print("响应无法解码为 UTF-8。")
-            else:
-                print("未收到响应.")
+        received_data = transact(ser, data_to_send_bytes, read_response,
+                                 response_mode, terminator, expected_length, gap, metrics=metrics)
 
         ser.close()
-        print("串口已关闭.")
+        metrics.mark('close')
+        metrics.finish()
+        vprint(DETAIL, "串口已关闭.")
         return True, received_data
 
     except serial.SerialException as e:
-        print(f"串口错误: {e}", file=sys.stderr)
+        metrics.finish(e)
+        trace_ring.record('serial', port, trace_ring.ERROR, e)
+        vprint(QUIET, f"串口错误: {e}", file=sys.stderr)
+        return False, None
+    except ValueError as e:
+        metrics.finish(e)
+        vprint(QUIET, f"错误: {e}", file=sys.stderr)
         return False, None
     except Exception as e:
-        print(f"发生未知错误: {e}", file=sys.stderr)
+        metrics.finish(e)
+        vprint(QUIET, f"发生未知错误: {e}", file=sys.stderr)
         return False, None
 
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--broker':
+        # 常驻模式: python send_serial_data.py --broker [socket_path]
+        import serial_broker
+        serial_broker.run_broker(sys.argv[2] if len(sys.argv) > 2 else BROKER_SOCKET_PATH)
+        sys.exit(0)
+
+    # 参数解析阶段从这里开始计时；串口路径在解析完成后才知道
+    metrics = CallMetrics('serial', None, process_start=True)
+    import argparse
+    import serial
     parser = argparse.ArgumentParser(description="通过串口发送数据，支持自定义串口参数。")
     parser.add_argument("data", type=str, help="要发送的数据。如果是十六进制，请使用 --hex 选项。")
     parser.add_argument("--port", type=str, default=DEFAULT_PORT,
@@ -130,8 +429,26 @@ if __name__ == "__main__":
                         help="将要发送的数据视为十六进制字符串进行解析（例如 '010300000001840A'）。")
     parser.add_argument("--encoding", type=str, default='ascii',
                         help="当发送数据为字符串时使用的编码方式（例如 'ascii', 'utf-8', 'latin-1'） (默认: 'ascii')。")
+    parser.add_argument("--response-mode", type=str, default=DEFAULT_RESPONSE_MODE, choices=RESPONSE_MODES,
+                        help="响应读取方式: sleep=固定等待0.1秒后读取, gap=按波特率计算的3.5字符静默间隔结束, "
+                             f"terminator=读到终止符为止, length=读满期望字节数 (默认: {DEFAULT_RESPONSE_MODE})。")
+    parser.add_argument("--terminator", type=str, default='\\r',
+                        help="terminator 模式的终止符，支持反斜杠转义 (默认: '\\r')。")
+    parser.add_argument("--expected-length", type=int, default=0,
+                        help="length 模式下期望的响应字节数；其他模式下作为上限 (默认: 0，不限)。")
+    parser.add_argument("--gap", type=float, default=None,
+                        help="gap 模式的静默间隔（秒），默认按串口参数自动计算。")
+    parser.add_argument("--no-broker", action="store_true",
+                        help="不经过串口代理，直接打开串口发送。")
+    parser.add_argument("--decode", type=str, default=None,
+                        help="响应解码器: number | regex:<正则> | struct:<格式>:<字段,...> | JSON（见 response_decoders.py）。")
+    parser.add_argument("--coalesce-key", type=str, default=None,
+                        help="合并键（例如 projector:volume）：同一合并键上连续的命令只发送最后一条，需要串口代理。")
+    parser.add_argument("--coalesce-window", type=float, default=None,
+                        help="合并窗口（秒），默认见 command_coalescer.py。")
 
     args = parser.parse_args()
+    metrics.target = args.port
 
     # 将命令行参数中的校验位字符串转换为 pyserial 常量
     parity_map = {
@@ -147,22 +464,76 @@ if __name__ == "__main__":
         try:
             # 移除数据中的空格（如果有），然后从十六进制字符串转换为字节串
             data_to_send_processed = bytes.fromhex(args.data.replace(" ", ""))
-            print(f"已将十六进制字符串 '{args.data}' 解析为字节: {data_to_send_processed!r}")
+            vprint(DETAIL, f"已将十六进制字符串 '{args.data}' 解析为字节: {data_to_send_processed!r}")
         except ValueError as ve:
-            print(f"错误: 无效的十六进制数据 '{args.data}' - {ve}", file=sys.stderr)
+            vprint(QUIET, f"错误: 无效的十六进制数据 '{args.data}' - {ve}", file=sys.stderr)
+            metrics.finish(ve)
+            sys.exit(1)
+
+    try:
+        check_response_mode(args.response_mode, args.expected_length)
+    except ValueError as e:
+        vprint(QUIET, f"错误: {e}（--expected-length）", file=sys.stderr)
+        metrics.finish(e)
+        sys.exit(1)
+    decoder = None
+    if args.decode:
+        from response_decoders import compile_decoder
+        try:
+            decoder = compile_decoder(args.decode)
+        except ValueError as e:
+            vprint(QUIET, f"错误: 无效的解码器 '{args.decode}': {e}", file=sys.stderr)
+            metrics.finish(e)
             sys.exit(1)
+    response_options = {
+        'response_mode': args.response_mode,
+        'terminator': codecs.decode(args.terminator, 'unicode_escape').encode('latin-1'),
+        'expected_length': args.expected_length,
+        'gap': args.gap,
+    }
+    metrics.mark('parse')
 
-    success, response = send_serial_data(
-        data_to_send=data_to_send_processed,
-        port=args.port,
-        baudrate=args.baudrate,
-        bytesize=args.bytesize, # bytesize 默认值就是 pyserial 常量值 (5,6,7,8), 直接使用
-        parity=parity_map.get(args.parity, DEFAULT_PARITY),
-        stopbits=args.stopbits, # stopbits 默认值就是 pyserial 常量值 (1.0, 1.5, 2.0), 直接使用
-        timeout=args.timeout,
-        read_response=args.read_response,
-        encoding=args.encoding
-    )
+    result = None
+    if not args.no_broker:
+        result = send_via_broker(
+            data_to_send_processed,
+            port=args.port,
+            baudrate=args.baudrate,
+            bytesize=args.bytesize,
+            parity=parity_map.get(args.parity, DEFAULT_PARITY),
+            stopbits=args.stopbits,
+            timeout=args.timeout,
+            read_response=args.read_response,
+            encoding=args.encoding,
+            metrics=metrics,
+            coalesce_key=args.coalesce_key,
+            coalesce_window=args.coalesce_window,
+            **response_options,
+        )
+    if result is None:
+        result = send_serial_data(
+            data_to_send=data_to_send_processed,
+            port=args.port,
+            baudrate=args.baudrate,
+            bytesize=args.bytesize, # bytesize 默认值就是 pyserial 常量值 (5,6,7,8), 直接使用
+            parity=parity_map.get(args.parity, DEFAULT_PARITY),
+            stopbits=args.stopbits, # stopbits 默认值就是 pyserial 常量值 (1.0, 1.5, 2.0), 直接使用
+            timeout=args.timeout,
+            read_response=args.read_response,
+            encoding=args.encoding,
+            metrics=metrics,
+            **response_options,
+        )
+    success, response = result
+
+    if success and decoder is not None and response:
+        import json
+        from response_decoders import DecodeError
+        try:
+            vprint(SUMMARY, f"解析结果: {json.dumps(decoder.decode(response), ensure_ascii=False)}")
+        except DecodeError as e:
+            vprint(QUIET, f"错误: 无法解析响应: {e}", file=sys.stderr)
+            success = False
 
     if success:
         sys.exit(0)
@@ -1,132 +1,402 @@
 #!/usr/bin/env python3
 # send_tcp_command.py
+import json
+import os
 import socket
 import sys
-import time
 
-def hex_string_to_bytes(hex_str):
+import device_health
+from response_decoders import NUMBER as NUMBER_DECODER
+from response_decoders import DecodeError
+from tcp_wire import (  # noqa: F401  tcp_exchange / hex_string_to_bytes 由其他脚本和 av_control 集成从本模块导入
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_FRAMING,
+    DEFAULT_READ_TIMEOUT,
+    encode_tcp_payload,
+    hex_string_to_bytes,
+    tcp_exchange,
+)
+from transport_metrics import DETAIL, QUIET, SUMMARY, CallMetrics, vprint
+
+# TCP 连接池守护进程的 Unix socket 路径（见 tcp_pool.py）。
+# 守护进程在运行时，命令通过它的长连接发送；否则回退到每次直接建立连接。
+DAEMON_SOCKET_PATH = os.environ.get('HA_TCP_DAEMON_SOCKET', '/tmp/ha_tcp_daemon.sock')
+
+
+def build_tcp_payload(command_input, should_append_cr, should_send_hex, encoding='utf-8', verbose=True):
+    """
+    按照 HEX / 文本规则把命令字符串转换为要发送的字节（规则见 tcp_wire.encode_tcp_payload）。
+    verbose 为 False 时不打印转换过程（批量模式下多个线程同时调用）；
+    为 True 时按 HA_TRANSPORT_VERBOSE=2 的详细级别打印。
+
+    Raises:
+        ValueError: HEX 字符串无效。
+    """
+    data_to_send = encode_tcp_payload(command_input, should_append_cr, should_send_hex, encoding)
+    if verbose:
+        vprint(DETAIL, f"命令字符串: '{command_input}'")
+        if should_send_hex:
+            vprint(DETAIL, f"解释为 HEX{'（含回车符 0D）' if should_append_cr else ''}: -> {data_to_send.hex().upper()}")
+        else:
+            printable = (command_input + '\r' if should_append_cr else command_input).replace('\r', '\\r')
+            vprint(DETAIL, f"解释为 {encoding.upper()}: '{printable}'")
+    return data_to_send
+
+def send_via_daemon(ip, port, data_to_send, read_response=True, read_timeout=DEFAULT_READ_TIMEOUT,
+                    framing=DEFAULT_FRAMING, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                    coalesce_key=None, coalesce_window=None, transport='tcp', reply_window=None,
+                    broadcast=False):
+    """
+    通过 TCP 连接池守护进程发送数据。
+
+    `transport` 为 'udp' 时守护进程用它复用的 UDP socket 发送（见 udp_transport.py），
+    在 `reply_window` 秒内收集应答，响应中的 replies 为全部应答（组播 / 广播目标可能有多个）；
+    `broadcast` 为 True 表示目标是子网定向广播地址。
+
+    给出 `coalesce_key` 时，守护进程把同一合并键上 `coalesce_window` 秒内连续到达的命令合并为最后一条
+    （见 command_coalescer.py）：被取代的调用返回 {"ok": true, "superseded": true}，
+    与上一次发送内容相同的命令返回 {"ok": true, "suppressed": true}，两者都不会发往设备。
+
+    只有守护进程没有运行（socket 不存在或连接被拒绝，数据还没有交给守护进程）时才返回 None 由调用方直接发送。
+    请求已经发出后的超时或无效响应不能回退：守护进程可能已经把命令发往设备，
+    直接重发会让设备收到两次，也绕过了合并和重复抑制。
+
+    Returns:
+        dict | None: 守护进程的响应；守护进程未运行时返回 None。
+
+    Raises:
+        ConnectionError: 守护进程在运行，但没有在超时内返回有效的响应。
     """
-    将一个空格分隔的十六进制字符串（例如：'01 0A FF'）转换为字节对象。
+    if not os.path.exists(DAEMON_SOCKET_PATH):
+        return None
+    import unix_ipc
+    request = {
+        'ip': ip,
+        'port': int(port),
+        'data': data_to_send.hex(),
+        'read_response': read_response,
+        'read_timeout': read_timeout,
+        'connect_timeout': connect_timeout,
+        'framing': framing,
+    }
+    timeout = connect_timeout + read_timeout + 5
+    if transport == 'udp':
+        request['transport'] = 'udp'
+        if reply_window is not None:
+            request['reply_window'] = reply_window
+            timeout += reply_window
+        if broadcast:
+            request['broadcast'] = True
+    if coalesce_key:
+        request['coalesce_key'] = coalesce_key
+        if coalesce_window is not None:
+            request['coalesce_window'] = coalesce_window
+        # 合并时还要等待合并窗口，以及同一合并键上一条命令发送完成
+        timeout += connect_timeout + read_timeout + (coalesce_window or 0)
+    try:
+        return unix_ipc.request(DAEMON_SOCKET_PATH, request, timeout=timeout)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # socket 文件残留但守护进程已退出
+        return None
+    except TimeoutError:
+        raise ConnectionError(f"连接池守护进程在 {timeout:g} 秒内没有响应（命令可能已经发出，未直接重发）") from None
+
+def udp_exchange(ip, port, data_to_send, read_response=True, reply_window=None, metrics=None, broadcast=False):
     """
-    hex_str = hex_str.replace(" ", "").replace("0x", "").replace("x", "") # 移除空格和0x前缀
-    if not hex_str:
-        return b''
-    
-    # 检查是否为偶数长度，因为每个字节需要两个十六进制字符
-    if len(hex_str) % 2 != 0:
-        raise ValueError(f"无效的十六进制字符串长度 '{hex_str}'。十六进制字符数必须是偶数。")
-        
+    通过 UDP 发送数据（见 udp_transport.py）：复用进程内绑定好的 socket，
+    需要应答时在 `reply_window` 秒内收集（单播目标收到第一个应答即返回）。
+    `broadcast` 为 True 表示目标是子网定向广播地址，收集所有设备的应答。
+
+    Returns:
+        list[tuple[str, bytes]]: 收到的应答 [(来源 "ip:port", 数据), ...]。
+
+    Raises:
+        OSError: 发送失败。
+    """
+    import udp_transport
+    if reply_window is None:
+        reply_window = udp_transport.DEFAULT_REPLY_WINDOW
+    if metrics is None:
+        metrics = CallMetrics('udp', f"{ip}:{port}", enabled=False)
+    replies = udp_transport.shared_sender().exchange(ip, port, data_to_send, read_response, reply_window, broadcast)
+    # 发送和收集应答在一次调用内完成，整个往返计入 response 阶段
+    metrics.mark('response')
+    metrics.bytes_sent += len(data_to_send)
+    metrics.bytes_received += sum(len(reply) for _, reply in replies)
+    return replies
+
+def print_replies(replies, decoder=None):
+    """打印组播 / 广播目标的多个应答，每个应答前标明来源。"""
+    vprint(SUMMARY, f"收到 {len(replies)} 个应答:")
+    for source, reply in replies:
+        vprint(SUMMARY, f"[{source}]")
+        try:
+            print_response(reply, decoder)
+        except DecodeError as e:
+            vprint(QUIET, f"错误: 无法解析 {source} 的响应: {e}")
+
+def print_response(response, decoder=None, decode_stream=None):
+    """
+    打印响应并解析。
+
+    未指定解码器（或为默认的 number 解码器）时与旧版本相同：尝试提取数值，返回提取到的数值（没有则为 None）。
+    指定了解码器时返回解析出的字段字典；`decode_stream` 为读取时已增量解码的状态。
+
+    Raises:
+        DecodeError: 响应与解码器不匹配。
+    """
+    received_numeric_value = None
+    vprint(DETAIL, "\n--- 收到响应 ---")
+    decoded_response = None
     try:
-        return bytes.fromhex(hex_str)
-    except ValueError:
-        raise ValueError(f"无效的十六进制字符 '{hex_str}'。请确保只包含有效的十六进制字符 (0-9, A-F)。")
+        # 尝试将响应解码为 UTF-8 字符串，并去除首尾空白
+        decoded_response = response.decode('utf-8').strip()
+        vprint(SUMMARY, f"收到响应 (文本): '{decoded_response}'")
+    except UnicodeDecodeError:
+        # 如果 UTF-8 解码失败，打印原始 HEX 数据
+        vprint(SUMMARY, f"收到响应 (无法解码，HEX): {response.hex().upper()}")
+
+    if decoder is not None and decoder is not NUMBER_DECODER:
+        if decode_stream is None:
+            decode_stream = decoder.stream()
+            decode_stream.feed(response)
+        fields = decode_stream.finish()
+        vprint(SUMMARY, f"解析结果: {json.dumps(fields, ensure_ascii=False)}")
+        return fields
 
-def send_tcp_command(ip, port, command_input, append_cr_str, send_hex_str):
+    # ======== 处理接收到的数值 ========
+    if decoded_response:
+        # 尝试将解码后的字符串转换为整数或浮点数
+        try:
+            # 假设响应直接是数值，或者可以通过int/float转换
+            received_numeric_value = int(decoded_response)
+            vprint(DETAIL, f"提取到的数值 (整数): {received_numeric_value}")
+        except ValueError:
+            try:
+                received_numeric_value = float(decoded_response)
+                vprint(DETAIL, f"提取到的数值 (浮点数): {received_numeric_value}")
+            except ValueError:
+                vprint(DETAIL, "响应中未检测到简单的数值（非整数或浮点数）。")
+    # ==================================
+    return received_numeric_value
+
+def send_tcp_command(ip, port, command_input, append_cr_str, send_hex_str, encoding='utf-8', use_daemon=True,
+                     connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                     framing=DEFAULT_FRAMING, metrics=None, decoder=None, coalesce_key=None, coalesce_window=None,
+                     transport='tcp', reply_window=None, broadcast=False):
     # 将字符串参数转换为布尔值
     should_append_cr = append_cr_str.lower() == 'true'
     should_send_hex = send_hex_str.lower() == 'true'
-    data_to_send = b'' # 初始化为字节对象
-    
+
+    if metrics is None:
+        metrics = CallMetrics(transport, f"{ip}:{port}")
+
     # 定义一个变量来存储接收到的数值
     received_numeric_value = None 
 
-    if should_send_hex:
-        try:
-            data_to_send = hex_string_to_bytes(command_input)
-            print(f"命令字符串: '{command_input}'")
-            print(f"解释为 HEX: -> {data_to_send.hex().upper()}")
-        except ValueError as e:
-            print(f"错误: {e}")
-            sys.exit(1)
-        
-        if should_append_cr:
-            # 如果是发送HEX且需要添加回车，则添加HEX的0D字节
-            data_to_send += b'\x0D' 
-            print(f"追加 HEX 回车符 (0D): {data_to_send.hex().upper()}")
-    else:
-        # 不是发送HEX，按普通字符串处理
-        command_string = command_input
-        if should_append_cr:
-            command_string += '\r' # 追加ASCII回车符
-        data_to_send = command_string.encode('utf-8') # 默认使用UTF-8编码
-        print(f"命令字符串: '{command_input}'")
-        print(f"解释为 ASCII/UTF-8: '{command_string.replace('\\r', '\\\\r')}'")
-
-    print(f"连接到 {ip}:{port}")
+    try:
+        data_to_send = build_tcp_payload(command_input, should_append_cr, should_send_hex, encoding or 'utf-8')
+    except (ValueError, LookupError) as e:
+        vprint(QUIET, f"错误: {e}")
+        metrics.finish(e)
+        sys.exit(1)
+    metrics.mark('encode')
+
+    vprint(DETAIL, f"连接到 {ip}:{port}")
     # 打印最终要发送的数据的HEX表示，便于调试
-    print(f"最终发送数据 (HEX): {data_to_send.hex().upper()}")
+    vprint(SUMMARY, f"{ip}:{port} 发送 (HEX): {data_to_send.hex().upper()}")
+    metrics.skip()
 
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(5) # 设置连接、发送和接收超时时间为5秒
-            s.connect((ip, int(port)))
-            s.sendall(data_to_send)
-            print("数据已发送。")
-            
-            # ======== 接收响应部分 ========
+    if use_daemon:
+        try:
+            reply = send_via_daemon(ip, port, data_to_send, read_timeout=read_timeout,
+                                    framing=framing, connect_timeout=connect_timeout,
+                                    coalesce_key=coalesce_key, coalesce_window=coalesce_window,
+                                    transport=transport, reply_window=reply_window, broadcast=broadcast)
+        except OSError as e:
+            vprint(QUIET, f"错误: {e}")
+            metrics.finish(e)
+            return
+        if reply is not None:
+            # 经守护进程发送时连接、发送和读取都在守护进程内完成，整个往返计入 response 阶段
+            metrics.mark('response')
+            metrics.bytes_sent = len(data_to_send)
+            vprint(DETAIL, "数据已通过连接池守护进程发送。")
+            if not reply.get('ok'):
+                vprint(QUIET, f"错误: {reply.get('error')}")
+                metrics.finish(reply.get('error', 'Error').split(':', 1)[0])
+                return
+            if reply.get('superseded'):
+                metrics.finish()
+                vprint(SUMMARY, f"已被合并键 '{coalesce_key}' 上更新的命令取代，未发送。")
+                return
+            if reply.get('suppressed'):
+                vprint(SUMMARY, "与上一次发送的内容相同，未重复发送。")
+            if len(reply.get('replies') or ()) > 1:
+                metrics.finish()
+                print_replies([(item['from'], bytes.fromhex(item['data'])) for item in reply['replies']], decoder)
+                return
+            if reply.get('response'):
+                response = bytes.fromhex(reply['response'])
+                metrics.bytes_received = len(response)
+                metrics.finish()
+                try:
+                    received_numeric_value = print_response(response, decoder)
+                except DecodeError as e:
+                    vprint(QUIET, f"错误: 无法解析响应: {e}")
+            else:
+                metrics.finish()
+                vprint(SUMMARY, "未收到响应。")
+            if received_numeric_value is not None:
+                vprint(DETAIL, f"最终提取到的数值: {received_numeric_value}")
+            return
+
+    if transport == 'udp':
+        try:
+            replies = udp_exchange(ip, port, data_to_send, reply_window=reply_window, metrics=metrics,
+                                   broadcast=broadcast)
+        except OSError as e:
+            vprint(QUIET, f"错误: UDP 发送失败: {e}")
+            metrics.finish(e)
+            return
+        metrics.finish()
+        if len(replies) > 1:
+            print_replies(replies, decoder)
+        elif replies:
             try:
-                # 尝试接收最多 1024 字节的数据
-                response = s.recv(1024) 
-                if response:
-                    print("\n--- 收到响应 ---")
-                    decoded_response = None
-                    try:
-                        # 尝试将响应解码为 UTF-8 字符串，并去除首尾空白
-                        decoded_response = response.decode('utf-8').strip()
-                        print(f"收到响应 (文本): '{decoded_response}'")
-                    except UnicodeDecodeError:
-                        # 如果 UTF-8 解码失败，打印原始 HEX 数据
-                        print(f"收到响应 (无法解码，HEX): {response.hex().upper()}")
-                        
-                    # ======== 处理接收到的数值 ========
-                    if decoded_response:
-                        # 尝试将解码后的字符串转换为整数或浮点数
-                        try:
-                            # 假设响应直接是数值，或者可以通过int/float转换
-                            received_numeric_value = int(decoded_response)
-                            print(f"提取到的数值 (整数): {received_numeric_value}")
-                        except ValueError:
-                            try:
-                                received_numeric_value = float(decoded_response)
-                                print(f"提取到的数值 (浮点数): {received_numeric_value}")
-                            except ValueError:
-                                print("响应中未检测到简单的数值（非整数或浮点数）。")
-                    # ==================================
-                else:
-                    print("未收到响应。")
-            except socket.timeout:
-                print("接收响应超时（在5秒内未收到数据）。")
-            # ==================================
-
-            # ======== 等待关闭连接（如果需要） ========
-            # 如果你确实需要在收到响应后仍然等待5秒再关闭连接，则保留此行。
-            # 这对于某些需要连接保持一段时间的设备协议可能有用。
-            # 如果你希望收到响应后立即关闭，可以移除这 5 秒的等待。
-            #print("等待 5 秒后关闭连接...")
-            #time.sleep(5) 
-            # ==================================
-
-    except socket.timeout:
-        print("错误: Socket 操作超时（连接或发送）。")
-    except ConnectionRefusedError:
-        print("错误: 连接被拒绝。请检查 IP 地址和端口，或目标设备是否在线。")
+                received_numeric_value = print_response(replies[0][1], decoder)
+            except DecodeError as e:
+                vprint(QUIET, f"错误: 无法解析响应: {e}")
+            if received_numeric_value is not None:
+                vprint(DETAIL, f"最终提取到的数值: {received_numeric_value}")
+        elif reply_window == 0:
+            vprint(SUMMARY, "已通过 UDP 发送（不等待应答）。")
+        else:
+            vprint(SUMMARY, "未收到 UDP 应答。")
+        return
+
+    error = None
+    decode_stream = decoder.stream() if decoder is not None and decoder is not NUMBER_DECODER else None
+    try:
+        # ======== 发送并接收响应 ========
+        response = tcp_exchange(ip, port, data_to_send, connect_timeout=connect_timeout,
+                                read_timeout=read_timeout, framing=framing, metrics=metrics,
+                                decode_stream=decode_stream)
+        metrics.finish()
+        vprint(DETAIL, "数据已发送。")
+        if response:
+            received_numeric_value = print_response(response, decoder, decode_stream)
+        else:
+            vprint(SUMMARY, f"未收到响应（在 {read_timeout} 秒内未收到数据）。")
+        # ==================================
+
+    except DecodeError as e:
+        vprint(QUIET, f"错误: 无法解析响应: {e}")
+    except device_health.DeviceUnavailableError as e:
+        error = e
+        vprint(QUIET, f"错误: {e}")
+    except socket.timeout as e:
+        error = e
+        vprint(QUIET, "错误: Socket 操作超时（连接或发送）。")
+    except ConnectionRefusedError as e:
+        error = e
+        vprint(QUIET, "错误: 连接被拒绝。请检查 IP 地址和端口，或目标设备是否在线。")
     except Exception as e:
-        print(f"发生意外错误: {e}")
+        error = e
+        vprint(QUIET, f"发生意外错误: {e}")
     finally:
-        print("连接已关闭。")
+        if error is not None:
+            metrics.finish(error)
+        vprint(DETAIL, "连接已关闭。")
         # 可以在这里打印最终提取到的数值，例如：
         if received_numeric_value is not None:
-            print(f"最终提取到的数值: {received_numeric_value}")
+            vprint(DETAIL, f"最终提取到的数值: {received_numeric_value}")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 6: # 现在期望 5 个参数 + 脚本名 = 6
-        print("用法: python send_tcp_command.py <ip> <port> <command> <append_cr> <send_hex>")
+    if len(sys.argv) >= 2 and sys.argv[1] == '--daemon':
+        # 常驻模式: python send_tcp_command.py --daemon [socket_path]
+        import tcp_pool
+        tcp_pool.run_daemon(sys.argv[2] if len(sys.argv) > 2 else DAEMON_SOCKET_PATH)
+        sys.exit(0)
+
+    import argparse
+
+    if len(sys.argv) >= 2 and sys.argv[1] in ('--batch', '--batch-json'):
+        # 批量并发模式: python send_tcp_command.py --batch <file.json|file.yaml|->
+        #               python send_tcp_command.py --batch-json '<JSON 列表>'
+        import tcp_batch
+        batch_parser = argparse.ArgumentParser(description="批量并发发送 TCP 命令。")
+        source = batch_parser.add_mutually_exclusive_group(required=True)
+        source.add_argument("--batch", help="命令列表文件 (JSON/YAML)，'-' 表示标准输入")
+        source.add_argument("--batch-json", help="直接以 JSON 字符串给出的命令列表")
+        batch_parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+        batch_parser.add_argument("--max-workers", type=int, default=tcp_batch.MAX_WORKERS,
+                                  help=f"最多同时处理的设备数 (默认: {tcp_batch.MAX_WORKERS})")
+        batch_args = batch_parser.parse_args()
+        try:
+            if batch_args.batch_json is not None:
+                entries = tcp_batch.parse_batch(batch_args.batch_json)
+            else:
+                entries = tcp_batch.load_batch(batch_args.batch)
+        except (OSError, ValueError) as e:
+            print(f"错误: 无法读取批量命令: {e}")
+            sys.exit(1)
+        results = tcp_batch.run_batch(entries, batch_args.max_workers)
+        tcp_batch.print_results(results, as_json=batch_args.json)
+        sys.exit(0 if all(result['ok'] for result in results) else 1)
+    # 参数解析阶段从这里开始计时；目标地址在解析完成后才知道
+    metrics = CallMetrics('tcp', None, process_start=True)
+    parser = argparse.ArgumentParser(
+        description="通过 TCP 发送命令。常驻模式: send_tcp_command.py --daemon [socket_path]")
+    parser.add_argument("ip", help="目标设备 IP 地址")
+    parser.add_argument("port", help="目标设备端口")
+    parser.add_argument("command", help="要发送的命令（HEX 时以空格分隔字节）")
+    parser.add_argument("append_cr", help="是否追加回车符 (true/false)")
+    parser.add_argument("send_hex", help="是否按 HEX 发送 (true/false)")
+    parser.add_argument("encoding", nargs="?", default="utf-8", help="文本编码 (默认: utf-8)")
+    parser.add_argument("--connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help=f"连接超时（秒）(默认: {DEFAULT_CONNECT_TIMEOUT})")
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT,
+                        help=f"等待完整响应的超时（秒）(默认: {DEFAULT_READ_TIMEOUT})")
+    parser.add_argument("--framing", default=DEFAULT_FRAMING,
+                        help="响应分帧方式: once | terminator[:\\r] | length:N | prefix:N[:little] | idle:秒 "
+                             f"(默认: {DEFAULT_FRAMING})")
+    parser.add_argument("--decode", default=None,
+                        help="响应解码器: number | regex:<正则> | struct:<格式>:<字段,...> | JSON（见 response_decoders.py）")
+    parser.add_argument("--coalesce-key", default=None,
+                        help="合并键（例如 projector:volume）：同一合并键上连续的命令只发送最后一条，需要连接池守护进程")
+    parser.add_argument("--coalesce-window", type=float, default=None,
+                        help="合并窗口（秒）(默认: 见 command_coalescer.py)")
+    parser.add_argument("--udp", action="store_true",
+                        help="通过 UDP 发送（目标可以是组播 / 广播地址），--framing / --connect-timeout 不适用")
+    parser.add_argument("--reply-window", type=float, default=None,
+                        help="UDP 模式下收集应答的时间（秒），0 表示发出即返回 (默认: 见 udp_transport.py)")
+    parser.add_argument("--broadcast", action="store_true",
+                        help="UDP 目标是子网定向广播地址（例如 192.168.3.255），收集所有设备的应答")
+    args = parser.parse_args()
+    metrics.target = f"{args.ip}:{args.port}"
+    if args.udp:
+        metrics.transport = 'udp'
+
+    try:
+        from framing import parse_framing
+        parse_framing(args.framing)
+    except ValueError as e:
+        vprint(QUIET, f"错误: 无效的分帧方式 '{args.framing}': {e}")
+        metrics.finish(e)
         sys.exit(1)
-    
-    ip_address = sys.argv[1]
-    port_number = sys.argv[2]
-    command_to_send = sys.argv[3]
-    append_cr_param = sys.argv[4]
-    send_hex_param = sys.argv[5] # 获取第五个参数
-
-    send_tcp_command(ip_address, port_number, command_to_send, append_cr_param, send_hex_param)
+    try:
+        from response_decoders import compile_decoder
+        decoder = compile_decoder(args.decode)
+    except ValueError as e:
+        vprint(QUIET, f"错误: 无效的解码器 '{args.decode}': {e}")
+        metrics.finish(e)
+        sys.exit(1)
+    metrics.mark('parse')
+
+    send_tcp_command(args.ip, args.port, args.command, args.append_cr, args.send_hex, args.encoding,
+                     connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                     framing=args.framing, metrics=metrics, decoder=decoder,
+                     coalesce_key=args.coalesce_key, coalesce_window=args.coalesce_window,
+                     transport='udp' if args.udp else 'tcp', reply_window=args.reply_window,
+                     broadcast=args.broadcast)
@@ -0,0 +1,184 @@
+# serial_broker.py
+# 常驻串口代理：每个串口只打开一次并保持打开，所有调用方的请求进入该串口的 FIFO 队列，
+# 由一个工作线程依次写入/读取，再把响应交还给发起请求的调用方。
+# 这样多个脚本同时触发时不会再争抢 /dev/ttyS1，也不用为每条命令重新打开和配置串口。
+import queue
+import signal
+import sys
+import threading
+import time
+
+import serial
+
+import unix_ipc
+from command_coalescer import CommandCoalescer
+from send_serial_data import DEFAULT_RESPONSE_MODE, DEFAULT_TIMEOUT, check_response_mode, transact
+
+
+class _Request:
+    def __init__(self, settings, data, read_response, response_options):
+        self.settings = settings
+        self.data = data
+        self.read_response = read_response
+        self.response_options = response_options
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self._state_lock = threading.Lock()
+        self._state = 'queued'  # queued -> running，或 queued -> dropped（客户端已放弃，不再写入串口）
+
+    def start(self):
+        """工作线程开始处理前调用。返回 False 表示请求已被丢弃。"""
+        with self._state_lock:
+            if self._state == 'dropped':
+                return False
+            self._state = 'running'
+            return True
+
+    def drop(self):
+        """丢弃仍在排队的请求。返回 False 表示工作线程已经开始写入，无法撤回。"""
+        with self._state_lock:
+            if self._state == 'running':
+                return False
+            self._state = 'dropped'
+            return True
+
+
+class SerialPortWorker:
+    """持有一个打开的串口，按 FIFO 顺序处理该串口上的请求。"""
+
+    def __init__(self, port):
+        self.port = port
+        self.queue = queue.Queue()
+        self.ser = None
+        self.settings = None
+        threading.Thread(target=self._run, name=f"serial-{port}", daemon=True).start()
+
+    def _ensure_open(self, settings):
+        if self.ser is not None and self.ser.is_open:
+            if settings != self.settings:
+                # 串口参数变化时直接在已打开的串口上重新配置，无需关闭
+                self.ser.apply_settings(settings)
+                self.settings = settings
+                print(f"串口 {self.port} 参数已更新: {settings}")
+            return
+        self.ser = serial.Serial(port=self.port, **settings)
+        self.settings = settings
+        print(f"串口 {self.port} 已打开并保持: {settings}")
+
+    def _run(self):
+        while True:
+            request = self.queue.get()
+            if not request.start():
+                continue
+            try:
+                self._ensure_open(request.settings)
+                request.response = transact(self.ser, request.data, request.read_response,
+                                            **request.response_options)
+            except serial.SerialException as e:
+                request.error = f"串口错误: {e}"
+                # 串口可能被拔出或出错，下次请求时重新打开
+                self._close()
+            except Exception as e:
+                request.error = f"{type(e).__name__}: {e}"
+            finally:
+                request.done.set()
+
+    def _close(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except Exception:
+                pass
+        self.ser = None
+        self.settings = None
+
+    def submit(self, settings, data, read_response, response_options=None, deadline=None):
+        """
+        排队写入并等待结果。
+
+        `deadline`（time.monotonic() 时刻）之前还没轮到的请求被丢弃，不再写入串口；
+        已经开始写入的请求等待本次读写完成（以串口的 timeout 为上限）。
+        """
+        request = _Request(settings, data, read_response, response_options or {})
+        self.queue.put(request)
+        wait_timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not request.done.wait(wait_timeout) and request.drop():
+            raise TimeoutError(f"串口 {self.port} 队列等待超时，请求已丢弃，未写入串口。")
+        request.done.wait()
+        if request.error:
+            raise RuntimeError(request.error)
+        return request.response
+
+
+class SerialBroker:
+    def __init__(self):
+        self._workers = {}
+        self._guard = threading.Lock()
+        self.coalescer = CommandCoalescer(self.forward)
+
+    def worker(self, port):
+        with self._guard:
+            worker = self._workers.get(port)
+            if worker is None:
+                worker = self._workers[port] = SerialPortWorker(port)
+            return worker
+
+    def handle(self, request):
+        """
+        处理一个代理请求（JSON 行）::
+
+            {"port": "/dev/ttyS1", "baudrate": 9600, "bytesize": 8, "parity": "N",
+             "stopbits": 1.0, "timeout": 1, "data": "<HEX>", "read_response": false,
+             "response_mode": "gap", "terminator": "0D", "expected_length": 0, "gap": null,
+             "coalesce_key": "projector:volume", "coalesce_window": 0.15, "wait_timeout": 25}
+
+        响应为 {"ok": true, "response": "<HEX>" | null}。带 coalesce_key 的请求先经过合并
+        （见 command_coalescer.py），被取代时响应带 "superseded": true，幂等重复带 "suppressed": true。
+        wait_timeout（秒）从收到请求开始计时（包括合并等待）：到时仍在排队的请求被丢弃并返回错误，
+        客户端在此之后已经放弃等待，不应再写入串口。
+        """
+        if request.get("wait_timeout") is not None:
+            request["_deadline"] = time.monotonic() + float(request["wait_timeout"])
+        if request.get("coalesce_key"):
+            fingerprint = (request["port"], request["data"].upper())
+            return self.coalescer.submit(request["coalesce_key"], request, fingerprint)
+        return self.forward(request)
+
+    def forward(self, request):
+        """把请求交给对应串口的工作线程，等待写入和读取完成。"""
+        timeout = float(request.get("timeout", DEFAULT_TIMEOUT))
+        settings = {
+            "baudrate": int(request["baudrate"]),
+            "bytesize": int(request["bytesize"]),
+            "parity": request["parity"],
+            "stopbits": float(request["stopbits"]),
+            "timeout": timeout,
+        }
+        response_options = {
+            "response_mode": request.get("response_mode", DEFAULT_RESPONSE_MODE),
+            "expected_length": int(request.get("expected_length") or 0),
+            "gap": request.get("gap"),
+        }
+        # 在排队之前拒绝无效的读取方式，错误直接返回给客户端
+        check_response_mode(response_options["response_mode"], response_options["expected_length"])
+        if request.get("terminator"):
+            response_options["terminator"] = bytes.fromhex(request["terminator"])
+        worker = self.worker(request["port"])
+        response = worker.submit(
+            settings,
+            bytes.fromhex(request["data"]),
+            bool(request.get("read_response", False)),
+            response_options,
+            deadline=request.get("_deadline"),
+        )
+        return {"ok": True, "response": response.hex().upper() if response is not None else None}
+
+
+def run_broker(socket_path):
+    """启动串口代理，在 `socket_path` 上接收请求，阻塞运行。"""
+    broker = SerialBroker()
+    # 收到 SIGTERM 时正常退出，以便清理 socket 文件
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"串口代理已启动，监听 {socket_path}")
+    unix_ipc.serve(socket_path, broker.handle)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# startup_check.py
+# 快速入口的启动耗时回归检查：对 fake_devices.py 中的 TCP 替身设备运行 python -S fast_send.py tcp，
+# 确认每条命令都送达设备，并且 p50 不超过同一次运行中空解释器（python -S -c pass）p50 的 STARTUP_BUDGET_RATIO 倍。
+# 超出预算或发送失败时以非零码退出，修改 fast_send.py 及其导入的模块（tcp_wire、unix_ipc、framing、
+# transport_metrics 等）后运行。
+#
+# 用法:
+#   python startup_check.py                 使用下面提交的预算
+#   python startup_check.py --count 50
+#
+# 预算是相对空解释器的倍数而不是绝对毫秒数：解释器启动和模块导入都受 CPU 速度影响，较慢的 HA 主机上两者
+# 同比变慢，倍数不变；多导入一个重模块（例如 socket 或 re）则会明显抬高倍数。两者交替运行，机器负载的波动
+# 对两边的影响相同。开发机上的倍数约为 1.8；需要调整时修改 STARTUP_BUDGET_RATIO 并在提交说明中写明原因。
+# 更完整的启动耗时对比见 benchmark.py --scenario startup。
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import FAST_START_PROBE, SCRIPTS_DIR, summarize
+from fake_devices import FakeTcpDevice
+
+STARTUP_BUDGET_RATIO = 2.5   # python -S fast_send.py tcp 发送一条命令的 p50 上限，以空解释器 p50 的倍数表示
+BASELINE_PROBE = 'python -S -c pass'
+DEFAULT_COUNT = 20
+
+
+def _probe_env():
+    env = dict(os.environ)
+    # 连接池守护进程的 socket 指向不存在的路径，测的是直接发送的路径；熔断器状态写到临时文件，不影响本机设备
+    scratch = tempfile.gettempdir()
+    env['HA_TCP_DAEMON_SOCKET'] = os.path.join(scratch, f'startup-check-no-daemon-{os.getpid()}.sock')
+    env['HA_DEVICE_HEALTH'] = os.path.join(scratch, f'startup-check-health-{os.getpid()}.json')
+    # 允许写入字节码缓存：HA 中的脚本目录同样会有 __pycache__，每次都重新编译测到的不是启动耗时
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env.pop('HA_TRANSPORT_TRACE', None)
+    env.pop('HA_TRANSPORT_METRICS', None)
+    return env
+
+
+def _timed(argv, env):
+    started = time.perf_counter()
+    completed = subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started, completed.returncode == 0
+
+
+def check_startup(count=DEFAULT_COUNT, budget_ratio=STARTUP_BUDGET_RATIO):
+    """
+    交替运行 `count` 次空解释器和快速入口，检查快速入口的启动耗时。
+
+    Returns:
+        tuple[bool, str]: 是否通过，以及说明（p50、基线和倍数，或失败原因）。
+    """
+    env = _probe_env()
+    baseline_argv = [sys.executable, '-S', '-c', 'pass']
+    baseline, probe, errors = [], [], 0
+    with FakeTcpDevice() as device:
+        argv = [sys.executable, '-S', os.path.join(SCRIPTS_DIR, 'fast_send.py'), 'tcp',
+                device.host, str(device.port), 'ping', 'true', 'false']
+        # 第一次运行写入字节码缓存，不计入统计
+        _timed(argv, env)
+        for _ in range(count):
+            baseline.append(_timed(baseline_argv, env)[0])
+            latency, ok = _timed(argv, env)
+            probe.append(latency)
+            errors += 0 if ok else 1
+        delivered = len(device.received) - 1
+    try:
+        os.unlink(env['HA_DEVICE_HEALTH'])
+    except FileNotFoundError:
+        pass
+
+    if errors or delivered != count:
+        return False, f"{FAST_START_PROBE}: {count} 次中 {errors} 次失败，设备收到 {delivered} 条命令"
+    base = summarize(baseline, sum(baseline), 0)['p50_ms']
+    stats = summarize(probe, sum(probe), 0)
+    p50 = stats['p50_ms']
+    ratio = p50 / base
+    detail = (f"{FAST_START_PROBE} p50 {p50} ms (p95 {stats['p95_ms']} ms)，"
+              f"{BASELINE_PROBE} p50 {base} ms，倍数 {ratio:.2f}")
+    if ratio > budget_ratio:
+        return False, f"启动耗时超出预算: {detail} > {budget_ratio:g}"
+    return True, f"启动耗时在预算内: {detail} <= {budget_ratio:g}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"检查 '{FAST_START_PROBE}' 的启动耗时是否在预算内（相对 '{BASELINE_PROBE}' 的倍数）。")
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT, help=f"运行次数 (默认: {DEFAULT_COUNT})")
+    args = parser.parse_args()
+    if args.count < 1:
+        parser.error("--count 必须大于 0")
+    ok, message = check_startup(args.count)
+    print(message, file=sys.stdout if ok else sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
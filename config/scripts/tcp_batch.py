@@ -0,0 +1,210 @@
+# tcp_batch.py
+# 批量并发发送 TCP 命令：不同设备并发，同一设备 (ip, port) 上的命令按列表顺序依次发送。
+# 整个房间的设备在“最慢的那台设备”的时间内完成，而不是所有设备耗时之和。
+import json
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from send_tcp_command import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_FRAMING,
+    DEFAULT_READ_TIMEOUT,
+    build_tcp_payload,
+    send_via_daemon,
+    tcp_exchange,
+    udp_exchange,
+)
+from response_decoders import DecodeError, compile_decoder
+from transport_metrics import CallMetrics
+
+MAX_WORKERS = 16    # 最多同时处理的设备数
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() == 'true'
+
+
+def load_batch(source):
+    """
+    读取批量命令列表。`source` 可以是 JSON / YAML 文件路径，'-' 表示从标准输入读取。
+
+    每一项的格式::
+
+        {"ip": "192.168.3.116", "port": 4001, "command": "kaixin001",
+         "append_cr": false, "send_hex": false, "encoding": "utf-8",
+         "framing": "once", "read_timeout": 5, "read_response": true,
+         "decode": "regex:VOL=(?P<volume>\\d+)"}
+
+    decode 为可选的响应解码器（见 response_decoders.py），解析结果放在结果的 fields 中。
+    "transport": "udp" 的命令通过 UDP 发送（见 udp_transport.py），可选 reply_window（秒）；
+    目标为组播 / 广播地址时一个数据报发往整组设备，子网定向广播地址需要 "broadcast": true。
+    """
+    text = sys.stdin.read() if source == '-' else open(source, encoding='utf-8').read()
+    return parse_batch(text)
+
+
+def parse_batch(text):
+    """解析 JSON（或 YAML）格式的批量命令列表。"""
+    try:
+        entries = json.loads(text)
+    except ValueError:
+        import yaml
+        entries = yaml.safe_load(text)
+    if isinstance(entries, dict):
+        entries = entries.get('commands', [])
+    if not isinstance(entries, list):
+        raise ValueError("批量命令必须是列表。")
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"第 {index + 1} 条命令必须是字典。")
+        missing = [key for key in ('ip', 'port', 'command') if key not in entry]
+        if missing:
+            raise ValueError(f"第 {index + 1} 条命令缺少字段: {', '.join(missing)}")
+        try:
+            port = int(entry['port'])
+        except (TypeError, ValueError):
+            raise ValueError(f"第 {index + 1} 条命令的端口无效: {entry['port']!r}") from None
+        if not 0 < port < 65536:
+            raise ValueError(f"第 {index + 1} 条命令的端口超出范围: {port}")
+    return entries
+
+
+def _run_one(entry):
+    result = {
+        'ip': entry['ip'],
+        'port': int(entry['port']),
+        'command': entry['command'],
+        'ok': False,
+        'response': None,
+        'error': None,
+        'elapsed_ms': 0.0,
+    }
+    if entry.get('decode'):
+        result['fields'] = None
+    started = time.perf_counter()
+    transport = entry.get('transport', 'tcp')
+    metrics = CallMetrics(transport, f"{entry['ip']}:{entry['port']}")
+    error = None
+    try:
+        data_to_send = build_tcp_payload(
+            str(entry['command']),
+            _as_bool(entry.get('append_cr', False)),
+            _as_bool(entry.get('send_hex', False)),
+            entry.get('encoding') or 'utf-8',
+            verbose=False,
+        )
+        metrics.mark('encode')
+        read_response = _as_bool(entry.get('read_response', True))
+        if transport == 'udp':
+            options = {'transport': 'udp'}
+            if entry.get('reply_window') is not None:
+                options['reply_window'] = float(entry['reply_window'])
+            if _as_bool(entry.get('broadcast', False)):
+                options['broadcast'] = True
+        else:
+            options = {
+                'connect_timeout': float(entry.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+                'read_timeout': float(entry.get('read_timeout', DEFAULT_READ_TIMEOUT)),
+                'framing': entry.get('framing', DEFAULT_FRAMING),
+            }
+        reply = send_via_daemon(entry['ip'], entry['port'], data_to_send, read_response, **options)
+        if reply is None and transport == 'udp':
+            replies = udp_exchange(entry['ip'], entry['port'], data_to_send, read_response,
+                                   options.get('reply_window'), metrics=metrics,
+                                   broadcast=options.get('broadcast', False))
+            response = replies[0][1] if replies else None
+            result['ok'] = True
+        elif reply is None:
+            response = tcp_exchange(entry['ip'], entry['port'], data_to_send, read_response, metrics=metrics,
+                                    **options)
+            result['ok'] = True
+        elif reply.get('ok'):
+            metrics.mark('response')
+            metrics.bytes_sent = len(data_to_send)
+            response = bytes.fromhex(reply['response']) if reply.get('response') else None
+            metrics.bytes_received = len(response or b'')
+            result['ok'] = True
+        else:
+            metrics.mark('response')
+            response = None
+            result['error'] = reply.get('error')
+            error = str(reply.get('error', 'Error')).split(':', 1)[0]
+        result['response'] = response
+        if entry.get('decode') and response:
+            result['fields'] = compile_decoder(entry['decode']).decode(response)
+    except DecodeError as e:
+        result['ok'] = False
+        result['error'] = f"无法解析响应: {e}"
+    except socket.timeout as e:
+        error = e
+        result['error'] = "Socket 操作超时（连接或发送）"
+    except ConnectionRefusedError as e:
+        error = e
+        result['error'] = "连接被拒绝"
+    except (OSError, ValueError, LookupError) as e:
+        error = e
+        result['error'] = f"{type(e).__name__}: {e}"
+    metrics.finish(error)
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def _run_device(entries):
+    # 同一设备上的命令依次发送，保持顺序
+    return [_run_one(entry) for entry in entries]
+
+
+def run_batch(entries, max_workers=MAX_WORKERS):
+    """
+    并发执行批量命令。
+
+    Returns:
+        list[dict]: 与 `entries` 一一对应的结果（顺序相同），每项包含
+        ip, port, command, ok, response (bytes | None), error, elapsed_ms，
+        指定了 decode 的命令还包含 fields。
+    """
+    groups = {}
+    for index, entry in enumerate(entries):
+        key = (entry['ip'], int(entry['port']))
+        groups.setdefault(key, []).append((index, entry))
+
+    results = [None] * len(entries)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups)))) as executor:
+        futures = {
+            executor.submit(_run_device, [entry for _, entry in members]): members
+            for members in groups.values()
+        }
+        for future, members in futures.items():
+            for (index, _), result in zip(members, future.result()):
+                results[index] = result
+    return results
+
+
+def _format_response(response):
+    if response is None:
+        return ''
+    try:
+        return response.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return response.hex().upper()
+
+
+def print_results(results, as_json=False):
+    """打印每个目标的结果表（或 JSON）。"""
+    if as_json:
+        rows = [dict(result, response=result['response'].hex().upper() if result['response'] else None)
+                for result in results]
+        print(json.dumps(rows, ensure_ascii=False))
+        return
+    print(f"{'目标':<22} {'命令':<20} {'结果':<4} {'耗时(ms)':>9}  响应/错误")
+    for result in results:
+        target = f"{result['ip']}:{result['port']}"
+        status = '成功' if result['ok'] else '失败'
+        detail = _format_response(result['response']) if result['ok'] else result['error']
+        if result.get('fields'):
+            detail += f"  {json.dumps(result['fields'], ensure_ascii=False)}"
+        print(f"{target:<22} {str(result['command'])[:20]:<20} {status:<4} {result['elapsed_ms']:>9}  {detail}")
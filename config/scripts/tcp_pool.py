@@ -0,0 +1,287 @@
+# tcp_pool.py
+# 按 (ip, port) 维护长连接的 TCP 连接池，以及基于它的常驻守护进程。
+# 守护进程通过本地 Unix socket 接收命令（见 unix_ipc.py），
+# 这样每次按键不再需要重新握手，矩阵也不会因为连接建立过于频繁而断开。
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+import device_health
+import trace_ring
+import udp_transport
+import unix_ipc
+from command_coalescer import CommandCoalescer
+from framing import parse_framing, read_frame
+
+DEFAULT_CONNECT_TIMEOUT = 5     # 建立连接的超时时间（秒）
+DEFAULT_READ_TIMEOUT = 5        # 等待响应的超时时间（秒）
+DEFAULT_IDLE_TIMEOUT = 300      # 空闲连接保留时间（秒），超过后由后台线程关闭
+RECV_BUFFER_SIZE = 1024
+
+
+class _PooledConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class TcpConnectionPool:
+    """
+    每个 (ip, port) 保持一个长连接。同一设备上的命令按到达顺序串行发送，
+    不同设备之间互不阻塞。复用的连接在写出任何字节之前就已失效时自动重连并发送一次；
+    已经写出部分数据时不再重发，避免设备收到重复的一帧（音量步进、开关切换等命令不是幂等的）。
+    """
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self._connections = {}      # (ip, port) -> _PooledConnection
+        self._locks = {}            # (ip, port) -> threading.Lock，保证同一设备串行
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _open(self, key, connect_timeout=None):
+        sock = socket.create_connection(key, timeout=connect_timeout or self.connect_timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Linux 上缩短 keep-alive 探测间隔，尽早发现被设备断开的连接
+        for option, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        return _PooledConnection(sock)
+
+    @staticmethod
+    def _is_alive(conn):
+        """检查连接是否仍然可用，并丢弃上一条命令残留的未读数据。"""
+        sock = conn.sock
+        while True:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return True
+            try:
+                leftover = sock.recv(RECV_BUFFER_SIZE, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            if not leftover:
+                # 对端已关闭连接
+                return False
+
+    def _checkout(self, key, connect_timeout=None):
+        """取出 key 的连接，返回 (连接, 是否为池中复用的连接)。"""
+        conn = self._connections.pop(key, None)
+        if conn is not None and not self._is_alive(conn):
+            conn.close()
+            conn = None
+        if conn is None:
+            return self._open(key, connect_timeout), False
+        return conn, True
+
+    def exchange(self, ip, port, data, read_response=True, read_timeout=DEFAULT_READ_TIMEOUT,
+                 framing=None, connect_timeout=None):
+        """
+        在池化连接上发送 `data`，并可选地按 `framing` 读取一帧响应。
+        熔断器打开的设备立即抛出 DeviceUnavailableError；连接 / 发送的结果计入熔断状态。
+        设置了 HA_TRANSPORT_TRACE 时，收发的原始字节写入追踪文件（见 trace_ring.py）。
+
+        Returns:
+            bytes | None: 收到的响应；不读取响应或等待超时时为 None。
+        """
+        key = (ip, int(port))
+        framing = parse_framing(framing)
+        device_health.before_connect(ip, port)
+        with self._lock_for(key):
+            try:
+                conn, reused = self._checkout(key, connect_timeout)
+                written = 0
+                try:
+                    conn.sock.settimeout(connect_timeout or self.connect_timeout)
+                    view = memoryview(data)
+                    while written < len(data):
+                        written += conn.sock.send(view[written:])
+                except OSError:
+                    conn.close()
+                    if not reused or written:
+                        raise
+                    # 复用的连接在检查之后才被对端关闭，且还没有写出任何字节：重连后发送一次
+                    conn = self._open(key, connect_timeout)
+                    try:
+                        conn.sock.settimeout(connect_timeout or self.connect_timeout)
+                        conn.sock.sendall(data)
+                    except OSError:
+                        conn.close()
+                        raise
+            except OSError as e:
+                device_health.record_failure(ip, port, e)
+                trace_ring.record('tcp', f"{ip}:{port}", trace_ring.ERROR, e)
+                raise
+            sent_at = time.perf_counter()
+            trace_ring.record('tcp', f"{ip}:{port}", trace_ring.TX, data)
+            device_health.record_success(ip, port)
+
+            response = None
+            try:
+                if read_response:
+                    response, closed = read_frame(conn.sock, framing, read_timeout)
+                    trace_ring.record('tcp', f"{ip}:{port}", trace_ring.RX, response,
+                                      time.perf_counter() - sent_at)
+                    if closed:
+                        # 设备在应答后关闭了连接，不再放回池中
+                        conn.close()
+                        return response
+            except OSError:
+                conn.close()
+                raise
+            conn.last_used = time.monotonic()
+            self._connections[key] = conn
+            return response
+
+    def reap_idle(self):
+        """关闭空闲时间超过 idle_timeout 的连接。"""
+        now = time.monotonic()
+        for key, conn in list(self._connections.items()):
+            lock = self._lock_for(key)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                if self._connections.get(key) is conn and now - conn.last_used > self.idle_timeout:
+                    del self._connections[key]
+                    conn.close()
+            finally:
+                lock.release()
+
+    def close_all(self):
+        for key in list(self._connections):
+            conn = self._connections.pop(key, None)
+            if conn is not None:
+                conn.close()
+
+
+def run_daemon(socket_path, pool=None, poller=None):
+    """
+    启动 TCP 连接池守护进程，在 `socket_path` 上接收请求。
+    如果存在 pollers.yaml，同时在共享的连接池上运行后台状态轮询（见 device_poller.py），
+    每转发一条发往某设备的命令，该设备的轮询就会临时加快。
+    带 coalesce_key 的命令先经过合并（见 command_coalescer.py），同一合并键上被取代的命令和幂等重复不会发往设备。
+    带 "transport": "udp" 的命令通过守护进程内复用的 UDP socket 发送（见 udp_transport.py），
+    在 reply_window 秒内收集应答；replies 为全部应答（组播 / 广播目标可能有多个），response 为第一个应答。
+    子网定向广播地址需要带 "broadcast": true（见 udp_transport.is_group_address）。
+
+    请求格式（JSON 行）::
+
+        {"ip": "192.168.3.116", "port": 4001, "data": "<HEX>", "read_response": true,
+         "connect_timeout": 5, "read_timeout": 5, "framing": "terminator:\\r",
+         "coalesce_key": "matrix:video:TV", "coalesce_window": 0.15}
+        {"transport": "udp", "ip": "239.1.1.10", "port": 9000, "data": "<HEX>", "read_response": true,
+         "reply_window": 0.2, "broadcast": false}
+
+    响应格式::
+
+        {"ok": true, "response": "<HEX>" | null}
+        {"ok": true, "response": "<HEX>" | null, "replies": [{"from": "ip:port", "data": "<HEX>"}, ...]}  (UDP)
+        {"ok": true, "response": null, "superseded": true}       (被同一合并键上更新的命令取代，未发送)
+        {"ok": true, "response": "<HEX>" | null, "suppressed": true}  (与上一次发送的内容相同，未发送)
+        {"ok": false, "error": "<错误类型>: <说明>"}
+
+    轮询相关的请求::
+
+        {"op": "poll_status"}                   -> {"ok": true, "values": {"<设备>.<查询>": {...}}}
+        {"op": "poll_boost", "device": "<设备>"}  -> {"ok": true, "queries": <受影响的查询数>}
+        {"op": "coalesce_status"}               -> {"ok": true, "sent": n, "superseded": n, "suppressed": n}
+    """
+    pool = pool or TcpConnectionPool()
+    if poller is None:
+        import device_poller
+        try:
+            poller = device_poller.load_poller(pool)
+        except Exception as e:
+            # 轮询配置错误不影响命令转发
+            print(f"警告: 无法启动状态轮询: {type(e).__name__}: {e}")
+    if poller is not None:
+        poller.start()
+        print(f"状态轮询已启动: {len(poller.queries)} 条查询")
+
+    udp = udp_transport.shared_sender()
+
+    def forward_udp(request):
+        replies = udp.exchange(
+            request["ip"],
+            request["port"],
+            bytes.fromhex(request["data"]),
+            read_response=request.get("read_response", True),
+            reply_window=float(request.get("reply_window", udp_transport.DEFAULT_REPLY_WINDOW)),
+            broadcast=bool(request.get("broadcast")),
+        )
+        if poller is not None:
+            poller.boost(request["ip"], request["port"])
+        return {
+            "ok": True,
+            "response": replies[0][1].hex().upper() if replies else None,
+            "replies": [{"from": source, "data": reply.hex().upper()} for source, reply in replies],
+        }
+
+    def forward(request):
+        if request.get("transport") == "udp":
+            return forward_udp(request)
+        response = pool.exchange(
+            request["ip"],
+            request["port"],
+            bytes.fromhex(request["data"]),
+            read_response=request.get("read_response", True),
+            read_timeout=request.get("read_timeout", DEFAULT_READ_TIMEOUT),
+            framing=request.get("framing"),
+            connect_timeout=request.get("connect_timeout"),
+        )
+        if poller is not None:
+            poller.boost(request["ip"], request["port"])
+        return {"ok": True, "response": response.hex().upper() if response is not None else None}
+
+    coalescer = CommandCoalescer(forward)
+
+    def handle(request):
+        op = request.get("op")
+        if op == "poll_status":
+            return {"ok": True, "values": poller.status() if poller else {}}
+        if op == "poll_boost":
+            return {"ok": True, "queries": poller.boost(device=request.get("device")) if poller else 0}
+        if op == "coalesce_status":
+            return {"ok": True, **coalescer.stats}
+        if request.get("coalesce_key"):
+            fingerprint = (request.get("transport", "tcp"), request["ip"], int(request["port"]),
+                           request["data"].upper())
+            return coalescer.submit(request["coalesce_key"], request, fingerprint)
+        return forward(request)
+
+    def reaper():
+        while True:
+            time.sleep(max(1, pool.idle_timeout / 4))
+            pool.reap_idle()
+
+    threading.Thread(target=reaper, name="tcp-pool-reaper", daemon=True).start()
+    threading.Thread(target=device_health.probe_loop, name="device-probe", daemon=True).start()
+    # 收到 SIGTERM 时正常退出，以便清理 socket 文件并关闭所有长连接
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"TCP 连接池守护进程已启动，监听 {socket_path}")
+    try:
+        unix_ipc.serve(socket_path, handle)
+    finally:
+        if poller is not None:
+            poller.stop()
+        pool.close_all()
+        udp.close_all()
@@ -0,0 +1,127 @@
+# tcp_wire.py
+# TCP 命令的 HEX / 文本编码规则和一次性连接的收发，由 send_tcp_command.py 和快速入口 fast_send.py 共用。
+# 模块本身只导入 time：连接直接使用 _socket（socket 模块导入时要构造一批 IntEnum，比解释器启动本身还慢），
+# 熔断器、流量追踪、分帧和传输指标在第一次收发时才导入，fast_send.py 经守护进程发送时不需要它们。
+import time
+
+DEFAULT_CONNECT_TIMEOUT = 5  # 建立连接的超时时间（秒）
+DEFAULT_READ_TIMEOUT = 5     # 等待一帧完整响应的超时时间（秒）
+DEFAULT_FRAMING = 'once'     # 默认分帧方式: 只 recv 一次（与旧版本行为一致），详见 framing.py
+
+
+def hex_string_to_bytes(hex_str):
+    """
+    将一个空格分隔的十六进制字符串（例如：'01 0A FF'）转换为字节对象。
+    """
+    hex_str = hex_str.replace(" ", "").replace("0x", "").replace("x", "") # 移除空格和0x前缀
+    if not hex_str:
+        return b''
+
+    # 检查是否为偶数长度，因为每个字节需要两个十六进制字符
+    if len(hex_str) % 2 != 0:
+        raise ValueError(f"无效的十六进制字符串长度 '{hex_str}'。十六进制字符数必须是偶数。")
+
+    try:
+        return bytes.fromhex(hex_str)
+    except ValueError:
+        raise ValueError(f"无效的十六进制字符 '{hex_str}'。请确保只包含有效的十六进制字符 (0-9, A-F)。") from None
+
+
+def encode_tcp_payload(command_input, append_cr, send_hex, encoding='utf-8'):
+    """
+    按照 HEX / 文本规则把命令字符串转换为要发送的字节。
+    HEX 命令需要回车时追加 0D 字节；文本命令追加 '\\r' 后按 `encoding` 编码。
+
+    Raises:
+        ValueError: HEX 字符串无效。
+        LookupError: 未知的编码。
+    """
+    if send_hex:
+        data = hex_string_to_bytes(command_input)
+        return data + b'\x0D' if append_cr else data
+    return (command_input + '\r' if append_cr else command_input).encode(encoding)
+
+
+def connect(ip, port, timeout):
+    """
+    与 socket.create_connection 相同：依次尝试解析出的每个地址，返回第一个连接成功的 _socket.socket。
+
+    Raises:
+        OSError: 无法解析或所有地址都连接失败（抛出最后一个错误）。
+    """
+    import _socket
+    # str 形式的主机名会先经过 idna 编码（导入 encodings.idna 和 re）；ASCII 地址直接以 bytes 传入
+    host = ip.encode('ascii') if ip.isascii() else ip
+    error = None
+    for family, kind, proto, _, address in _socket.getaddrinfo(host, int(port), 0, _socket.SOCK_STREAM):
+        sock = _socket.socket(family, kind, proto)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error
+
+
+def tcp_exchange(ip, port, data_to_send, read_response=True, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, framing=DEFAULT_FRAMING, metrics=None, decode_stream=None):
+    """
+    建立一次 TCP 连接，发送数据并按分帧规则读取响应，然后关闭连接。
+
+    连接和读取分别使用各自的超时；收到完整的一帧后立即返回。
+    已知离线（熔断器打开）的设备不会尝试连接，立即抛出 DeviceUnavailableError（见 device_health.py）。
+    传入 CallMetrics 时记录 connect / send / first_byte / response / close 各阶段的耗时和收发字节数，
+    第一次调用时延迟导入的耗时计入 parse 阶段。
+    传入 DecodeStream（见 response_decoders.py）时，响应在分段到达的同时增量解码。
+    设置了 HA_TRANSPORT_TRACE 时，收发的原始字节写入追踪文件（见 trace_ring.py）。
+
+    Returns:
+        bytes | None: 收到的响应；没有响应或读取超时时为 None。
+
+    Raises:
+        OSError: 连接或发送失败（包括 TimeoutError / ConnectionRefusedError / DeviceUnavailableError）。
+    """
+    import device_health
+    import trace_ring
+    from framing import parse_framing, read_frame
+    framing = parse_framing(framing)
+    if metrics is None:
+        from transport_metrics import CallMetrics
+        metrics = CallMetrics('tcp', f"{ip}:{port}", enabled=False)
+    metrics.mark('parse')
+    target = f"{ip}:{port}"
+    device_health.before_connect(ip, port)
+    try:
+        s = connect(ip, port, connect_timeout)
+    except OSError as e:
+        device_health.record_failure(ip, port, e)
+        trace_ring.record('tcp', target, trace_ring.ERROR, e)
+        raise
+    finally:
+        # 连接失败时同样记录耗时（例如连接超时）
+        metrics.mark('connect')
+    try:
+        try:
+            s.sendall(data_to_send)
+        except OSError as e:
+            device_health.record_failure(ip, port, e)
+            trace_ring.record('tcp', target, trace_ring.ERROR, e)
+            raise
+        sent_at = time.perf_counter()
+        trace_ring.record('tcp', target, trace_ring.TX, data_to_send)
+        device_health.record_success(ip, port)
+        metrics.bytes_sent += len(data_to_send)
+        metrics.mark('send')
+        if not read_response:
+            return None
+        response, _ = read_frame(s, framing, read_timeout, on_first_byte=lambda: metrics.mark('first_byte'),
+                                 on_chunk=decode_stream.feed if decode_stream is not None else None)
+        trace_ring.record('tcp', target, trace_ring.RX, response, time.perf_counter() - sent_at)
+        metrics.bytes_received += len(response or b'')
+        metrics.mark('response')
+        return response
+    finally:
+        s.close()
+        metrics.mark('close')
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# trace_ring.py
+# 传输流量追踪：把每次收发的原始字节以紧凑的二进制记录写入固定大小的 mmap 环形文件，
+# 写满后覆盖最旧的记录。记录时只做一次 struct 打包和内存拷贝，不做任何格式化，
+# 排查问题时不必再把 HA_TRANSPORT_VERBOSE 调到 2，让 HEX 打印拖慢每次调用并淹没 HA 日志。
+#
+# 设置 HA_TRANSPORT_TRACE=/tmp/ha_transport.trace 启用（HA 进程、守护进程和串口代理都生效），
+# HA_TRANSPORT_TRACE_SIZE 为环形区大小（字节，默认 4 MiB，只在创建文件时生效）。未设置时没有任何开销。
+#
+# 文件格式（小端）:
+#   文件头  HEADER_SIZE 字节: magic、版本、环形区容量、head / tail（逻辑写入位置，单调递增）、记录序号
+#   记录    RECORD 头 + 设备名 + 数据；记录不跨越环形区末尾，放不下时以填充记录（或不足一个记录头的空隙）补齐
+# 多个进程通过 flock 串行写入。
+#
+# 用法:
+#   python trace_ring.py dump [--device 子串] [--direction tx|rx|error] [--since 秒] [--last N] [--json]
+#   python trace_ring.py stats
+#   python trace_ring.py clear
+#   python trace_ring.py replay [--device 子串] [--since 秒] [--speed 倍数]
+#       把记录的会话对本地替身设备（fake_devices.py）重放：替身设备按记录的延迟返回记录的响应，
+#       通过真实的传输代码发送记录的请求，比较实际收到的响应与记录是否一致。
+import _thread
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import time
+
+TRACE_PATH = os.environ.get('HA_TRANSPORT_TRACE', '')
+try:
+    TRACE_SIZE = int(os.environ.get('HA_TRANSPORT_TRACE_SIZE', 4 * 1024 * 1024))
+except ValueError:
+    TRACE_SIZE = 4 * 1024 * 1024
+
+MAGIC = b'HATRACE\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQ')        # magic, version, capacity, head, tail, seq
+HEADER_SIZE = 64                          # 数据区从这里开始
+# length, seq, timestamp, latency_us, transport, direction, device_len, original_len
+RECORD = struct.Struct('<IIdIBBHI')
+MIN_CAPACITY = 64 * 1024
+MAX_DATA = 4096                           # 单条记录最多保存的数据字节数，超出部分截断（original_len 保留原始长度）
+NO_LATENCY = 0xFFFFFFFF
+
+TRANSPORTS = ('tcp', 'serial', 'udp')     # 新的传输方式只能追加在末尾，已有追踪文件中的编号保持不变
+TX, RX, ERROR = 0, 1, 2
+DIRECTIONS = ('tx', 'rx', 'error')
+PAD = 0xFF
+
+
+class TraceRing:
+    """一个 mmap 环形追踪文件。同一进程内的线程共用一个实例。"""
+
+    def __init__(self, path, size=TRACE_SIZE):
+        self.path = path
+        self._lock = _thread.allocate_lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o660)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+            valid = False
+            if len(header) == HEADER.size:
+                magic, version, capacity, _, _, _ = HEADER.unpack(header)
+                valid = (magic == MAGIC and version == VERSION
+                         and os.fstat(self._fd).st_size == HEADER_SIZE + capacity)
+            if not valid:
+                capacity = max(MIN_CAPACITY, size)
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, HEADER_SIZE + capacity)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, VERSION, capacity, 0, 0, 0), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.capacity = capacity
+        self._map = mmap.mmap(self._fd, HEADER_SIZE + capacity)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def _skip(self, tail):
+        """返回 tail 处记录之后的逻辑位置。"""
+        position = tail % self.capacity
+        if self.capacity - position < RECORD.size:
+            return tail + self.capacity - position
+        length = struct.unpack_from('<I', self._map, HEADER_SIZE + position)[0]
+        if length < RECORD.size or length > self.capacity - position:
+            raise ValueError(f"追踪文件在位置 {tail} 处损坏")
+        return tail + length
+
+    def append(self, transport, device, direction, data, latency=None, timestamp=None):
+        """追加一条记录。`latency` 为秒（例如从发送到收到响应的时间）。"""
+        device = device.encode('utf-8', 'replace')[:255]
+        original_len = len(data)
+        data = data[:MAX_DATA]
+        size = RECORD.size + len(device) + len(data)
+        latency_us = NO_LATENCY if latency is None else min(int(latency * 1e6), NO_LATENCY - 1)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                _, _, capacity, head, tail, seq = HEADER.unpack_from(self._map, 0)
+                position = head % capacity
+                pad = capacity - position if capacity - position < size else 0
+                try:
+                    while head + pad + size - tail > capacity:
+                        tail = self._skip(tail)
+                except ValueError:
+                    # 文件损坏（例如写入时进程被杀）：丢弃全部旧记录
+                    tail = head + pad
+                if pad >= RECORD.size:
+                    RECORD.pack_into(self._map, HEADER_SIZE + position, pad, 0, 0.0, NO_LATENCY, 0, PAD, 0, 0)
+                head += pad
+                position = head % capacity
+                start = HEADER_SIZE + position
+                RECORD.pack_into(self._map, start, size, seq & 0xFFFFFFFF, timestamp or time.time(), latency_us,
+                                 TRANSPORTS.index(transport), direction, len(device), original_len)
+                start += RECORD.size
+                self._map[start:start + len(device)] = device
+                start += len(device)
+                self._map[start:start + len(data)] = data
+                HEADER.pack_into(self._map, 0, MAGIC, VERSION, capacity, head + size, tail, seq + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def records(self):
+        """按写入顺序返回环形区中的全部记录（字典列表）。"""
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            _, _, capacity, head, tail, _ = HEADER.unpack_from(self._map, 0)
+            ring = self._map[HEADER_SIZE:HEADER_SIZE + capacity]
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        records = []
+        while tail < head:
+            position = tail % capacity
+            if capacity - position < RECORD.size:
+                tail += capacity - position
+                continue
+            length, seq, timestamp, latency_us, transport, direction, device_len, original_len = \
+                RECORD.unpack_from(ring, position)
+            if length < RECORD.size or length > capacity - position:
+                break
+            tail += length
+            if direction == PAD:
+                continue
+            start = position + RECORD.size
+            records.append({
+                'seq': seq,
+                'ts': timestamp,
+                'transport': TRANSPORTS[transport] if transport < len(TRANSPORTS) else str(transport),
+                'direction': DIRECTIONS[direction] if direction < len(DIRECTIONS) else str(direction),
+                'device': ring[start:start + device_len].decode('utf-8', 'replace'),
+                'data': ring[start + device_len:position + length],
+                'original_len': original_len,
+                'latency': None if latency_us == NO_LATENCY else latency_us / 1e6,
+            })
+        return records
+
+    def clear(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                _, _, capacity, head, _, seq = HEADER.unpack_from(self._map, 0)
+                HEADER.pack_into(self._map, 0, MAGIC, VERSION, capacity, head, head, seq)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+_ring = None
+# 每次发送都会导入本模块：只需要一把锁，不导入 threading（连带 collections 等，命令行启动多几毫秒）
+_ring_guard = _thread.allocate_lock()
+
+
+def _shared_ring():
+    global _ring, TRACE_PATH
+    with _ring_guard:
+        if _ring is None and TRACE_PATH:
+            try:
+                _ring = TraceRing(TRACE_PATH)
+            except OSError as e:
+                print(f"警告: 无法打开追踪文件 {TRACE_PATH}，已停用追踪: {e}", file=sys.stderr)
+                TRACE_PATH = ''
+        return _ring
+
+
+def record(transport, device, direction, data, latency=None, timestamp=None):
+    """
+    记录一次收发（TX / RX / ERROR）。未设置 HA_TRANSPORT_TRACE 时立即返回。
+    ERROR 记录的 `data` 可以是异常对象，保存其类型和说明。
+    `timestamp`（time.time()）默认为写入时刻；交给后台线程写入时传入实际收发的时刻。
+    """
+    if not TRACE_PATH:
+        return
+    ring = _ring or _shared_ring()
+    if ring is None:
+        return
+    if isinstance(data, BaseException):
+        data = f"{type(data).__name__}: {data}".encode('utf-8', 'replace')
+    try:
+        ring.append(transport, device, direction, data or b'', latency, timestamp)
+    except (OSError, ValueError) as e:
+        print(f"警告: 写入追踪记录失败: {e}", file=sys.stderr)
+
+
+# ======== 命令行 ========
+
+def select_records(records, device=None, direction=None, since=None, last=None):
+    if device:
+        records = [r for r in records if device in r['device']]
+    if direction:
+        records = [r for r in records if r['direction'] == direction]
+    if since:
+        cutoff = time.time() - since
+        records = [r for r in records if r['ts'] >= cutoff]
+    if last:
+        records = records[-last:]
+    return records
+
+
+def _clock(ts):
+    return time.strftime('%H:%M:%S', time.localtime(ts)) + f".{int(ts * 1000) % 1000:03d}"
+
+
+def format_record(r):
+    clock = _clock(r['ts'])
+    latency = f"{r['latency'] * 1000:8.1f}ms" if r['latency'] is not None else ' ' * 10
+    if r['direction'] == 'error':
+        payload = r['data'].decode('utf-8', 'replace')
+    else:
+        payload = r['data'].hex(' ').upper()
+        if r['original_len'] > len(r['data']):
+            payload += f" ...（共 {r['original_len']} 字节）"
+    return f"{clock} #{r['seq']:<6} {r['transport']:<6} {r['device']:<22} {r['direction']:<5} {latency}  {payload}"
+
+
+def pair_exchanges(records):
+    """把每条 TX 与同一设备上随后的 RX / ERROR 配对（下一条 TX 之前）。返回 (tx, reply | None) 列表。"""
+    exchanges = []
+    open_tx = {}
+    for r in records:
+        key = (r['transport'], r['device'])
+        if r['direction'] == 'tx':
+            open_tx[key] = len(exchanges)
+            exchanges.append([r, None])
+        elif key in open_tx:
+            exchanges[open_tx.pop(key)][1] = r
+    return [tuple(exchange) for exchange in exchanges]
+
+
+class _Script:
+    """替身设备的应答脚本：按顺序返回记录的响应，并按记录的延迟应答。"""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.expected = []
+        self.mismatched = []
+
+    def __call__(self, request):
+        if not self.expected:
+            self.mismatched.append(request)
+            return None
+        tx, reply = self.expected.pop(0)
+        if request != bytes(tx['data']):
+            self.mismatched.append(request)
+        if reply is None or reply['direction'] != 'rx' or not reply['data']:
+            return None
+        if reply['latency'] and self.speed:
+            time.sleep(reply['latency'] / self.speed)
+        return bytes(reply['data'])
+
+
+def replay(exchanges, speed=1.0):
+    """
+    对本地替身设备重放配对好的收发记录。每台记录中的设备对应一个替身设备
+    （TCP 设备用 FakeTcpDevice，UDP 设备用 FakeUdpDevice，串口设备用 FakePtyDevice），
+    请求通过 tcp_exchange / udp_exchange / transact 发送。
+
+    Returns:
+        list[dict]: 每次收发的重放结果。
+    """
+    import trace_ring
+    from fake_devices import FakePtyDevice, FakeTcpDevice, FakeUdpDevice
+    from framing import ResponseFraming
+
+    # 重放产生的流量不写回追踪文件（作为脚本运行时本模块与传输代码导入的 trace_ring 不是同一个模块对象）
+    trace_ring.TRACE_PATH = ''
+
+    scripts, stand_ins, ports = {}, [], {}
+    for tx, reply in exchanges:
+        key = (tx['transport'], tx['device'])
+        if key not in scripts:
+            script = scripts[key] = _Script(speed)
+            if tx['transport'] == 'tcp':
+                device = FakeTcpDevice(reply=script, silent_prefix=None).start()
+                ports[key] = device.port
+            elif tx['transport'] == 'udp':
+                device = FakeUdpDevice(reply=script, silent_prefix=None).start()
+                ports[key] = device.port
+            else:
+                import serial
+                device = FakePtyDevice(reply=script, silent_prefix=None).start()
+                ports[key] = serial.Serial(device.path, timeout=1)
+            stand_ins.append(device)
+        scripts[key].expected.append((tx, reply))
+
+    results = []
+    try:
+        started = time.monotonic()
+        origin = exchanges[0][0]['ts'] if exchanges else 0
+        for tx, reply in exchanges:
+            if speed:
+                delay = (tx['ts'] - origin) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            key = (tx['transport'], tx['device'])
+            # 空的 RX 记录表示等待超时、没有收到响应
+            expected = bytes(reply['data']) or None if reply is not None and reply['direction'] == 'rx' else None
+            sent_at = time.perf_counter()
+            error = None
+            try:
+                if tx['transport'] == 'tcp':
+                    from send_tcp_command import tcp_exchange
+                    framing = ResponseFraming('length', length=len(expected)) if expected else None
+                    response = tcp_exchange('127.0.0.1', ports[key], bytes(tx['data']),
+                                            read_response=expected is not None, framing=framing, read_timeout=2)
+                elif tx['transport'] == 'udp':
+                    from send_tcp_command import udp_exchange
+                    # 不需要应答时也留出一点时间，确认替身设备确实没有应答
+                    replies = udp_exchange('127.0.0.1', ports[key], bytes(tx['data']),
+                                           reply_window=2 if expected is not None else 0.05)
+                    response = replies[0][1] if replies else None
+                else:
+                    from send_serial_data import transact
+                    response = transact(ports[key], bytes(tx['data']), expected is not None,
+                                        response_mode='length', expected_length=len(expected or b''))
+            except OSError as e:
+                response, error = None, f"{type(e).__name__}: {e}"
+            results.append({
+                'device': tx['device'],
+                'transport': tx['transport'],
+                'request': tx['data'].hex().upper(),
+                'recorded_latency': reply['latency'] if reply is not None else None,
+                'replay_latency': round(time.perf_counter() - sent_at, 6),
+                'ok': error is None and response == expected,
+                'error': error,
+            })
+    finally:
+        for key, port in ports.items():
+            if key[0] == 'serial':
+                port.close()
+        for device in stand_ins:
+            device.stop()
+    for (transport, device), script in scripts.items():
+        for request in script.mismatched:
+            results.append({'device': device, 'transport': transport, 'request': request.hex().upper(),
+                            'recorded_latency': None, 'replay_latency': None, 'ok': False,
+                            'error': "替身设备收到的请求与记录不一致"})
+    return results
+
+
+def main():
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="传输流量追踪（mmap 环形文件）：查看、过滤和重放。")
+    parser.add_argument("--file", default=TRACE_PATH or '/tmp/ha_transport.trace',
+                        help="追踪文件 (默认: HA_TRANSPORT_TRACE 或 /tmp/ha_transport.trace)")
+    sub = parser.add_subparsers(dest="action", required=True)
+    for name, help_text in (("dump", "解码并显示记录"), ("replay", "对本地替身设备重放记录的会话")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument("--device", help="只保留设备名包含该子串的记录（ip:port 或串口路径）")
+        command.add_argument("--since", type=float, help="只保留最近若干秒内的记录")
+        command.add_argument("--last", type=int, help="只保留最后 N 条记录")
+        command.add_argument("--json", action="store_true", help="以 JSON 行输出")
+        if name == "dump":
+            command.add_argument("--direction", choices=DIRECTIONS, help="只保留某个方向的记录")
+        else:
+            command.add_argument("--speed", type=float, default=1.0,
+                                 help="重放速度倍数，0 表示不等待原始间隔和延迟 (默认: 1)")
+    sub.add_parser("stats", help="显示追踪文件的使用情况")
+    sub.add_parser("clear", help="清空全部记录")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"错误: 追踪文件 {args.file} 不存在（是否设置了 HA_TRANSPORT_TRACE？）", file=sys.stderr)
+        return 1
+    ring = TraceRing(args.file)
+    if args.action == 'clear':
+        ring.clear()
+        return 0
+    records = ring.records()
+
+    if args.action == 'stats':
+        _, _, capacity, head, tail, seq = HEADER.unpack_from(ring._map, 0)
+        print(f"文件: {args.file}  容量: {capacity} 字节  已用: {head - tail} 字节  "
+              f"记录: {len(records)} 条（累计写入 {seq} 条）")
+        if records:
+            span = records[-1]['ts'] - records[0]['ts']
+            print(f"时间范围: {_clock(records[0]['ts'])} 至 {_clock(records[-1]['ts'])}（{span:.1f} 秒）")
+        counts = {}
+        for r in records:
+            counts.setdefault((r['transport'], r['device']), {}).setdefault(r['direction'], 0)
+            counts[(r['transport'], r['device'])][r['direction']] += 1
+        for (transport, device), directions in sorted(counts.items()):
+            print(f"  {transport:<6} {device:<22} " + '  '.join(f"{d} {n}" for d, n in sorted(directions.items())))
+        return 0
+
+    records = select_records(records, args.device, getattr(args, 'direction', None), args.since, args.last)
+    if args.action == 'dump':
+        for r in records:
+            if args.json:
+                print(json.dumps(dict(r, data=r['data'].hex().upper()), ensure_ascii=False))
+            else:
+                print(format_record(r))
+        return 0
+
+    exchanges = pair_exchanges(records)
+    if not exchanges:
+        print("没有可重放的请求记录。")
+        return 0
+    results = replay(exchanges, args.speed)
+    for result in results:
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False))
+            continue
+        recorded = f"{result['recorded_latency'] * 1000:.1f}ms" if result['recorded_latency'] is not None else '-'
+        replayed = f"{result['replay_latency'] * 1000:.1f}ms" if result['replay_latency'] is not None else '-'
+        status = 'OK' if result['ok'] else f"不一致 {result['error'] or ''}"
+        print(f"{result['transport']:<6} {result['device']:<22} {result['request'][:40]:<40} "
+              f"记录 {recorded:>9}  重放 {replayed:>9}  {status}")
+    failed = sum(not result['ok'] for result in results)
+    print(f"重放 {len(exchanges)} 次收发，{failed} 处不一致。")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
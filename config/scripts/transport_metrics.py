@@ -0,0 +1,182 @@
+# transport_metrics.py
+# 传输调用的分阶段计时和分级日志。
+#
+# 每次 TCP / 串口调用记录各阶段耗时（解释器启动、参数解析、编码、连接/打开、发送、首字节、完整响应、关闭）、
+# 收发字节数和错误类型，写入 HA_TRANSPORT_METRICS 指定的文件：
+#   *.prom   Prometheus textfile 格式（累计 _sum/_count，供 node_exporter 的 textfile collector 读取）
+#   其他     JSON 行格式，每次调用追加一行
+# 未设置 HA_TRANSPORT_METRICS 时不记录，开销只有几次 perf_counter() 调用。
+#
+# HA_TRANSPORT_VERBOSE 控制打印到标准输出（也就是 HA 日志）的详细程度:
+#   0  只打印错误
+#   1  每次调用一行摘要（默认）
+#   2  打印全部调试细节（发送/接收的 HEX 等，旧版本的行为）
+import os
+import sys
+import time
+
+METRICS_PATH = os.environ.get('HA_TRANSPORT_METRICS', '')
+try:
+    VERBOSITY = int(os.environ.get('HA_TRANSPORT_VERBOSE', '1'))
+except ValueError:
+    VERBOSITY = 1
+
+QUIET, SUMMARY, DETAIL = 0, 1, 2
+
+PHASES = ('interpreter_start', 'parse', 'encode', 'connect', 'send', 'first_byte', 'response', 'close')
+
+
+def vprint(level, *args, **kwargs):
+    """按 HA_TRANSPORT_VERBOSE 的级别打印；级别高于当前设置的内容直接丢弃，不做任何格式化之外的工作。"""
+    if VERBOSITY >= level:
+        print(*args, **kwargs)
+
+
+def _interpreter_start_seconds():
+    """
+    从进程创建到现在经过的时间（秒），即解释器启动和导入的开销。
+    读取 /proc（仅 Linux），精度为一个时钟周期（通常 10ms）；无法获取时返回 None。
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # 第 22 个字段是进程启动时间（自系统启动以来的时钟周期数）；comm 字段可能包含空格，从 ')' 之后开始数
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class CallMetrics:
+    """
+    记录一次传输调用的各阶段耗时。
+
+    用法::
+
+        metrics = CallMetrics('tcp', '192.168.3.116:4001')
+        ...编码...
+        metrics.mark('encode')
+        ...连接...
+        metrics.mark('connect')
+        metrics.finish(error=None)
+
+    mark(phase) 记录从上一次 mark（或创建对象）到现在的耗时。
+    """
+
+    def __init__(self, transport, target, enabled=None, process_start=False):
+        self.enabled = bool(METRICS_PATH) if enabled is None else enabled
+        self.transport = transport
+        self.target = target
+        self.phases = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error = None
+        self._started = self._last = time.perf_counter()
+        if self.enabled and process_start:
+            self.phases['interpreter_start'] = _interpreter_start_seconds()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        if self.enabled:
+            self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last)
+        self._last = now
+
+    def skip(self):
+        """丢弃从上一次 mark 到现在的时间（例如等待锁、打印），不计入任何阶段。"""
+        self._last = time.perf_counter()
+
+    def finish(self, error=None):
+        """结束计时并写入指标文件。`error` 为异常对象或错误类型名称。"""
+        if error is not None:
+            self.error = error if isinstance(error, str) else type(error).__name__
+        if not self.enabled:
+            return
+        record = {
+            'ts': round(time.time(), 3),
+            'transport': self.transport,
+            'target': self.target,
+            'total_s': round(time.perf_counter() - self._started, 6),
+            'phases_s': {phase: None if value is None else round(value, 6) for phase, value in self.phases.items()},
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'error': self.error,
+        }
+        import json
+        try:
+            if METRICS_PATH.endswith('.prom'):
+                _write_prometheus(METRICS_PATH, record)
+            else:
+                with open(METRICS_PATH, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"警告: 无法写入传输指标 {METRICS_PATH}: {e}", file=sys.stderr)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _write_prometheus(path, record):
+    """
+    把一次调用累加进 Prometheus textfile。累计值保存在旁边的 .state.json 中，
+    每次在文件锁保护下更新后整体重写 .prom 文件（textfile collector 要求原子替换）。
+    """
+    import fcntl
+    import json
+    with open(path + '.state.json', 'a+', encoding='utf-8') as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        state_file.seek(0)
+        try:
+            state = json.loads(state_file.read() or '{}')
+        except ValueError:
+            state = {}
+
+        key = f"{record['transport']}|{record['target']}"
+        entry = state.setdefault(key, {'calls': 0, 'errors': {}, 'sent': 0, 'received': 0, 'phases': {}})
+        entry['calls'] += 1
+        entry['sent'] += record['bytes_sent']
+        entry['received'] += record['bytes_received']
+        if record['error']:
+            entry['errors'][record['error']] = entry['errors'].get(record['error'], 0) + 1
+        for phase, seconds in list(record['phases_s'].items()) + [('total', record['total_s'])]:
+            if seconds is None:
+                continue
+            totals = entry['phases'].setdefault(phase, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+        state_file.seek(0)
+        state_file.truncate()
+        state_file.write(json.dumps(state))
+        state_file.flush()
+
+        lines = [
+            '# HELP ha_transport_phase_seconds Duration of each phase of a transport call.',
+            '# TYPE ha_transport_phase_seconds summary',
+        ]
+        for key, entry in state.items():
+            transport, target = key.split('|', 1)
+            labels = f'transport="{_label(transport)}",target="{_label(target)}"'
+            for phase, (total, count) in entry['phases'].items():
+                lines.append(f'ha_transport_phase_seconds_sum{{{labels},phase="{phase}"}} {total:.6f}')
+                lines.append(f'ha_transport_phase_seconds_count{{{labels},phase="{phase}"}} {count}')
+        calls = ['# HELP ha_transport_calls_total Transport calls.', '# TYPE ha_transport_calls_total counter']
+        errors = ['# HELP ha_transport_errors_total Failed transport calls by error class.',
+                  '# TYPE ha_transport_errors_total counter']
+        transferred = ['# HELP ha_transport_bytes_total Bytes sent and received.',
+                       '# TYPE ha_transport_bytes_total counter']
+        for key, entry in state.items():
+            transport, target = key.split('|', 1)
+            labels = f'transport="{_label(transport)}",target="{_label(target)}"'
+            calls.append(f'ha_transport_calls_total{{{labels}}} {entry["calls"]}')
+            for error, count in entry['errors'].items():
+                errors.append(f'ha_transport_errors_total{{{labels},error="{_label(error)}"}} {count}')
+            transferred.append(f'ha_transport_bytes_total{{{labels},direction="sent"}} {entry["sent"]}')
+            transferred.append(f'ha_transport_bytes_total{{{labels},direction="received"}} {entry["received"]}')
+        lines += calls + errors + transferred
+
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temporary, path)
@@ -0,0 +1,151 @@
+# udp_transport.py
+# UDP 传输：用于支持 UDP 控制的设备（投影机、显示器、音频处理器等），省去 TCP 的握手、断开和等待 recv。
+#
+#   - 每个目标 (ip, port) 一个已绑定的 UDP socket，进程内复用：重复发送只需一次 sendto 系统调用，
+#     设备的应答也总是回到同一个本地端口；
+#   - 不需要应答时发出即返回（reply_window 为 0）；需要应答时在 reply_window 秒内收集应答，
+#     单播目标收到第一个应答立即返回，一个数据报就是一帧，不需要分帧规则；
+#   - 目标为组播地址（224.0.0.0/4）、受限广播地址 255.255.255.255，或调用方声明为广播（设备档案 broadcast: true、
+#     命令行 --broadcast）时，一个数据报发往整组设备，在整个 reply_window 内收集所有设备的应答。
+#     子网定向广播（例如 192.168.3.255）不能只凭地址判断：在 /23 等更大的网段里它是普通主机，因此需要显式声明。
+#
+# UDP 没有连接，发送几乎不会失败，因此 UDP 目标不经过熔断器（device_health.py），也不用为每个数据报读写熔断状态文件。
+import select
+import socket
+import threading
+import time
+
+import trace_ring
+
+DEFAULT_REPLY_WINDOW = 0.2  # 等待应答的时间（秒）
+MULTICAST_TTL = 1           # 组播数据报的 TTL，默认不出本网段
+MAX_DATAGRAM = 65535
+
+
+def is_group_address(ip):
+    """
+    `ip` 是组播地址或受限广播地址 255.255.255.255 时返回 True。子网定向广播需要调用方传入 broadcast=True。
+    只识别 IPv4 点分地址；不导入 ipaddress，命令行每次启动可以少几毫秒。
+    """
+    parts = ip.split('.')
+    if len(parts) != 4 or not all(part.isdigit() for part in parts):
+        return False
+    return 224 <= int(parts[0]) <= 239 or ip == '255.255.255.255'
+
+
+class UdpSender:
+    """
+    按 (ip, port) 复用绑定好的 UDP socket。同一目标上的收发按到达顺序串行（应答不会被下一次收发读走），
+    不同目标之间互不阻塞。
+    """
+
+    def __init__(self, multicast_ttl=MULTICAST_TTL):
+        self.multicast_ttl = multicast_ttl
+        self._sockets = {}          # (ip, port) -> (socket, 解析后的目标地址)
+        self._locks = {}            # (ip, port) -> threading.Lock
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicast_ttl)
+            sock.bind(('', 0))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    @staticmethod
+    def _drain(sock):
+        """丢弃上一次收发之后才到达的迟到应答。"""
+        while True:
+            try:
+                sock.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, ConnectionRefusedError):
+                return
+
+    def exchange(self, ip, port, data, read_response=True, reply_window=DEFAULT_REPLY_WINDOW, broadcast=False):
+        """
+        向 (ip, port) 发送一个数据报，并可选地在 `reply_window` 秒内收集应答。
+        `broadcast` 为 True 表示目标是子网定向广播地址，按组目标收集所有设备的应答。
+        设置了 HA_TRANSPORT_TRACE 时，收发的原始字节写入追踪文件（见 trace_ring.py）。
+
+        Returns:
+            list[tuple[str, bytes]]: 收到的应答 [(来源 "ip:port", 数据), ...]；单播目标最多一个。
+
+        Raises:
+            OSError: 目标无法解析或发送失败（例如网络不可达）。
+        """
+        key = (ip, int(port))
+        target = f"{ip}:{port}"
+        group = broadcast or is_group_address(ip)
+        with self._lock_for(key):
+            entry = self._sockets.get(key)
+            try:
+                if entry is None:
+                    # 目标可以写成主机名；只解析一次，之后用解析结果过滤应答的来源。
+                    # 先解析再打开 socket，解析失败时不会留下已绑定的 socket
+                    peer = socket.gethostbyname(ip)
+                    entry = self._sockets[key] = (self._open(), peer)
+                else:
+                    self._drain(entry[0])
+                sock, peer = entry
+                sock.sendto(data, (peer, key[1]))
+            except OSError as e:
+                trace_ring.record('udp', target, trace_ring.ERROR, e)
+                raise
+            sent_at = time.perf_counter()
+            trace_ring.record('udp', target, trace_ring.TX, data)
+            if not read_response or reply_window <= 0:
+                return []
+
+            replies = []
+            deadline = time.monotonic() + reply_window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                    break
+                try:
+                    reply, source = sock.recvfrom(MAX_DATAGRAM)
+                except BlockingIOError:
+                    continue
+                except ConnectionRefusedError:
+                    # 单播目标的端口不可达（ICMP），不会再有应答
+                    break
+                if not group and source[0] != peer:
+                    continue
+                trace_ring.record('udp', target, trace_ring.RX, reply, time.perf_counter() - sent_at)
+                replies.append((f"{source[0]}:{source[1]}", reply))
+                if not group:
+                    break
+            if not replies:
+                trace_ring.record('udp', target, trace_ring.RX, None, time.perf_counter() - sent_at)
+            return replies
+
+    def close_all(self):
+        with self._guard:
+            sockets, self._sockets = self._sockets, {}
+        for sock, _ in sockets.values():
+            sock.close()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_sender():
+    """进程内共用的 UdpSender（守护进程的命令转发和状态轮询共用同一组 socket）。"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = UdpSender()
+        return _shared
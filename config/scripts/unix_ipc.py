@@ -0,0 +1,86 @@
+# unix_ipc.py
+# 本地 Unix socket 上的 JSON 行协议：每个请求/响应都是一行 JSON。
+# 由常驻进程（TCP 连接池守护进程、串口代理等）和它们的轻量客户端共用。
+# 客户端（request）只用 _socket，json 在用到时才导入，供 fast_send.py 等需要快速启动的入口使用。
+import os
+
+
+def _server_class():
+    # socketserver（连带 selectors、threading）只有守护进程需要，客户端不导入
+    import json
+    import socketserver
+
+    class JsonLineHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # 同一个连接上可以连续发送多个请求
+            for line in self.rfile:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    request = json.loads(line)
+                    reply = self.server.json_handler(request)
+                except Exception as e:
+                    reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+                self.wfile.flush()
+
+    class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    return ThreadingUnixServer, JsonLineHandler
+
+
+def serve(path, handler):
+    """
+    在 Unix socket `path` 上启动 JSON 行服务器，阻塞运行直到进程退出。
+
+    Args:
+        path: Unix socket 文件路径。如果文件已存在（上次异常退出残留）会先删除。
+        handler: 可调用对象，接收请求字典并返回响应字典。
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server_class, handler_class = _server_class()
+    server = server_class(path, handler_class)
+    server.json_handler = handler
+    os.chmod(path, 0o660)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def request(path, payload, timeout=10.0):
+    """
+    向 `path` 上的守护进程发送一个请求并等待响应。
+
+    如果守护进程没有运行，会抛出 OSError（FileNotFoundError / ConnectionRefusedError），
+    调用方据此回退到直接发送。
+
+    Raises:
+        ConnectionError: 守护进程没有返回数据，或返回的不是完整的一行 JSON（例如中途退出）。
+    """
+    import _socket
+    import json
+    s = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+        buffer = b''
+        while not buffer.endswith(b'\n'):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            buffer += chunk
+    finally:
+        s.close()
+    if not buffer:
+        raise ConnectionError("守护进程未返回任何数据。")
+    try:
+        return json.loads(buffer)
+    except ValueError as e:
+        raise ConnectionError(f"守护进程返回了无效的响应: {e}") from None
@@ -13,6 +13,78 @@ const FALLBACK_PATH_DATA = "M18.677,15.975 C17.922,16.509 17.489,17.269 17.489,1
 // --- 改进点: 简单的内存缓存用于已加载的 SVG 数据 ---
 const svgCache = {};
 
+// --- 雪碧图: 由 scripts/build_svg_sprite.py 把 svg 目录打包成一个 JSON 文件 ---
+// 清单 svg-sprite.json 记录当前雪碧图的内容哈希和文件名；雪碧图本身按哈希命名，内容不变则 URL 不变。
+// 雪碧图保存在 localStorage 中，看板刷新后立即可用，同时在后台用清单重新验证，哈希变化时才重新下载。
+// 雪碧图中没有的图标（例如新加入 svg 目录但尚未重新打包）仍按原方式单独请求。
+const SPRITE_MANIFEST_URL = "/local/svg-sprite.json";
+const SPRITE_FORMAT = 1; // 与 build_svg_sprite.py 的 SPRITE_FORMAT 对应
+const SPRITE_STORAGE_KEY = `customIconsets.${NAMESPACE}.sprite`;
+
+/**
+ * 读取 localStorage 中缓存的雪碧图。格式不符或无法读取时返回 null。
+ */
+function readStoredSprite() {
+    try {
+        const sprite = JSON.parse(localStorage.getItem(SPRITE_STORAGE_KEY));
+        return sprite && sprite.format === SPRITE_FORMAT && sprite.icons ? sprite : null;
+    } catch (error) {
+        return null;
+    }
+}
+
+/**
+ * 用清单重新验证雪碧图：哈希与缓存一致时直接使用缓存，否则下载新的雪碧图并写入 localStorage。
+ *
+ * @param {object|null} stored - localStorage 中缓存的雪碧图。
+ * @returns {Promise<object>} - 最新的雪碧图。
+ */
+async function revalidateSprite(stored) {
+    // 清单很小，每次启动都向服务器确认（no-cache），雪碧图本身允许浏览器缓存
+    const manifestResponse = await fetch(SPRITE_MANIFEST_URL, { cache: "no-cache" });
+    if (!manifestResponse.ok) {
+        throw new Error(`${SPRITE_MANIFEST_URL}: ${manifestResponse.status} ${manifestResponse.statusText}`);
+    }
+    const manifest = await manifestResponse.json();
+    if (stored && stored.hash === manifest.hash) {
+        return stored;
+    }
+    const spriteResponse = await fetch(`/local/${manifest.file}`);
+    if (!spriteResponse.ok) {
+        throw new Error(`/local/${manifest.file}: ${spriteResponse.status} ${spriteResponse.statusText}`);
+    }
+    const sprite = await spriteResponse.json();
+    if (sprite.format !== SPRITE_FORMAT || sprite.hash !== manifest.hash || !sprite.icons) {
+        throw new Error(`/local/${manifest.file}: 雪碧图格式或哈希与清单不一致`);
+    }
+    try {
+        localStorage.setItem(SPRITE_STORAGE_KEY, JSON.stringify(sprite));
+    } catch (error) {
+        // 存储空间不足或被禁用时只影响下一次启动
+        console.warn(`[CustomIconsets] Warning: unable to cache SVG sprite in localStorage:`, error);
+    }
+    return sprite;
+}
+
+let sprite = readStoredSprite();
+const spriteReady = revalidateSprite(sprite)
+    .then((latest) => {
+        sprite = latest;
+        return latest;
+    })
+    .catch((error) => {
+        console.warn(`[CustomIconsets] Warning: SVG sprite unavailable, falling back to per-file loading:`, error);
+        return sprite;
+    });
+
+/**
+ * 从雪碧图中取出图标，不存在时返回 null。
+ */
+function iconFromSprite(name) {
+    const icon = sprite && sprite.icons[name];
+    return icon ? { path: icon.path, viewBox: icon.viewBox || DEFAULT_VIEWBOX } : null;
+}
+
 /**
  * 加载并解析本地服务器上的 SVG 文件。
  * 提取第一个 <path> 元素的 'd' 属性和 <svg> 元素的 'viewBox' 属性。
@@ -83,11 +155,25 @@ async function loadFile(path) {
 /**
  * 用于 window.customIconsets 的图标获取函数。
  * 这是 Home Assistant (Lovelace) 将调用的函数，用于获取图标数据。
+ * 优先从雪碧图中获取（localStorage 中有缓存时不需要等待网络），雪碧图中没有的图标单独请求。
  *
  * @param {string} name - 图标名称 (例如, "my_icon")。
  * @returns {Promise<{path: string, viewBox: string}>} - 包含 SVG 路径和 viewBox 的对象。
  */
 async function getIcon(name) {
+    if (svgCache[name]) {
+        return svgCache[name];
+    }
+    let icon = iconFromSprite(name);
+    if (!icon) {
+        // 首次启动（没有缓存）或缓存的雪碧图较旧：等待重新验证完成后再查一次
+        await spriteReady;
+        icon = iconFromSprite(name);
+    }
+    if (icon) {
+        svgCache[name] = icon;
+        return icon;
+    }
     return await loadFile(name);
 }
 
@@ -97,4 +183,6 @@ window.customIconsets = window.customIconsets || {};
 window.customIconsets[NAMESPACE] = getIcon;
 
 // 改进点: 初始化时输出信息，方便调试
-console.info(`[CustomIconsets] Custom iconset '${NAMESPACE}' initialized. SVG files expected in /local${SVG_FOLDER_LOCATION}/`);
+console.info(`[CustomIconsets] Custom iconset '${NAMESPACE}' initialized. SVG sprite: ${SPRITE_MANIFEST_URL}` +
+    (sprite ? ` (cached, ${Object.keys(sprite.icons).length} icons)` : "") +
+    `, fallback SVG files expected in /local${SVG_FOLDER_LOCATION}/`);